@@ -0,0 +1,93 @@
+"""
+Benchmark the image preprocessing pipeline
+
+Renders synthetic desktop screenshots at common resolutions and reports the
+bytes saved and the time spent per image for each output format.
+
+    python benchmarks/bench_images.py --max-edge 1568 --quality 85
+"""
+
+import argparse
+import asyncio
+import base64
+import io
+import random
+import statistics
+import time
+
+from PIL import Image, ImageDraw
+
+from testdriver_proxy.config import Config
+from testdriver_proxy.images import ImagePipeline, ImageStore
+
+SIZES = [(1280, 720), (1920, 1080), (2560, 1440), (3840, 2160)]
+FORMATS = ["jpeg", "webp", "png"]
+
+
+def render_screenshot(width: int, height: int, seed: int = 0) -> bytes:
+    """Draw a UI-like screenshot: title bar, sidebar, text rows, buttons and a photo"""
+    rng = random.Random(seed)
+    image = Image.new("RGB", (width, height), (245, 246, 248))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, width, 40), fill=(32, 33, 36))
+    draw.rectangle((0, 40, width // 5, height), fill=(230, 232, 236))
+    for row in range(60, height - 40, 28):
+        x = width // 5 + 24
+        draw.text((x, row), "Lorem ipsum dolor sit amet " * rng.randint(1, 4), fill=(20, 20, 20))
+    for _ in range(12):
+        x, y = rng.randrange(width - 160), rng.randrange(40, height - 40)
+        draw.rounded_rectangle((x, y, x + 140, y + 32), radius=6, fill=(26, 115, 232))
+    # A noisy region stands in for photos and video frames
+    photo_w, photo_h = width // 4, height // 4
+    photo = Image.frombytes("RGB", (photo_w, photo_h), rng.randbytes(photo_w * photo_h * 3))
+    image.paste(photo, (width - photo_w - 40, height - photo_h - 40))
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+async def measure(pipeline: ImagePipeline, png: bytes, repeat: int) -> tuple[float, int]:
+    """Median latency in ms and output size in bytes for one screenshot"""
+    timings = []
+    output = 0
+    data = base64.b64encode(png).decode("ascii")
+    for _ in range(repeat):
+        # A fresh store per run so every iteration does the full work
+        pipeline.store = ImageStore(Config())
+        part = {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{data}"}}
+        started = time.perf_counter()
+        block = await pipeline.process_part(part)
+        timings.append((time.perf_counter() - started) * 1000)
+        output = len(base64.b64decode(block["source"]["data"]))
+    return statistics.median(timings), output
+
+
+async def run(args: argparse.Namespace) -> None:
+    print(f"max_edge={args.max_edge} quality={args.quality} repeat={args.repeat}")
+    print(f"{'size':>10} {'format':>6} {'input KB':>9} {'output KB':>10} {'saved':>6} {'ms/image':>9}")
+    for width, height in SIZES:
+        png = render_screenshot(width, height)
+        for fmt in args.formats:
+            config = Config(image_max_edge=args.max_edge, image_format=fmt, image_quality=args.quality)
+            pipeline = ImagePipeline(config, ImageStore(config))
+            latency, output = await measure(pipeline, png, args.repeat)
+            pipeline.close()
+            saved = 1 - output / len(png)
+            print(
+                f"{width}x{height:<5} {fmt:>6} {len(png) / 1024:9.0f} {output / 1024:10.0f} "
+                f"{saved:6.0%} {latency:9.1f}"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-edge", type=int, default=1568)
+    parser.add_argument("--quality", type=int, default=85)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--formats", nargs="+", default=FORMATS, choices=FORMATS)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
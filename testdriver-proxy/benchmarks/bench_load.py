@@ -0,0 +1,184 @@
+"""
+End-to-end load benchmark against a local mock upstream
+
+Drives the app from ``create_app`` in-process at a fixed concurrency, with
+its upstream calls answered by ``mock_upstream.MockUpstream``, for
+non-streaming and streaming chat completions with and without screenshots.
+Every scenario is also run straight against the mock with the equivalent
+Anthropic request. The difference between the two is what the proxy adds:
+latency percentiles, and CPU per request, since the load generator and the
+mock share the process in both runs.
+
+Proxy settings come from the environment like the server's (e.g.
+``SINGLE_PASS_PARSING=true``), except for the upstream URL and HTTP/2.
+Logging defaults to errors only, so injected errors do not flood the output.
+
+    python benchmarks/bench_load.py --concurrency 32 --requests 400 --ttfb 0.05 --tokens-per-second 500
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import resource
+import time
+from dataclasses import replace
+from typing import Any, Callable, Dict, List, Tuple
+
+import httpx
+
+from mock_upstream import MockUpstream, add_arguments, settings_from
+from testdriver_proxy.config import Config
+from testdriver_proxy.main import setup_logging
+from testdriver_proxy.proxy import create_app
+
+
+def screenshot(index: int, kb: int) -> str:
+    # Random bytes do not compress, like real screenshots after PNG encoding
+    return base64.b64encode(index.to_bytes(4, "big") + os.urandom(kb * 1024)).decode()
+
+
+def build_body(index: int, stream: bool, screenshots: List[str], anthropic: bool = False) -> bytes:
+    """An OpenAI request for the proxy, or the Anthropic request it becomes"""
+    prompt = f"Request {index}: which element should be clicked next?"
+    content: Any = prompt
+    if screenshots and anthropic:
+        content = [{"type": "text", "text": prompt}] + [
+            {"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": data}}
+            for data in screenshots
+        ]
+    elif screenshots:
+        content = [{"type": "text", "text": prompt}] + [
+            {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{data}"}}
+            for data in screenshots
+        ]
+    body = {
+        "model": "glm-4.5v" if screenshots else "glm-4.5",
+        "messages": [{"role": "user", "content": content}],
+        "stream": stream,
+    }
+    if anthropic:
+        body["max_tokens"] = 2000
+    return json.dumps(body).encode()
+
+
+async def drive(
+    send: Callable[[int], Any], requests: int, concurrency: int
+) -> Tuple[List[float], int, float, float]:
+    """Latencies of successful requests, failures, wall and CPU seconds"""
+    latencies: List[float] = []
+    failures = 0
+    next_index = 0
+
+    async def user() -> None:
+        nonlocal next_index, failures
+        while next_index < requests:
+            index = next_index
+            next_index += 1
+            started = time.perf_counter()
+            if await send(index):
+                latencies.append(time.perf_counter() - started)
+            else:
+                failures += 1
+
+    cpu_started, wall_started = time.process_time(), time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return latencies, failures, time.perf_counter() - wall_started, time.process_time() - cpu_started
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except OSError:
+        # Peak rather than current outside Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+
+async def scenario(args, stream: bool, screenshots: List[str]) -> Dict[str, float]:
+    mock = MockUpstream(settings_from(args))
+    config = replace(
+        Config.from_env(),
+        zai_api_key="bench",
+        zai_base_url="http://mock",
+        http2=False,
+        log_requests=False,
+        pool_max_connections=max(100, args.concurrency),
+        pool_max_keepalive=max(20, args.concurrency),
+    )
+    app = create_app(config, httpx.ASGITransport(app=mock))
+    headers = {"content-type": "application/json"}
+
+    async with (
+        httpx.AsyncClient(transport=httpx.ASGITransport(app=mock), base_url="http://mock", headers=headers) as direct,
+        httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://proxy", headers=headers) as proxied,
+    ):
+        # Bodies are built per request, in both runs, so their cost cancels out
+        async def send_direct(index: int) -> bool:
+            body = build_body(index, stream, screenshots, anthropic=True)
+            response = await direct.post("/v1/messages", content=body)
+            return response.status_code == 200
+
+        async def send_proxied(index: int) -> bool:
+            body = build_body(index, stream, screenshots)
+            response = await proxied.post("/v1/chat/completions", content=body)
+            return response.status_code == 200 and (not stream or response.text.endswith("[DONE]\n\n"))
+
+        await drive(send_proxied, min(args.requests, args.concurrency), args.concurrency)  # Warm up
+        base, _, _, base_cpu = await drive(send_direct, args.requests, args.concurrency)
+        latencies, failures, wall, cpu = await drive(send_proxied, args.requests, args.concurrency)
+
+    await app.state.proxy.aclose()
+    completed = max(1, len(latencies))
+    return {
+        "rps": len(latencies) / wall,
+        "p50": (percentile(latencies, 0.50) - percentile(base, 0.50)) * 1e3,
+        "p95": (percentile(latencies, 0.95) - percentile(base, 0.95)) * 1e3,
+        "p99": (percentile(latencies, 0.99) - percentile(base, 0.99)) * 1e3,
+        "cpu": (cpu / completed - base_cpu / max(1, len(base))) * 1e3,
+        "rss": rss_mb(),
+        "failures": failures,
+    }
+
+
+async def run(args) -> None:
+    images = [screenshot(i, args.screenshot_kb) for i in range(args.screenshots)]
+    print(
+        f"concurrency {args.concurrency}, {args.requests} requests per scenario, "
+        f"ttfb {args.ttfb * 1e3:g} ms, {args.output_tokens} output tokens"
+        + (f" at {args.tokens_per_second:g}/s" if args.tokens_per_second else "")
+    )
+    print(
+        f"{'path':>10} {'images':>6} {'req/s':>8} {'+p50 ms':>8} {'+p95 ms':>8} {'+p99 ms':>8} "
+        f"{'cpu ms/req':>10} {'rss MB':>7} {'failed':>6}"
+    )
+    for stream in (False, True):
+        for screenshots in ([], images) if images else ([],):
+            result = await scenario(args, stream, screenshots)
+            print(
+                f"{'stream' if stream else 'non-stream':>10} {len(screenshots):>6} {result['rps']:8.0f} "
+                f"{result['p50']:8.2f} {result['p95']:8.2f} {result['p99']:8.2f} "
+                f"{result['cpu']:10.3f} {result['rss']:7.0f} {result['failures']:>6}"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=400, help="requests per scenario")
+    parser.add_argument("--screenshots", type=int, default=2, help="screenshots per request with images")
+    parser.add_argument("--screenshot-kb", type=int, default=512)
+    add_arguments(parser)
+    args = parser.parse_args()
+    setup_logging(os.getenv("LOG_LEVEL", "ERROR"))
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
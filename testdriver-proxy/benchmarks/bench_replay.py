@@ -0,0 +1,231 @@
+"""
+Replay captured traffic against the proxy and a local mock upstream
+
+Reads one or more files written by a proxy run with ``TRAFFIC_CAPTURE_PATH``
+set and, for every record, sends a synthetic request of the same shape at
+its recorded arrival time divided by ``--speed``: the same model, stream
+flag, number of messages, screenshot count and sizes, and body size. The
+mock upstream answers each request with the recorded time to first token,
+duration and output tokens, so the proxy sees the bursts, long histories and
+mix of vision and text requests of the captured workload. ``--speed 10``
+offers ten times the recorded load; ``--scale-upstream`` also shortens the
+upstream timings by the same factor, replaying the whole capture faster.
+
+Proxy settings come from the environment like the server's, except for the
+upstream URL, HTTP/2 and capture itself.
+
+    python benchmarks/bench_replay.py capture.*.jsonl --speed 10
+    python benchmarks/bench_replay.py capture.*.jsonl --speed 4 --limit 5000
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import re
+import time
+from dataclasses import replace
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from mock_upstream import MockSettings, MockUpstream
+from testdriver_proxy.capture import read_capture
+from testdriver_proxy.config import Config
+from testdriver_proxy.main import setup_logging
+from testdriver_proxy.proxy import create_app
+
+TAG = re.compile(rb"\[replay (\d+)\]")
+FILLER = "The page shows the checkout form with the card number field focused. "
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+class Replay:
+    """Synthetic requests and mock upstream timings for a capture"""
+
+    def __init__(self, records: List[Dict[str, Any]], args):
+        self.records = records
+        self.upstream_speed = args.speed if args.scale_upstream else 1.0
+        self.chunk_tokens = args.chunk_tokens
+        self._random = random.Random(args.seed)
+        self._screenshots: Dict[Tuple[int, int], str] = {}
+
+    def screenshot(self, size: int, slot: int) -> str:
+        """Base64 data of about ``size`` characters, shared by requests with a screenshot this size"""
+        size = max(8, size // 4096 * 4096)
+        key = (size, slot)
+        if key not in self._screenshots:
+            self._screenshots[key] = base64.b64encode(self._random.randbytes(size * 3 // 4)).decode()
+        return self._screenshots[key]
+
+    def body(self, index: int) -> bytes:
+        """A request shaped like record ``index``, tagged so the mock can find its timings.
+
+        Earlier screenshots repeat across requests, like an agent's history;
+        the last one is unique to the request, like the step's new screenshot.
+        """
+        record = self.records[index]
+        count = max(1, record["messages"])
+        images = record["images"]
+        image_size = record["image_bytes"] // images if images else 0
+        # What is left of the body once the screenshots are accounted for
+        text_size = max(0, (record["request_bytes"] or 0) - record["image_bytes"] - 100 * count - 200)
+        filler = (FILLER * (text_size // count // len(FILLER) + 1))[:text_size // count]
+
+        messages: List[Dict[str, Any]] = []
+        for position in range(count):
+            # Roles alternate, ending with the user
+            role = "user" if (count - position) % 2 else "assistant"
+            messages.append({"role": role, "content": f"[replay {index}] {filler}" if position == 0 else filler})
+        if images:
+            parts: List[Dict[str, Any]] = [{"type": "text", "text": messages[-1]["content"]}]
+            for slot in range(images):
+                data = self.screenshot(image_size - 22, slot)
+                if slot == images - 1:
+                    data = f"{index:08d}" + data[8:]
+                parts.append({"type": "image_url", "image_url": {"url": f"data:image/png;base64,{data}"}})
+            messages[-1]["content"] = parts
+
+        body: Dict[str, Any] = {"model": record["model"], "messages": messages, "stream": record["stream"]}
+        if record.get("max_tokens"):
+            body["max_tokens"] = record["max_tokens"]
+        return json.dumps(body).encode()
+
+    def plan(self, body: bytes) -> Optional[MockSettings]:
+        """Mock upstream settings reproducing the recorded timings of a tagged request"""
+        match = TAG.search(body)
+        if match is None:
+            return None
+        record = self.records[int(match.group(1))]
+        duration = record["duration"] / self.upstream_speed
+        output_tokens = record["output_tokens"] or 0
+        if record["stream"] and record["ttft"] is not None:
+            # The mock sends tokens right after its headers
+            ttfb = record["ttft"] / self.upstream_speed
+            generating = duration - ttfb
+            rate = output_tokens / generating if output_tokens and generating > 0 else 0.0
+        elif record["ttfb"] is not None:
+            ttfb, rate = record["ttfb"] / self.upstream_speed, 0.0
+        else:
+            ttfb, rate = duration, 0.0
+        return MockSettings(
+            ttfb=ttfb, tokens_per_second=rate, output_tokens=output_tokens, chunk_tokens=self.chunk_tokens
+        )
+
+
+async def run(args) -> None:
+    records = read_capture(args.captures)[:args.limit or None]
+    if not records:
+        raise SystemExit("no records in the capture")
+    replay = Replay(records, args)
+    config = replace(
+        Config.from_env(),
+        zai_api_key="bench",
+        zai_base_url="http://mock",
+        http2=False,
+        log_requests=False,
+        traffic_capture_path=None,
+        pool_max_connections=args.connections,
+        pool_max_keepalive=args.connections,
+    )
+    mock = MockUpstream(MockSettings(), replay.plan)
+    app = create_app(config, httpx.ASGITransport(app=mock))
+
+    results: List[Optional[Tuple[float, Optional[float], int]]] = [None] * len(records)
+    in_flight = peak = 0
+
+    async def send(client: httpx.AsyncClient, index: int) -> None:
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        started = time.perf_counter()
+        first_token = None
+        try:
+            async with client.stream("POST", "/v1/chat/completions", content=replay.body(index)) as response:
+                async for text in response.aiter_text():
+                    if first_token is None and records[index]["stream"] and '"content":' in text:
+                        first_token = time.perf_counter() - started
+            results[index] = (time.perf_counter() - started, first_token, response.status_code)
+        except httpx.HTTPError:
+            results[index] = (time.perf_counter() - started, None, 0)
+        finally:
+            in_flight -= 1
+
+    lags: List[float] = []
+    timeout = httpx.Timeout(config.timeout * 2)
+    headers = {"content-type": "application/json"}
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://proxy", headers=headers, timeout=timeout
+    ) as client:
+        tasks = []
+        started = time.perf_counter()
+        for index, record in enumerate(records):
+            delay = record["t"] / args.speed - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            lags.append(max(0.0, -delay))
+            tasks.append(asyncio.create_task(send(client, index)))
+        await asyncio.gather(*tasks)
+        wall = time.perf_counter() - started
+    await app.state.proxy.aclose()
+
+    span = records[-1]["t"] or 1e-9
+    print(
+        f"{len(records)} requests over {span:.1f} s recorded, replayed at {args.speed:g}x "
+        f"({len(records) / (span / args.speed):.1f} req/s offered) in {wall:.1f} s; "
+        f"peak {peak} in flight, p99 dispatch lag {percentile(lags, 0.99) * 1e3:.1f} ms"
+    )
+    print(
+        f"{'class':<18} {'requests':>8} {'failed':>12} {'p50 ms':>15} {'p95 ms':>15} "
+        f"{'p99 ms':>15} {'ttft p50 ms':>15}"
+    )
+    print(f"{'':<18} {'':>8} {'rec / rep':>12}" + f" {'rec / rep':>15}" * 4)
+    classes: Dict[str, List[int]] = {}
+    for index, record in enumerate(records):
+        name = f"{'stream' if record['stream'] else 'non-stream'} {'vision' if record['images'] else 'text'}"
+        classes.setdefault(name, []).append(index)
+        classes.setdefault("all", []).append(index)
+    for name, indexes in sorted(classes.items(), key=lambda item: item[0] == "all"):
+        scale = replay.upstream_speed
+        recorded = [records[i]["duration"] / scale for i in indexes]
+        replayed = [results[i][0] for i in indexes]
+        recorded_ttft = [records[i]["ttft"] / scale for i in indexes if records[i]["ttft"] is not None]
+        replayed_ttft = [results[i][1] for i in indexes if results[i][1] is not None]
+        recorded_failed = sum(1 for i in indexes if records[i]["status"] != 200)
+        replayed_failed = sum(1 for i in indexes if results[i][2] != 200)
+
+        def pair(a: List[float], b: List[float], fraction: float) -> str:
+            return f"{percentile(a, fraction) * 1e3:.0f} / {percentile(b, fraction) * 1e3:.0f}"
+
+        print(
+            f"{name:<18} {len(indexes):>8} {f'{recorded_failed} / {replayed_failed}':>12} "
+            f"{pair(recorded, replayed, 0.50):>15} {pair(recorded, replayed, 0.95):>15} "
+            f"{pair(recorded, replayed, 0.99):>15} "
+            f"{pair(recorded_ttft, replayed_ttft, 0.50) if recorded_ttft else '':>15}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("captures", nargs="+", help="capture files; several workers' files are merged")
+    parser.add_argument("--speed", type=float, default=1.0, help="divides the time between arrivals")
+    parser.add_argument("--scale-upstream", action="store_true", help="also divide upstream timings by --speed")
+    parser.add_argument("--limit", type=int, default=0, help="replay only the first N requests")
+    parser.add_argument("--connections", type=int, default=100, help="upstream pool size")
+    parser.add_argument("--chunk-tokens", type=int, default=4, help="tokens per mock stream event")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.speed <= 0:
+        parser.error("--speed must be positive")
+    setup_logging(os.getenv("LOG_LEVEL", "ERROR"))
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
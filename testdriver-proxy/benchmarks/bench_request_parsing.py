@@ -0,0 +1,72 @@
+"""
+Benchmark request parsing for screenshot-heavy chat completions
+
+Compares what FastAPI does for a declared body model (``json.loads`` followed
+by ``ChatCompletionRequest.model_validate``) with single-pass parsing
+enabled by ``SINGLE_PASS_PARSING`` (``parse_chat_request``), reporting time
+and peak traced memory per request.
+
+    python benchmarks/bench_request_parsing.py --screenshots 8 --screenshot-kb 1024
+"""
+
+import argparse
+import base64
+import json
+import os
+import time
+import tracemalloc
+
+from testdriver_proxy.fastpath import parse_chat_request
+from testdriver_proxy.models import ChatCompletionRequest
+
+
+def build_body(screenshots: int, screenshot_kb: int) -> bytes:
+    messages = [{"role": "system", "content": "You are a UI testing agent"}]
+    for turn in range(screenshots):
+        image = base64.b64encode(os.urandom(screenshot_kb * 1024)).decode()
+        messages.append({
+            "role": "user",
+            "content": [
+                {"type": "text", "text": f"Step {turn}: what should I click?"},
+                {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image}"}},
+            ],
+        })
+        messages.append({"role": "assistant", "content": '{"action": "click", "x": 10, "y": 20}'})
+    return json.dumps({"model": "glm-4.5v", "temperature": 0, "messages": messages}).encode()
+
+
+def validated(body: bytes) -> ChatCompletionRequest:
+    return ChatCompletionRequest.model_validate(json.loads(body))
+
+
+def measure(fn, body: bytes, iterations: int):
+    """Best seconds per call and peak traced bytes"""
+    best = float("inf")
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn(body)
+        best = min(best, time.perf_counter() - started)
+    tracemalloc.start()
+    fn(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--screenshots", type=int, default=8)
+    parser.add_argument("--screenshot-kb", type=int, default=1024)
+    parser.add_argument("--iterations", type=int, default=10)
+    args = parser.parse_args()
+
+    body = build_body(args.screenshots, args.screenshot_kb)
+    print(f"body: {len(body) / 1e6:.1f} MB, {args.screenshots} screenshots")
+    print(f"{'parser':>11} {'ms/request':>11} {'peak MB':>8}")
+    for name, fn in (("two pass", validated), ("single pass", parse_chat_request)):
+        seconds, peak = measure(fn, body, args.iterations)
+        print(f"{name:>11} {seconds * 1e3:11.2f} {peak / 1e6:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
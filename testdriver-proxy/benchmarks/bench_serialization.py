@@ -0,0 +1,122 @@
+"""
+Benchmark per-response serialization overhead
+
+Compares the previous path (validated pydantic models, FastAPI's
+``jsonable_encoder`` and ``json.dumps``) with the current one
+(``model_construct`` and pydantic-core / orjson straight to bytes), for a
+non-streaming response and for a single streaming chunk.
+
+    python benchmarks/bench_serialization.py --iterations 20000
+"""
+
+import argparse
+import json
+import time
+
+from fastapi.encoders import jsonable_encoder
+
+from testdriver_proxy.cache import Completion
+from testdriver_proxy.config import Config
+from testdriver_proxy.models import (
+    ChatCompletionChunk,
+    ChatCompletionRequest,
+    ChatCompletionResponse,
+    Choice,
+    Message,
+    StreamChoice,
+    Usage,
+)
+from testdriver_proxy.proxy import ZAIProxy
+from testdriver_proxy.serialization import FastJSONResponse, orjson
+from testdriver_proxy.sse import ChunkEncoder
+
+COMPLETION = Completion(
+    id="chatcmpl-msg_01",
+    content='{"action": "click", "x": 512, "y": 384, "reason": "Submit button"}' * 8,
+    finish_reason="stop",
+    prompt_tokens=5400,
+    completion_tokens=180,
+)
+REQUEST = ChatCompletionRequest(model="glm-4.5v", messages=[Message(role="user", content="Hi")])
+
+
+def legacy_response() -> bytes:
+    response = ChatCompletionResponse(
+        id=COMPLETION.id,
+        created=int(time.time()),
+        model=REQUEST.model,
+        choices=[
+            Choice(
+                index=0,
+                message=Message(role="assistant", content=COMPLETION.content),
+                finish_reason=COMPLETION.finish_reason,
+            )
+        ],
+        usage=Usage(
+            prompt_tokens=COMPLETION.prompt_tokens,
+            completion_tokens=COMPLETION.completion_tokens,
+            total_tokens=COMPLETION.prompt_tokens + COMPLETION.completion_tokens,
+        ),
+    )
+    content = jsonable_encoder(response)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def make_current_response():
+    proxy = ZAIProxy(Config())
+
+    def current_response() -> bytes:
+        return FastJSONResponse(content=proxy._build_response(REQUEST, COMPLETION)).body
+
+    return current_response
+
+
+def legacy_chunk() -> str:
+    chunk = ChatCompletionChunk(
+        id=COMPLETION.id,
+        created=int(time.time()),
+        model=REQUEST.model,
+        choices=[StreamChoice(index=0, delta={"content": " token"}, finish_reason=None)],
+    )
+    return f"data: {chunk.model_dump_json()}\n\n"
+
+
+def make_current_chunk():
+    encoder = ChunkEncoder(COMPLETION.id, REQUEST.model)
+
+    def current_chunk() -> str:
+        return encoder.content(" token")
+
+    return current_chunk
+
+
+def measure(fn, iterations: int) -> float:
+    """Best per-call time in microseconds over three runs"""
+    best = float("inf")
+    for _ in range(3):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        best = min(best, time.perf_counter() - started)
+    return best / iterations * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"orjson: {'yes' if orjson is not None else 'no'}, iterations: {args.iterations}")
+    print(f"{'case':>10} {'legacy us':>10} {'current us':>11} {'speedup':>8}")
+    cases = [
+        ("response", legacy_response, make_current_response()),
+        ("chunk", legacy_chunk, make_current_chunk()),
+    ]
+    for name, legacy, current in cases:
+        before = measure(legacy, args.iterations)
+        after = measure(current, args.iterations)
+        print(f"{name:>10} {before:10.2f} {after:11.2f} {before / after:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Benchmark the streaming translation loop
+
+Feeds a recorded-shape Anthropic SSE stream through the previous line-based
+translator (``aiter_lines`` + pydantic chunk per event) and the current
+byte-level translator, and reports events per second on one core.
+
+    python benchmarks/bench_sse.py --events 10000 --chunk-size 4096
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+from testdriver_proxy.models import ChatCompletionChunk, StreamChoice
+from testdriver_proxy.sse import FINISH_REASON_MAP, SSEParser, StreamTranslator
+
+
+def build_stream(events: int) -> bytes:
+    """Anthropic SSE body with ``events`` text deltas"""
+    body = [
+        {"type": "message_start", "message": {"id": "msg_1", "usage": {"input_tokens": 1200}}},
+        {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}},
+    ]
+    for i in range(events):
+        body.append({
+            "type": "content_block_delta",
+            "index": 0,
+            "delta": {"type": "text_delta", "text": f" token{i % 97}"},
+        })
+        if i % 100 == 0:
+            body.append({"type": "ping"})
+    body += [
+        {"type": "content_block_stop", "index": 0},
+        {"type": "message_delta", "delta": {"stop_reason": "end_turn"}, "usage": {"output_tokens": events}},
+        {"type": "message_stop"},
+    ]
+    return "".join(f"event: {e['type']}\ndata: {json.dumps(e)}\n\n" for e in body).encode()
+
+
+class FakeResponse:
+    """Replays a body in fixed-size network chunks"""
+
+    def __init__(self, body: bytes, chunk_size: int):
+        self.body = body
+        self.chunk_size = chunk_size
+
+    async def aiter_bytes(self):
+        for i in range(0, len(self.body), self.chunk_size):
+            yield self.body[i:i + self.chunk_size]
+
+    async def aiter_lines(self):
+        pending = ""
+        async for chunk in self.aiter_bytes():
+            lines = (pending + chunk.decode()).split("\n")
+            pending = lines.pop()
+            for line in lines:
+                yield line
+        if pending:
+            yield pending
+
+
+async def legacy_translate(response: FakeResponse, model: str):
+    """The translation loop as it was before the byte-level parser"""
+    chunk_id = f"chatcmpl-{uuid.uuid4().hex[:8]}"
+    async for line in response.aiter_lines():
+        if not line or line.strip() == "":
+            continue
+        if line.startswith("data: "):
+            line = line[6:]
+        if line.strip() == "[DONE]":
+            yield "data: [DONE]\n\n"
+            break
+        try:
+            if line.startswith("event: "):
+                continue
+            zai_chunk = json.loads(line)
+            event_type = zai_chunk.get("type")
+            delta = {}
+            finish_reason = None
+            if event_type == "content_block_start":
+                delta = {"role": "assistant", "content": ""}
+            elif event_type == "content_block_delta":
+                delta_data = zai_chunk.get("delta", {})
+                if delta_data.get("type") == "text_delta":
+                    delta = {"content": delta_data.get("text", "")}
+            elif event_type == "message_delta":
+                stop_reason = zai_chunk.get("delta", {}).get("stop_reason")
+                if stop_reason:
+                    finish_reason = FINISH_REASON_MAP.get(stop_reason, "stop")
+            elif event_type == "message_stop":
+                continue
+            chunk = ChatCompletionChunk(
+                id=chunk_id,
+                created=int(time.time()),
+                model=model,
+                choices=[StreamChoice(index=0, delta=delta, finish_reason=finish_reason)],
+            )
+            yield f"data: {chunk.model_dump_json()}\n\n"
+        except json.JSONDecodeError:
+            continue
+
+
+async def current_translate(response: FakeResponse, model: str):
+    """Same loop as ZAIProxy._translate_stream"""
+    parser = SSEParser()
+    translator = StreamTranslator(f"chatcmpl-{uuid.uuid4().hex[:8]}", model)
+    async for raw in response.aiter_bytes():
+        for event, data in parser.feed(raw):
+            frame = translator.feed(event, data)
+            if frame is not None:
+                yield frame
+            if translator.done:
+                return
+
+
+async def measure(translate, body: bytes, chunk_size: int, repeat: int) -> tuple[float, int]:
+    """Best wall time over ``repeat`` runs and the number of frames emitted"""
+    best = float("inf")
+    frames = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        frames = 0
+        async for _frame in translate(FakeResponse(body, chunk_size), "glm-4.5"):
+            frames += 1
+        best = min(best, time.perf_counter() - started)
+    return best, frames
+
+
+async def run(args: argparse.Namespace) -> None:
+    body = build_stream(args.events)
+    events = body.count(b"\n\n")
+    print(f"{events} upstream events, {len(body) / 1024:.0f} KB, chunk size {args.chunk_size} B")
+    print(f"{'translator':>10} {'seconds':>8} {'frames':>7} {'events/s':>10} {'us/event':>9}")
+    results = {}
+    for name, translate in (("legacy", legacy_translate), ("current", current_translate)):
+        seconds, frames = await measure(translate, body, args.chunk_size, args.repeat)
+        results[name] = seconds
+        print(f"{name:>10} {seconds:8.3f} {frames:7} {events / seconds:10.0f} {seconds / events * 1e6:9.2f}")
+    print(f"speedup: {results['legacy'] / results['current']:.1f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--chunk-size", type=int, default=4096)
+    parser.add_argument("--repeat", type=int, default=5)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+Microbenchmarks for the request and response translators
+
+Times the pure translation steps of a chat completion on realistic fixtures:
+``transform_request`` on a long agent history with 0, 1 and 10 screenshots,
+encoding the upstream body, mapping an Anthropic message to an OpenAI
+response, and translating a 10,000-event stream. Each case reports ns/op and
+the peak memory it allocates per op (traced with ``tracemalloc``; CPython
+has no per-allocation counter).
+
+Results are compared with ``baselines/translators.json``. ``--check`` exits
+non-zero when a case is slower or allocates more than the tolerance allows,
+so it can gate a deploy; ``--save`` records a new baseline. Times are
+normalized by a fixed pure-Python calibration loop run on the same machine,
+so a baseline recorded elsewhere still gives a usable comparison.
+
+    python benchmarks/bench_translators.py
+    python benchmarks/bench_translators.py --check --tolerance 0.25
+    python benchmarks/bench_translators.py --save
+"""
+
+import argparse
+import base64
+import json
+import os
+import platform
+import random
+import sys
+import timeit
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+from bench_sse import build_stream
+from testdriver_proxy.config import Config
+from testdriver_proxy.models import ChatCompletionRequest
+from testdriver_proxy.proxy import ZAIProxy
+from testdriver_proxy.serialization import FastJSONResponse, dumps
+from testdriver_proxy.sse import SSEParser, StreamTranslator
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "translators.json")
+
+# Memory is deterministic apart from allocator noise; time is not
+MEMORY_TOLERANCE = 0.10
+
+SYSTEM_PROMPT = (
+    "You are a UI testing agent. Given the current screenshot and the task, reply with the next "
+    "action as JSON: click, type, scroll, assert or done, with coordinates and a short reason. "
+) * 12
+
+
+def run_sync(coroutine: Any) -> Any:
+    """Run a coroutine that never suspends, without an event loop"""
+    try:
+        coroutine.send(None)
+    except StopIteration as e:
+        return e.value
+    coroutine.close()
+    raise RuntimeError("coroutine suspended")
+
+
+def agent_history(turns: int, screenshots: int, screenshot_kb: int) -> ChatCompletionRequest:
+    """A test run's conversation: screenshots attached to the last ``screenshots`` turns"""
+    rng = random.Random(turns * 1000 + screenshots)
+    messages: List[Dict[str, Any]] = [{"role": "system", "content": SYSTEM_PROMPT}]
+    for turn in range(turns):
+        content: Any = f"Step {turn}: the page shows the checkout form. What should I do next?"
+        if turn >= turns - screenshots:
+            image = base64.b64encode(rng.randbytes(screenshot_kb * 1024)).decode()
+            content = [
+                {"type": "text", "text": content},
+                {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image}"}},
+            ]
+        messages.append({"role": "user", "content": content})
+        action = {"action": "click", "x": rng.randrange(1920), "y": rng.randrange(1080), "reason": "Next field"}
+        messages.append({"role": "assistant", "content": json.dumps(action)})
+    return ChatCompletionRequest.model_validate(
+        {"model": "glm-4.5v", "temperature": 0.2, "max_tokens": 1024, "messages": messages}
+    )
+
+
+def build_cases(args) -> List[Tuple[str, Callable[[], Any]]]:
+    proxy = ZAIProxy(Config(http2=False))
+    cases: List[Tuple[str, Callable[[], Any]]] = []
+
+    for screenshots in (0, 1, 10):
+        request = agent_history(args.turns, screenshots, args.screenshot_kb)
+        cases.append((
+            f"transform_request/{args.turns}-turns/{screenshots}-screenshots",
+            lambda request=request: run_sync(proxy.transform_request(request)),
+        ))
+    zai_request = run_sync(proxy.transform_request(agent_history(args.turns, 10, args.screenshot_kb)))
+    cases.append((f"upstream_body/{args.turns}-turns/10-screenshots", lambda: dumps(zai_request)))
+
+    message = json.dumps({
+        "id": "msg_01",
+        "type": "message",
+        "role": "assistant",
+        "content": [{"type": "text", "text": json.dumps({"action": "type", "text": "4111 1111 1111 1111"}) * 4}],
+        "stop_reason": "end_turn",
+        "usage": {"input_tokens": 48000, "output_tokens": 120},
+    }).encode()
+    openai_request = agent_history(2, 0, 0)
+
+    def non_stream() -> bytes:
+        completion = proxy._parse_completion(json.loads(message))
+        return FastJSONResponse(content=proxy._build_response(openai_request, completion)).body
+
+    cases.append(("non_stream_response", non_stream))
+
+    stream = build_stream(args.events)
+    chunks = [stream[i:i + args.chunk_size] for i in range(0, len(stream), args.chunk_size)]
+
+    # Mirrors the loop in ZAIProxy._translate_stream
+    def translate() -> int:
+        parser = SSEParser()
+        translator = StreamTranslator("chatcmpl-bench", "glm-4.5")
+        frames = 0
+        for raw in chunks:
+            for event, data in parser.feed(raw):
+                if translator.feed(event, data) is not None:
+                    frames += 1
+        translator.completion()
+        return frames
+
+    cases.append((f"stream_translate/{args.events}-events", translate))
+    return cases
+
+
+def calibrate() -> float:
+    """Seconds for a fixed interpreter-bound workload"""
+    return min(timeit.repeat(lambda: sorted(str(i) for i in range(2000)), number=200, repeat=5)) / 200
+
+
+def measure(fn: Callable[[], Any], repeat: int) -> Tuple[float, int]:
+    """Best ns/op over ``repeat`` runs and the peak bytes one op allocates"""
+    fn()  # Warm caches, e.g. the image store
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    result = fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return best * 1e9, peak - before
+
+
+def load_baseline() -> Dict[str, Any]:
+    try:
+        with open(BASELINE_PATH) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=40, help="turns of agent history")
+    parser.add_argument("--screenshot-kb", type=int, default=256)
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--chunk-size", type=int, default=4096)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown for --check")
+    parser.add_argument("--check", action="store_true", help="exit 1 on a regression against the baseline")
+    parser.add_argument("--save", action="store_true", help="record the results as the new baseline")
+    args = parser.parse_args()
+
+    baseline = load_baseline()
+    cases = build_cases(args)
+    calibration = calibrate()
+    # Scales baseline times to this machine's speed
+    scale = calibration / baseline["calibration_s"] if baseline.get("calibration_s") else 1.0
+
+    print(f"python {platform.python_version()}, calibration {calibration * 1e6:.0f} us (x{scale:.2f} baseline)")
+    print(f"{'case':<44} {'ns/op':>14} {'peak KiB/op':>12} {'vs baseline':>12}")
+    results: Dict[str, Dict[str, float]] = {}
+    regressions = []
+    for name, fn in cases:
+        ns, peak = measure(fn, args.repeat)
+        results[name] = {"ns_per_op": round(ns), "peak_bytes_per_op": peak}
+
+        previous = baseline.get("cases", {}).get(name)
+        change = ""
+        if previous:
+            ratio = ns / (previous["ns_per_op"] * scale)
+            change = f"{(ratio - 1) * 100:+.1f}%"
+            if ratio > 1 + args.tolerance:
+                regressions.append(f"{name}: {change} time")
+            if peak > previous["peak_bytes_per_op"] * (1 + MEMORY_TOLERANCE) + 1024:
+                regressions.append(f"{name}: {peak / 1024:.0f} KiB peak vs {previous['peak_bytes_per_op'] / 1024:.0f}")
+        print(f"{name:<44} {ns:14,.0f} {peak / 1024:12,.1f} {change:>12}")
+
+    if args.save:
+        os.makedirs(os.path.dirname(BASELINE_PATH), exist_ok=True)
+        with open(BASELINE_PATH, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "calibration_s": calibration,
+                "cases": results,
+            }, f, indent=2)
+            f.write("\n")
+        print(f"baseline saved to {os.path.relpath(BASELINE_PATH)}")
+
+    if regressions:
+        print("regressions:\n  " + "\n  ".join(regressions))
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Benchmark proxy throughput with 1, 2, 4 and 8 worker processes
+
+Starts a minimal mock upstream, then for each worker count launches the
+proxy through its real entry point (``python -m testdriver_proxy.main`` with
+``WORKERS=N``) and drives non-streaming chat completions at it from several
+load generator processes.
+
+    python benchmarks/bench_workers.py --workers 1 2 4 8 --duration 10
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+UPSTREAM_BODY = json.dumps({
+    "id": "msg_bench",
+    "type": "message",
+    "role": "assistant",
+    "content": [{"type": "text", "text": "Click the submit button"}],
+    "stop_reason": "end_turn",
+    "usage": {"input_tokens": 120, "output_tokens": 6},
+}).encode()
+
+
+async def upstream_app(scope, receive, send):
+    """Raw ASGI app answering every request with a fixed Anthropic message"""
+    if scope["type"] != "http":
+        return
+    while (await receive()).get("more_body"):
+        pass
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"application/json")],
+    })
+    await send({"type": "http.response.body", "body": UPSTREAM_BODY})
+
+
+def run_upstream(port: int) -> None:
+    import uvicorn
+
+    uvicorn.run(upstream_app, host="127.0.0.1", port=port, log_level="warning", http="httptools")
+
+
+def wait_ready(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up")
+
+
+async def drive(url: str, concurrency: int, duration: float) -> list[float]:
+    latencies: list[float] = []
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=30.0) as client:
+        async def user(index: int) -> None:
+            turn = 0
+            while time.monotonic() < deadline:
+                # Distinct prompts so requests are neither cached nor coalesced
+                body = {
+                    "model": "glm-4.5",
+                    "temperature": 0.7,
+                    "messages": [{"role": "user", "content": f"user {index} turn {turn}"}],
+                }
+                started = time.perf_counter()
+                response = await client.post(url, json=body)
+                if response.status_code == 200:
+                    latencies.append(time.perf_counter() - started)
+                turn += 1
+
+        await asyncio.gather(*(user(i) for i in range(concurrency)))
+    return latencies
+
+
+def load_process(url: str, concurrency: int, duration: float, results) -> None:
+    results.put(asyncio.run(drive(url, concurrency, duration)))
+
+
+def measure(port: int, workers: int, args) -> tuple[float, float, float]:
+    env = {
+        **os.environ,
+        "PORT": str(port),
+        "HOST": "127.0.0.1",
+        "WORKERS": str(workers),
+        "ZAI_BASE_URL": f"http://127.0.0.1:{args.upstream_port}",
+        "ZAI_API_KEY": "bench",
+        "HTTP2": "false",
+        "LOG_LEVEL": "WARNING",
+        "LOG_REQUESTS": "false",
+    }
+    proxy = subprocess.Popen([sys.executable, "-m", "testdriver_proxy.main"], env=env)
+    try:
+        wait_ready(f"http://127.0.0.1:{port}/health")
+        time.sleep(1.0)  # let every worker finish booting
+
+        context = multiprocessing.get_context("spawn")
+        results = context.Queue()
+        url = f"http://127.0.0.1:{port}/v1/chat/completions"
+        loaders = [
+            context.Process(target=load_process, args=(url, args.concurrency, args.duration, results))
+            for _ in range(args.load_processes)
+        ]
+        for loader in loaders:
+            loader.start()
+        latencies = [latency for _ in loaders for latency in results.get()]
+        for loader in loaders:
+            loader.join()
+    finally:
+        proxy.terminate()
+        proxy.wait()
+
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1] if latencies else 0.0
+    return len(latencies) / args.duration, statistics.median(latencies) * 1e3, p99 * 1e3
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--concurrency", type=int, default=32, help="connections per load process")
+    parser.add_argument("--load-processes", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--upstream-port", type=int, default=8766)
+    args = parser.parse_args()
+
+    upstream = multiprocessing.get_context("spawn").Process(target=run_upstream, args=(args.upstream_port,))
+    upstream.start()
+    try:
+        wait_ready(f"http://127.0.0.1:{args.upstream_port}/")
+        print(f"cpus: {os.cpu_count()}, load: {args.load_processes} x {args.concurrency} connections")
+        print(f"{'workers':>8} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+        for workers in args.workers:
+            rps, p50, p99 = measure(args.port, workers, args)
+            print(f"{workers:>8} {rps:9.0f} {p50:8.2f} {p99:8.2f}")
+    finally:
+        upstream.terminate()
+        upstream.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Local mock of the Anthropic Messages API (``POST /v1/messages``)
+
+An ASGI app with a configurable time to first byte, token rate, tokens per
+stream chunk, response size and injected errors, for benchmarking the proxy
+without a network or an API key. ``bench_load.py`` mounts it in-process; it
+can also be served on its own and used as ``ZAI_BASE_URL`` for a running
+proxy:
+
+    python benchmarks/mock_upstream.py --port 9000 --ttfb 0.3 --tokens-per-second 60
+"""
+
+import argparse
+import asyncio
+import json
+import random
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+WORD = "click "  # One token's worth of text
+
+
+@dataclass
+class MockSettings:
+    """How the mock upstream behaves"""
+    ttfb: float = 0.05  # Seconds before the response headers
+    tokens_per_second: float = 0.0  # 0 sends every token at once
+    output_tokens: int = 64
+    chunk_tokens: int = 4  # Tokens per content_block_delta event
+    error_rate: float = 0.0  # Share of requests answered with error_status
+    error_status: int = 529
+    seed: int = 0
+
+
+class MockUpstream:
+    """ASGI app answering ``POST /v1/messages`` like the Anthropic API.
+
+    ``plan`` may choose settings per request from its body, e.g. to replay
+    the timings of recorded traffic; it returns None to use the defaults.
+    """
+
+    def __init__(self, settings: MockSettings, plan: Optional[Callable[[bytes], Optional[MockSettings]]] = None):
+        self.settings = settings
+        self.plan = plan
+        self.requests = 0
+        self.errors = 0
+        self.bytes_received = 0
+        self._random = random.Random(settings.seed)
+        self._text = WORD * settings.output_tokens
+
+    async def __call__(self, scope: Dict[str, Any], receive, send) -> None:
+        if scope["type"] == "lifespan":
+            while (await receive())["type"] != "lifespan.shutdown":
+                await send({"type": "lifespan.startup.complete"})
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+        body = bytearray()
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        self.requests += 1
+        self.bytes_received += len(body)
+
+        if scope["method"] != "POST" or not scope["path"].endswith("/v1/messages"):
+            await self._json(send, 404, {"type": "error", "error": {"type": "not_found_error"}})
+            return
+
+        settings = (self.plan and self.plan(bytes(body))) or self.settings
+        await asyncio.sleep(settings.ttfb)
+        if settings.error_rate and self._random.random() < settings.error_rate:
+            self.errors += 1
+            error = {"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}}
+            await self._json(send, settings.error_status, error)
+            return
+
+        input_tokens = len(body) // 4
+        text = self._text if settings is self.settings else WORD * settings.output_tokens
+        if json.loads(body).get("stream"):
+            await self._stream(send, input_tokens, settings, text)
+        else:
+            if settings.tokens_per_second:
+                await asyncio.sleep(settings.output_tokens / settings.tokens_per_second)
+            await self._json(send, 200, {
+                "id": f"msg_mock_{self.requests}",
+                "type": "message",
+                "role": "assistant",
+                "content": [{"type": "text", "text": text}],
+                "stop_reason": "end_turn",
+                "usage": {"input_tokens": input_tokens, "output_tokens": settings.output_tokens},
+            })
+
+    async def _json(self, send, status: int, payload: Dict[str, Any]) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json")],
+        })
+        await send({"type": "http.response.body", "body": json.dumps(payload).encode()})
+
+    async def _stream(self, send, input_tokens: int, settings: MockSettings, text: str) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/event-stream")],
+        })
+
+        async def event(name: str, payload: Dict[str, Any]) -> None:
+            data = f"event: {name}\ndata: {json.dumps(payload)}\n\n".encode()
+            await send({"type": "http.response.body", "body": data, "more_body": True})
+
+        await event("message_start", {
+            "type": "message_start",
+            "message": {"id": f"msg_mock_{self.requests}", "usage": {"input_tokens": input_tokens}},
+        })
+        await event("content_block_start", {"type": "content_block_start", "index": 0})
+        delay = settings.chunk_tokens / settings.tokens_per_second if settings.tokens_per_second else 0
+        step = len(WORD) * settings.chunk_tokens
+        for start in range(0, len(text), step):
+            if delay:
+                await asyncio.sleep(delay)
+            await event("content_block_delta", {
+                "type": "content_block_delta",
+                "index": 0,
+                "delta": {"type": "text_delta", "text": text[start:start + step]},
+            })
+        await event("content_block_stop", {"type": "content_block_stop", "index": 0})
+        await event("message_delta", {
+            "type": "message_delta",
+            "delta": {"stop_reason": "end_turn"},
+            "usage": {"output_tokens": settings.output_tokens},
+        })
+        await event("message_stop", {"type": "message_stop"})
+        await send({"type": "http.response.body", "body": b""})
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Command line options for ``MockSettings``"""
+    parser.add_argument("--ttfb", type=float, default=0.05, help="seconds before response headers")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="0 sends all tokens at once")
+    parser.add_argument("--output-tokens", type=int, default=64)
+    parser.add_argument("--chunk-tokens", type=int, default=4, help="tokens per stream event")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=529)
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def settings_from(args: argparse.Namespace) -> MockSettings:
+    return MockSettings(
+        ttfb=args.ttfb,
+        tokens_per_second=args.tokens_per_second,
+        output_tokens=args.output_tokens,
+        chunk_tokens=args.chunk_tokens,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        seed=args.seed,
+    )
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    add_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(MockUpstream(settings_from(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,724 @@
+"""
+Batch jobs: stored input files and a scheduler running them in the background
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, AsyncIterator, Awaitable, BinaryIO, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from .config import Config
+from .limiter import LimitExceeded
+from .multipart import MultipartError, boundary_of, read_multipart
+from .serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+ENDPOINTS = ("/v1/chat/completions",)
+COMPLETION_WINDOWS = {"24h": 24 * 3600}
+MAX_METADATA_PAIRS = 16
+
+# Statuses of a batch the scheduler still has work for
+ACTIVE_STATUSES = ("validating", "in_progress", "finalizing", "cancelling")
+
+# Runs one request of a batch; returns the HTTP status and response body
+BatchRunner = Callable[[Dict[str, Any]], Awaitable[Tuple[int, Dict[str, Any]]]]
+
+
+class BatchError(Exception):
+    """Raised for a request the batch API rejects"""
+    
+    def __init__(self, message: str, status_code: int = 400, code: Optional[str] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.code = code
+
+
+class BatchStore:
+    """Uploaded files and batch records, shared by every worker process.
+    
+    File contents live under ``directory/files``; file and batch objects are
+    kept, in their OpenAI JSON shape, in a SQLite database next to them.
+    Batches also carry the scheduler that owns them and when it last checked
+    in, so a batch left behind by a process that died is picked up again.
+    """
+    
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.files_dir = os.path.join(directory, "files")
+        self.path = os.path.join(directory, "batches.sqlite3")
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+    
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(self.files_dir, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "id TEXT PRIMARY KEY, path TEXT NOT NULL, created_at INTEGER NOT NULL, data TEXT NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS batches ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, created_at INTEGER NOT NULL, "
+                "owner TEXT, heartbeat REAL, data TEXT NOT NULL)"
+            )
+            self._conn = conn
+        return self._conn
+    
+    def new_file_path(self) -> Tuple[str, str]:
+        """An id and path for a file about to be written"""
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        # Called on the event loop, so it must not touch the shared connection
+        os.makedirs(self.files_dir, exist_ok=True)
+        return file_id, os.path.join(self.files_dir, file_id)
+    
+    def add_file(self, file_id: str, path: str, filename: str, purpose: str) -> Dict[str, Any]:
+        created_at = int(time.time())
+        data = {
+            "id": file_id,
+            "object": "file",
+            "bytes": os.path.getsize(path),
+            "created_at": created_at,
+            "filename": filename,
+            "purpose": purpose,
+        }
+        with self._lock:
+            self._connect().execute(
+                "INSERT INTO files (id, path, created_at, data) VALUES (?, ?, ?, ?)",
+                (file_id, path, created_at, json.dumps(data)),
+            )
+        return data
+    
+    def get_file(self, file_id: str) -> Optional[Tuple[Dict[str, Any], str]]:
+        """A file object and the path of its contents"""
+        with self._lock:
+            row = self._connect().execute("SELECT data, path FROM files WHERE id = ?", (file_id,)).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+    
+    def list_files(self, purpose: Optional[str] = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._connect().execute("SELECT data FROM files ORDER BY created_at DESC").fetchall()
+        files = [json.loads(data) for (data,) in rows]
+        return [f for f in files if purpose is None or f["purpose"] == purpose]
+    
+    def delete_file(self, file_id: str) -> bool:
+        with self._lock:
+            row = self._connect().execute("DELETE FROM files WHERE id = ? RETURNING path", (file_id,)).fetchone()
+        if row is None:
+            return False
+        try:
+            os.remove(row[0])
+        except FileNotFoundError:
+            pass
+        return True
+    
+    def add_batch(self, data: Dict[str, Any]) -> None:
+        with self._lock:
+            self._connect().execute(
+                "INSERT INTO batches (id, status, created_at, data) VALUES (?, ?, ?, ?)",
+                (data["id"], data["status"], data["created_at"], json.dumps(data)),
+            )
+    
+    def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connect().execute("SELECT data FROM batches WHERE id = ?", (batch_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def list_batches(self, limit: int, after: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Batches, newest first, starting after the batch ``after``"""
+        query = "SELECT data FROM batches"
+        params: Tuple[Any, ...] = ()
+        if after:
+            query += " WHERE (created_at, id) < (SELECT created_at, id FROM batches WHERE id = ?)"
+            params = (after,)
+        query += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        with self._lock:
+            rows = self._connect().execute(query, (*params, limit)).fetchall()
+        return [json.loads(data) for (data,) in rows]
+    
+    def update_batch(
+        self,
+        batch_id: str,
+        changes: Dict[str, Any],
+        owner: Optional[str] = None,
+        expect: Tuple[str, ...] = (),
+    ) -> Optional[Dict[str, Any]]:
+        """Merge ``changes`` into a batch and return it.
+        
+        With ``owner``, nothing is changed and None returned unless that
+        scheduler holds the batch. With ``expect``, the batch is returned
+        unchanged unless its status is one of those.
+        """
+        with self._lock:
+            conn = self._connect()
+            # IMMEDIATE takes the write lock up front so read-modify-write is atomic
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT data, owner FROM batches WHERE id = ?", (batch_id,)).fetchone()
+                if row is None or (owner is not None and row[1] != owner):
+                    conn.execute("ROLLBACK")
+                    return None
+                data = json.loads(row[0])
+                if expect and data["status"] not in expect:
+                    conn.execute("ROLLBACK")
+                    return data
+                data.update(changes)
+                heartbeat = time.time() if owner is not None else None
+                conn.execute(
+                    "UPDATE batches SET status = ?, data = ?, heartbeat = COALESCE(?, heartbeat) WHERE id = ?",
+                    (data["status"], json.dumps(data), heartbeat, batch_id),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return data
+    
+    def claim(self, owner: str, stale_before: float) -> Optional[Dict[str, Any]]:
+        """Take the oldest batch with work left that no live scheduler holds"""
+        placeholders = ", ".join("?" * len(ACTIVE_STATUSES))
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    f"SELECT id, data FROM batches WHERE status IN ({placeholders}) "
+                    "AND (owner IS NULL OR heartbeat < ?) ORDER BY created_at, id LIMIT 1",
+                    (*ACTIVE_STATUSES, stale_before),
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE batches SET owner = ?, heartbeat = ? WHERE id = ?", (owner, time.time(), row[0])
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return json.loads(row[1]) if row else None
+    
+    def release(self, batch_id: str, owner: str) -> None:
+        with self._lock:
+            self._connect().execute(
+                "UPDATE batches SET owner = NULL WHERE id = ? AND owner = ?", (batch_id, owner)
+            )
+    
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def read_lines(path: str) -> Iterator[Tuple[int, bytes]]:
+    """Non-blank lines of a JSONL file with their 1-based line numbers"""
+    with open(path, "rb") as f:
+        for number, line in enumerate(f, 1):
+            if line.strip():
+                yield number, line
+
+
+def read_requests(lines: Iterator[Tuple[int, bytes]], count: int) -> List[Dict[str, Any]]:
+    """Parse up to ``count`` more requests from the lines of an input file"""
+    return [json.loads(raw) for _, raw in itertools.islice(lines, count)]
+
+
+def validate_input(path: str, endpoint: str, max_requests: int) -> Tuple[int, List[Dict[str, Any]]]:
+    """Count the requests of an input file and find what is wrong with it"""
+    errors: List[Dict[str, Any]] = []
+    seen: Set[str] = set()
+    total = 0
+    
+    def error(code: str, message: str, line: int) -> None:
+        if len(errors) < 100:
+            errors.append({"code": code, "message": message, "param": None, "line": line})
+    
+    for number, raw in read_lines(path):
+        total += 1
+        try:
+            line = json.loads(raw)
+        except ValueError:
+            error("invalid_json_line", "This line is not parseable as valid JSON.", number)
+            continue
+        if not isinstance(line, dict):
+            error("invalid_request", "Each line must be a JSON object.", number)
+            continue
+        custom_id = line.get("custom_id")
+        if not isinstance(custom_id, str) or not custom_id:
+            error("missing_required_parameter", "Missing required parameter: 'custom_id'.", number)
+        elif custom_id in seen:
+            error("duplicate_custom_id", f"The custom_id {custom_id!r} is used more than once.", number)
+        else:
+            seen.add(custom_id)
+        if line.get("method") != "POST":
+            error("invalid_method", "The method must be 'POST'.", number)
+        if line.get("url") != endpoint:
+            error("mismatched_endpoint", f"The url must match the batch's endpoint, {endpoint}.", number)
+        if not isinstance(line.get("body"), dict):
+            error("missing_required_parameter", "Missing required parameter: 'body'.", number)
+    
+    if total == 0:
+        error("empty_file", "The input file has no requests.", 0)
+    elif total > max_requests:
+        error("too_many_requests", f"The input file has {total} requests; the limit is {max_requests}.", 0)
+    return total, errors
+
+
+def finished_ids(path: str) -> Tuple[Set[str], int]:
+    """custom_ids already written to a results file, and how many lines it has.
+    
+    A line cut short by a crash is removed, so that request is run again.
+    """
+    ids: Set[str] = set()
+    if not os.path.exists(path):
+        return ids, 0
+    good = 0
+    with open(path, "rb+") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                ids.add(json.loads(line)["custom_id"])
+            except (ValueError, KeyError, TypeError):
+                break
+            good += len(line)
+        f.truncate(good)
+    return ids, len(ids)
+
+
+class BatchScheduler:
+    """Runs stored batches in the background.
+    
+    Each process with a scheduler claims one batch at a time and runs up to
+    ``batch_concurrency`` of its requests at once, through the same pool,
+    limiter and retries as live traffic. While live requests are queued for
+    an upstream slot it holds back new batch requests, so bulk work never
+    delays interactive clients. Results are appended to the batch's output
+    and error files as each request finishes; after a restart the batch is
+    claimed again and only the requests without a result are run.
+    """
+    
+    HEARTBEAT_INTERVAL = 1.0
+    READ_CHUNK = 256  # Input lines read and parsed per trip to a worker thread
+    LEASE = 30.0  # A batch whose owner has not checked in for this long is taken over
+    POLL_INTERVAL = 1.0
+    LIMIT_RETRY_SECONDS = 300.0  # A request the upstream keeps turning away for this long fails
+    
+    def __init__(self, config: Config, store: BatchStore, run: BatchRunner, queue_depth: Callable[[], int]):
+        self.store = store
+        self.run = run
+        self.queue_depth = queue_depth
+        self.concurrency = config.batch_concurrency
+        self.max_requests = config.batch_max_requests
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.completed = 0
+        self.failed = 0
+        self.current: Optional[str] = None
+        self._stop: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+    
+    async def aclose(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    def interrupt(self, batch_id: str) -> None:
+        """Stop dispatching requests of ``batch_id`` without waiting for the next heartbeat"""
+        if self.current == batch_id and self._stop is not None:
+            self._stop.set()
+    
+    async def _loop(self) -> None:
+        while True:
+            try:
+                batch = await asyncio.to_thread(self.store.claim, self.owner, time.time() - self.LEASE)
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to claim a batch: {e}")
+                batch = None
+            if batch is None:
+                await asyncio.sleep(self.POLL_INTERVAL)
+                continue
+            
+            self.current = batch["id"]
+            try:
+                await self._process(batch)
+            except asyncio.CancelledError:
+                # Shutting down: let the next scheduler resume it right away
+                await asyncio.to_thread(self.store.release, batch["id"], self.owner)
+                raise
+            except Exception as e:
+                logger.error(f"Batch {batch['id']} failed: {e}", exc_info=True)
+                await self._update(batch, {
+                    "status": "failed",
+                    "failed_at": int(time.time()),
+                    "errors": {"object": "list", "data": [{"code": "internal_error", "message": str(e)}]},
+                })
+            finally:
+                self.current = None
+    
+    async def _update(
+        self, batch: Dict[str, Any], changes: Dict[str, Any], expect: Tuple[str, ...] = ()
+    ) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.store.update_batch, batch["id"], changes, self.owner, expect)
+    
+    def _results_path(self, batch: Dict[str, Any], kind: str) -> str:
+        return os.path.join(self.store.directory, "results", f"{batch['id']}.{kind}.jsonl")
+    
+    async def _process(self, batch: Dict[str, Any]) -> None:
+        found = await asyncio.to_thread(self.store.get_file, batch["input_file_id"])
+        if found is None:
+            await self._update(batch, {
+                "status": "failed",
+                "failed_at": int(time.time()),
+                "errors": {"object": "list", "data": [{"code": "file_not_found", "message": "Input file was deleted"}]},
+            })
+            return
+        input_path = found[1]
+        
+        if batch["status"] == "validating":
+            total, errors = await asyncio.to_thread(validate_input, input_path, batch["endpoint"], self.max_requests)
+            now = int(time.time())
+            counts = {"total": total, "completed": 0, "failed": 0}
+            if errors:
+                changes = {"status": "failed", "failed_at": now, "errors": {"object": "list", "data": errors}}
+            else:
+                changes = {"status": "in_progress", "in_progress_at": now}
+            # A cancel that came in while validating is finished below instead
+            batch = await self._update(batch, {**changes, "request_counts": counts}, expect=("validating",))
+            if batch is None or batch["status"] == "failed":
+                return
+        
+        if batch["status"] == "in_progress":
+            batch = await self._run_requests(batch, input_path)
+            if batch is None:
+                return
+        await self._finish(batch)
+    
+    async def _run_requests(self, batch: Dict[str, Any], input_path: str) -> Optional[Dict[str, Any]]:
+        """Run every request without a result; returns the batch as it stands afterwards"""
+        output_path = self._results_path(batch, "output")
+        error_path = self._results_path(batch, "errors")
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        done, completed = await asyncio.to_thread(finished_ids, output_path)
+        failed_ids, failed = await asyncio.to_thread(finished_ids, error_path)
+        done |= failed_ids
+        total = batch["request_counts"]["total"]
+        counts = {"total": total, "completed": completed, "failed": failed}
+        
+        stop = self._stop = asyncio.Event()
+        state: Dict[str, Any] = {"batch": batch}
+        
+        async def heartbeat() -> None:
+            while not stop.is_set():
+                await asyncio.sleep(self.HEARTBEAT_INTERVAL)
+                current = await self._update(state["batch"], {"request_counts": dict(counts)})
+                if current is None or current["status"] != "in_progress":
+                    # Cancelled, or the batch was taken over after a stall
+                    state["batch"] = current
+                    stop.set()
+                elif time.time() >= current["expires_at"]:
+                    stop.set()
+                else:
+                    state["batch"] = current
+        
+        write_lock = asyncio.Lock()
+        
+        async def write(f: BinaryIO, record: Dict[str, Any]) -> None:
+            data = dumps(record) + b"\n"
+            async with write_lock:
+                await asyncio.to_thread(f.write, data)
+        
+        async def run_line(line: Dict[str, Any], output, errors) -> None:
+            deadline = time.monotonic() + self.LIMIT_RETRY_SECONDS
+            while True:
+                try:
+                    status, body = await self.run(line["body"])
+                    break
+                except LimitExceeded as e:
+                    if time.monotonic() + e.retry_after > deadline:
+                        # Still turned away, e.g. by a circuit that stays open
+                        status = e.status_code
+                        body = {"error": {"message": e.reason, "type": "overloaded_error", "code": str(e.status_code)}}
+                        break
+                    # The upstream queue is full or failing; wait and try the same request again
+                    await asyncio.sleep(e.retry_after)
+                    if stop.is_set():
+                        return  # Left without a result, so it is run again on resume
+                except Exception as e:
+                    logger.error(f"Batch request {line['custom_id']} failed: {e}", exc_info=True)
+                    status, body = 500, {"error": {"message": str(e), "type": "internal_error"}}
+                    break
+            record = {
+                "id": f"batch_req_{uuid.uuid4().hex[:24]}",
+                "custom_id": line["custom_id"],
+                "response": {"status_code": status, "request_id": uuid.uuid4().hex, "body": body},
+                "error": None,
+            }
+            if 200 <= status < 300:
+                await write(output, record)
+                counts["completed"] += 1
+                self.completed += 1
+            else:
+                error = body.get("error") if isinstance(body, dict) else None
+                record["error"] = {
+                    "code": (error or {}).get("code") or str(status),
+                    "message": (error or {}).get("message") or "Request failed",
+                }
+                await write(errors, record)
+                counts["failed"] += 1
+                self.failed += 1
+        
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks: Set[asyncio.Task] = set()
+        watcher = asyncio.create_task(heartbeat())
+        
+        def release(task: asyncio.Task) -> None:
+            tasks.discard(task)
+            semaphore.release()
+        
+        try:
+            with open(output_path, "ab", buffering=0) as output, open(error_path, "ab", buffering=0) as errors:
+                lines = read_lines(input_path)
+                try:
+                    while not stop.is_set():
+                        chunk = await asyncio.to_thread(read_requests, lines, self.READ_CHUNK)
+                        if not chunk:
+                            break
+                        for line in chunk:
+                            if stop.is_set():
+                                break
+                            if line["custom_id"] in done:
+                                continue
+                            await semaphore.acquire()
+                            # Live traffic waiting for the upstream goes first
+                            while self.queue_depth() and not stop.is_set():
+                                await asyncio.sleep(0.05)
+                            if stop.is_set():
+                                semaphore.release()
+                                break
+                            task = asyncio.create_task(run_line(line, output, errors))
+                            tasks.add(task)
+                            task.add_done_callback(release)
+                finally:
+                    lines.close()
+                if tasks:
+                    await asyncio.wait(set(tasks))
+        finally:
+            for task in tasks:
+                task.cancel()
+            stop.set()
+            self._stop = None
+            watcher.cancel()
+            try:
+                await watcher
+            except asyncio.CancelledError:
+                pass
+        
+        current = state["batch"]
+        if current is None:
+            return None
+        batch = await self._update(current, {"request_counts": counts})
+        if batch is None or batch["status"] != "in_progress":
+            return batch
+        if counts["completed"] + counts["failed"] >= total:
+            changes = {"status": "finalizing", "finalizing_at": int(time.time())}
+        else:
+            changes = {"status": "expired", "expired_at": int(time.time())}
+        # A cancel may have come in since the last heartbeat
+        return await self._update(batch, changes, expect=("in_progress",))
+    
+    async def _finish(self, batch: Dict[str, Any]) -> None:
+        """Publish the results files of a batch that has stopped running"""
+        now = int(time.time())
+        changes: Dict[str, Any] = {}
+        for kind, key, purpose in (("output", "output_file_id", "batch_output"), ("errors", "error_file_id", "batch_output")):
+            path = self._results_path(batch, kind)
+            if batch.get(key) is None and os.path.exists(path) and os.path.getsize(path):
+                file_id, _ = self.store.new_file_path()
+                await asyncio.to_thread(self.store.add_file, file_id, path, f"{batch['id']}_{kind}.jsonl", purpose)
+                changes[key] = file_id
+        
+        if batch["status"] == "finalizing":
+            changes.update(status="completed", completed_at=now)
+        elif batch["status"] == "cancelling":
+            changes.update(status="cancelled", cancelled_at=now)
+        await self._update(batch, changes)
+        logger.info(f"Batch {batch['id']} {changes.get('status', batch['status'])}: {batch.get('request_counts')}")
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "owner": self.owner,
+            "current": self.current,
+            "concurrency": self.concurrency,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+
+class BatchManager:
+    """The ``/v1/files`` and ``/v1/batches`` operations over a ``BatchStore``"""
+    
+    def __init__(self, config: Config, run: BatchRunner, queue_depth: Callable[[], int]):
+        directory = config.batch_dir or os.path.join(config.state_dir, "batches")
+        self.store = BatchStore(directory)
+        self.scheduler = BatchScheduler(config, self.store, run, queue_depth)
+        self.max_file_bytes = config.batch_max_file_bytes
+    
+    def start(self) -> None:
+        self.scheduler.start()
+    
+    async def aclose(self) -> None:
+        await self.scheduler.aclose()
+        self.store.close()
+    
+    async def upload(self, chunks: AsyncIterator[bytes], content_type: Optional[str]) -> Dict[str, Any]:
+        """Store a file uploaded as ``multipart/form-data`` with ``file`` and ``purpose`` fields"""
+        file_id, path = self.store.new_file_path()
+        uploaded: Dict[str, Any] = {}
+        
+        def open_file(field: str, filename: str) -> BinaryIO:
+            if field != "file" or uploaded:
+                raise MultipartError("Expected a single file, in the 'file' field")
+            uploaded["filename"] = filename
+            uploaded["file"] = open(path, "wb")
+            return uploaded["file"]
+        
+        try:
+            try:
+                fields = await read_multipart(chunks, boundary_of(content_type), open_file, self.max_file_bytes)
+            finally:
+                if "file" in uploaded:
+                    uploaded["file"].close()
+            if not uploaded:
+                raise MultipartError("Missing required field: 'file'")
+            if fields.get("purpose") != "batch":
+                raise BatchError(f"Unsupported purpose {fields.get('purpose')!r}; supported: batch")
+            return await asyncio.to_thread(self.store.add_file, file_id, path, uploaded["filename"], "batch")
+        except MultipartError as e:
+            self._discard(path)
+            raise BatchError(str(e)) from e
+        except BaseException:
+            self._discard(path)
+            raise
+    
+    @staticmethod
+    def _discard(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    
+    async def get_file(self, file_id: str) -> Tuple[Dict[str, Any], str]:
+        """A file object and the path of its contents"""
+        found = await asyncio.to_thread(self.store.get_file, file_id)
+        if found is None:
+            raise BatchError(f"No such file: {file_id}", 404, "not_found")
+        return found
+    
+    async def list_files(self, purpose: Optional[str] = None) -> Dict[str, Any]:
+        files = await asyncio.to_thread(self.store.list_files, purpose)
+        return {"object": "list", "data": files, "has_more": False}
+    
+    async def delete_file(self, file_id: str) -> Dict[str, Any]:
+        if not await asyncio.to_thread(self.store.delete_file, file_id):
+            raise BatchError(f"No such file: {file_id}", 404, "not_found")
+        return {"id": file_id, "object": "file", "deleted": True}
+    
+    async def create_batch(
+        self,
+        input_file_id: str,
+        endpoint: str,
+        completion_window: str,
+        metadata: Optional[Dict[str, str]] = None,
+    ) -> Dict[str, Any]:
+        if endpoint not in ENDPOINTS:
+            raise BatchError(f"Unsupported endpoint {endpoint!r}; supported: {', '.join(ENDPOINTS)}")
+        if completion_window not in COMPLETION_WINDOWS:
+            raise BatchError(f"Unsupported completion_window {completion_window!r}; supported: 24h")
+        if metadata is not None and len(metadata) > MAX_METADATA_PAIRS:
+            raise BatchError(f"metadata can have at most {MAX_METADATA_PAIRS} pairs")
+        found = await asyncio.to_thread(self.store.get_file, input_file_id)
+        if found is None:
+            raise BatchError(f"No such file: {input_file_id}", 404, "not_found")
+        if found[0]["purpose"] != "batch":
+            raise BatchError(f"File {input_file_id} was not uploaded with purpose 'batch'")
+        
+        now = int(time.time())
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex[:24]}",
+            "object": "batch",
+            "endpoint": endpoint,
+            "errors": None,
+            "input_file_id": input_file_id,
+            "completion_window": completion_window,
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": now,
+            "in_progress_at": None,
+            "expires_at": now + COMPLETION_WINDOWS[completion_window],
+            "finalizing_at": None,
+            "completed_at": None,
+            "failed_at": None,
+            "expired_at": None,
+            "cancelling_at": None,
+            "cancelled_at": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            "metadata": metadata,
+        }
+        await asyncio.to_thread(self.store.add_batch, batch)
+        return batch
+    
+    async def get_batch(self, batch_id: str) -> Dict[str, Any]:
+        batch = await asyncio.to_thread(self.store.get_batch, batch_id)
+        if batch is None:
+            raise BatchError(f"No such batch: {batch_id}", 404, "not_found")
+        return batch
+    
+    async def list_batches(self, limit: int = 20, after: Optional[str] = None) -> Dict[str, Any]:
+        limit = max(1, min(limit, 100))
+        # One more than asked for tells whether there is another page
+        batches = await asyncio.to_thread(self.store.list_batches, limit + 1, after)
+        page = batches[:limit]
+        return {
+            "object": "list",
+            "data": page,
+            "first_id": page[0]["id"] if page else None,
+            "last_id": page[-1]["id"] if page else None,
+            "has_more": len(batches) > limit,
+        }
+    
+    async def cancel_batch(self, batch_id: str) -> Dict[str, Any]:
+        # The scheduler running it stops dispatching and finishes the cancel
+        batch = await asyncio.to_thread(
+            self.store.update_batch,
+            batch_id,
+            {"status": "cancelling", "cancelling_at": int(time.time())},
+            None,
+            ("validating", "in_progress"),
+        )
+        if batch is None:
+            raise BatchError(f"No such batch: {batch_id}", 404, "not_found")
+        if batch["status"] != "cancelling":
+            raise BatchError(f"Batch {batch_id} is {batch['status']} and cannot be cancelled", 409)
+        self.scheduler.interrupt(batch_id)
+        return batch
+    
+    def stats(self) -> Dict[str, Any]:
+        return {"directory": self.store.directory, **self.scheduler.stats()}
@@ -0,0 +1,328 @@
+"""
+Response cache for deterministic chat completions
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+# Upstream request fields that influence the completion; "stream" is left out
+# so streaming and non-streaming clients share entries.
+KEY_FIELDS = (
+    "model",
+    "system",
+    "messages",
+    "max_tokens",
+    "temperature",
+    "top_p",
+    "stop_sequences",
+)
+
+
+@dataclass(slots=True)
+class Completion:
+    """Upstream-independent result of a chat completion"""
+    id: str
+    content: str
+    finish_reason: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    # Prompt tokens read from and written to the upstream's prompt cache
+    cache_read_tokens: int = 0
+    cache_write_tokens: int = 0
+
+    @classmethod
+    def from_usage(cls, usage: Dict[str, Any], **fields: Any) -> "Completion":
+        """A completion with the token counts of an Anthropic ``usage`` object
+
+        Anthropic leaves prompt tokens served from or added to its prompt
+        cache out of ``input_tokens``; OpenAI's ``prompt_tokens`` counts them.
+        """
+        cache_read = usage.get("cache_read_input_tokens") or 0
+        cache_write = usage.get("cache_creation_input_tokens") or 0
+        return cls(
+            prompt_tokens=usage.get("input_tokens", 0) + cache_read + cache_write,
+            completion_tokens=usage.get("output_tokens", 0),
+            cache_read_tokens=cache_read,
+            cache_write_tokens=cache_write,
+            **fields,
+        )
+
+    def to_bytes(self) -> bytes:
+        return json.dumps(asdict(self), separators=(",", ":")).encode()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Completion":
+        return cls(**json.loads(data))
+
+
+def request_key(zai_request: Dict[str, Any]) -> str:
+    """Canonical hash of a transformed upstream request"""
+    canonical = {field: zai_request.get(field) for field in KEY_FIELDS}
+    encoded = json.dumps(canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class LRUCache:
+    """Byte-bounded LRU map with per-entry expiry"""
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        cost = len(key) + len(value)
+        if cost > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self.size += cost
+        while self.size > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        _, value = self._entries.pop(key)
+        self.size -= len(key) + len(value)
+
+
+class DiskCache:
+    """SQLite-backed cache shared by all worker processes on a host.
+
+    WAL mode lets several uvicorn workers read concurrently while one writes.
+    When the stored payloads exceed ``max_bytes`` the least recently used rows
+    are deleted until the table is back under ``COMPACT_RATIO`` of the limit.
+    Their total size is kept in a one-row table by triggers, so every worker's
+    writes are counted and a write checks the limit without a table scan.
+    """
+
+    COMPACT_RATIO = 0.9
+
+    def __init__(self, path: str, max_bytes: int, ttl: float):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.compactions = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses_size ("
+                "id INTEGER PRIMARY KEY CHECK (id = 0), total INTEGER NOT NULL)"
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO responses_size (id, total) "
+                "SELECT 0, COALESCE(SUM(size), 0) FROM responses"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS responses_inserted AFTER INSERT ON responses BEGIN "
+                "UPDATE responses_size SET total = total + NEW.size WHERE id = 0; END"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS responses_updated AFTER UPDATE OF size ON responses BEGIN "
+                "UPDATE responses_size SET total = total + NEW.size - OLD.size WHERE id = 0; END"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS responses_deleted AFTER DELETE ON responses BEGIN "
+                "UPDATE responses_size SET total = total - OLD.size WHERE id = 0; END"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> Optional[Tuple[float, bytes]]:
+        """Return ``(remaining_ttl, value)`` for a live entry"""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value, expires_at FROM responses WHERE key = ? AND expires_at > ?",
+                (key, now),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            conn.commit()
+        return row[1] - now, bytes(row[0])
+
+    def set(self, key: str, value: bytes) -> None:
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            # An upsert rather than REPLACE, whose implicit delete fires no trigger
+            conn.execute(
+                "INSERT INTO responses (key, value, size, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value, "
+                "size = excluded.size, expires_at = excluded.expires_at, accessed_at = excluded.accessed_at",
+                (key, value, len(value), now + self.ttl, now),
+            )
+            conn.commit()
+            self._compact(conn, now)
+
+    def _compact(self, conn: sqlite3.Connection, now: float) -> None:
+        (total,) = conn.execute("SELECT total FROM responses_size").fetchone()
+        if total <= self.max_bytes:
+            return
+        conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+        target = self.max_bytes * self.COMPACT_RATIO
+        (total,) = conn.execute("SELECT total FROM responses_size").fetchone()
+        for key, size in conn.execute(
+            "SELECT key, size FROM responses ORDER BY accessed_at"
+        ).fetchall():
+            if total <= target:
+                break
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+        conn.commit()
+        self.compactions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            conn = self._connect()
+            (entries,) = conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+            (size,) = conn.execute("SELECT total FROM responses_size").fetchone()
+        return {
+            "path": self.path,
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "compactions": self.compactions,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class ResponseCache:
+    """Caches completions for requests that are deterministic enough to reuse.
+
+    Entries live in an in-memory LRU (L1) and, when ``cache_disk_path`` or
+    ``state_dir`` is set, in a SQLite file (L2) that survives restarts and is
+    shared by worker processes. L2 hits are promoted to L1.
+    """
+
+    def __init__(self, config: Config):
+        self.enabled = config.cache_enabled
+        self.max_temperature = config.cache_max_temperature
+        self.memory = LRUCache(config.cache_max_bytes, config.cache_ttl)
+        # Workers share the L2 through the state directory unless a path is set
+        disk_path = config.cache_disk_path
+        if disk_path is None and config.state_dir:
+            disk_path = os.path.join(config.state_dir, "cache.sqlite3")
+        self.disk = (
+            DiskCache(disk_path, config.cache_disk_max_bytes, config.cache_ttl)
+            if disk_path
+            else None
+        )
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def key_for(self, zai_request: Dict[str, Any]) -> Optional[str]:
+        """Cache key for an upstream request, or None if it is not cacheable"""
+        if not self.enabled:
+            return None
+        temperature = zai_request.get("temperature")
+        if temperature is not None and temperature > self.max_temperature:
+            return None
+        return request_key(zai_request)
+
+    async def get(self, key: str) -> Optional[Completion]:
+        data = self.memory.get(key)
+        if data is None and self.disk is not None:
+            try:
+                entry = await asyncio.to_thread(self.disk.get, key)
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to read response cache entry from disk: {e}")
+                entry = None
+            if entry is not None:
+                ttl, data = entry
+                self.memory.set(key, data, ttl=ttl)
+                self.disk_hits += 1
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return Completion.from_bytes(data)
+
+    async def set(self, key: str, completion: Completion) -> None:
+        data = completion.to_bytes()
+        self.memory.set(key, data)
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.set, key, data)
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to write response cache entry to disk: {e}")
+
+    def close(self) -> None:
+        if self.disk is not None:
+            self.disk.close()
+
+    async def stats(self) -> Dict[str, Any]:
+        stats = {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "entries": len(self.memory),
+            "bytes": self.memory.size,
+            "max_bytes": self.memory.max_bytes,
+            "evictions": self.memory.evictions,
+        }
+        if self.disk is not None:
+            try:
+                stats["disk"] = await asyncio.to_thread(self.disk.stats)
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to read response cache stats from disk: {e}")
+                stats["disk"] = None
+        return stats
@@ -0,0 +1,147 @@
+"""
+Anonymized capture of request shapes and timings for replay
+"""
+
+import json
+import logging
+import os
+import time
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List
+
+from .config import Config
+from .models import ChatCompletionRequest
+
+if TYPE_CHECKING:
+    from .metrics import RequestTracker
+
+logger = logging.getLogger(__name__)
+
+FORMAT = "testdriver-proxy-capture"
+VERSION = 1
+
+
+def request_shape(request: ChatCompletionRequest) -> Dict[str, Any]:
+    """What a replay needs to know about a request, without any of its content"""
+    images = 0
+    image_bytes = 0
+    for message in request.messages:
+        if isinstance(message.content, list):
+            for part in message.content:
+                part_type = part.get("type")
+                if part_type == "image_url":
+                    images += 1
+                    image_bytes += len((part.get("image_url") or {}).get("url", ""))
+                elif part_type == "image":
+                    # Anthropic-style block: base64 data or a URL
+                    source = part.get("source") or {}
+                    images += 1
+                    image_bytes += len(source.get("data") or source.get("url") or "")
+    return {
+        "model": request.model,
+        "stream": bool(request.stream),
+        "messages": len(request.messages),
+        "images": images,
+        "image_bytes": image_bytes,
+        "max_tokens": request.max_tokens,
+    }
+
+
+class TrafficCapture:
+    """Appends the shape and timings of every chat completion as a JSON line.
+    
+    Only sizes, counts, the model and timings are written, never message
+    text, images or client identities. The file starts with a header holding
+    the wall clock time capture began; each record's ``t`` is its arrival in
+    seconds after that, so files from several workers can be merged. Each
+    worker process writes its own file, named after its pid, so neither
+    sibling workers nor the replacement of a recycled one overwrite it.
+    Capture stops once the file reaches ``traffic_capture_max_bytes``.
+    """
+    
+    def __init__(self, config: Config):
+        root, ext = os.path.splitext(config.traffic_capture_path)
+        self.path = f"{root}.{os.getpid()}{ext}"
+        self.max_bytes = config.traffic_capture_max_bytes
+        self.captured = 0
+        self.full = False
+        self._file = None
+        self._size = 0
+        # Arrival times are perf_counter readings, anchored here
+        self._started = time.perf_counter()
+        self._started_unix = time.time()
+    
+    def record(self, shape: Dict[str, Any], tracker: "RequestTracker") -> None:
+        if self.full:
+            return
+        first_token = tracker.first_token
+        line = json.dumps({
+            "t": round(tracker.started - self._started, 4),
+            **shape,
+            "request_bytes": tracker.request_size,
+            "status": tracker.status,
+            # Upstream time to first byte, and time to first token of streams
+            "ttfb": round(tracker.upstream_ttfb, 4) if tracker.upstream_ttfb is not None else None,
+            "ttft": round(first_token - tracker.started, 4) if first_token is not None else None,
+            "duration": round(tracker.duration, 4),
+            "response_bytes": tracker.response_size,
+            "prompt_tokens": tracker.prompt_tokens,
+            "output_tokens": tracker.completion_tokens,
+        }, separators=(",", ":")) + "\n"
+        try:
+            if self._file is None:
+                self._open()
+            if self._size + len(line) > self.max_bytes:
+                self.full = True
+                logger.warning(f"Traffic capture {self.path} reached {self.max_bytes} bytes, stopping")
+                return
+            self._file.write(line)
+            self._size += len(line)
+            self.captured += 1
+        except OSError as e:
+            logger.warning(f"Failed to capture traffic to {self.path}: {e}")
+    
+    def _open(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, "w", encoding="utf-8")
+        header = json.dumps({"format": FORMAT, "version": VERSION, "started": self._started_unix}) + "\n"
+        self._file.write(header)
+        self._size = len(header)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {"path": self.path, "captured": self.captured, "full": self.full}
+    
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_capture(paths: Iterable[str]) -> List[Dict[str, Any]]:
+    """Records of one or more capture files in arrival order.
+    
+    ``t`` is rebased to seconds after the earliest capture began, so the
+    files of several workers replay as the traffic they shared.
+    """
+    files = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            if header.get("format") != FORMAT:
+                raise ValueError(f"Not a traffic capture: {path}")
+            if header.get("version") != VERSION:
+                raise ValueError(f"Unsupported capture version {header.get('version')}: {path}")
+            lines = [json.loads(line) for line in f if line.strip()]
+            files.append((header["started"], lines))
+    
+    if not files:
+        return []
+    origin = min(started for started, _ in files)
+    records = []
+    for started, lines in files:
+        for record in lines:
+            record["t"] = round(record["t"] + started - origin, 4)
+            records.append(record)
+    records.sort(key=lambda record: record["t"])
+    return records
@@ -0,0 +1,153 @@
+"""
+Circuit breaking for upstream targets
+"""
+
+import logging
+import math
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from .config import Config
+from .limiter import LimitExceeded
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+# In gauge order: 0 closed, 1 half-open, 2 open
+CIRCUIT_STATES = (CLOSED, HALF_OPEN, OPEN)
+
+
+class CircuitOpen(LimitExceeded):
+    """Raised when no upstream target will take a call"""
+    
+    def __init__(self, retry_after: float):
+        super().__init__(503, "Upstream is failing; circuit breaker open", max(1, math.ceil(retry_after)))
+
+
+class CircuitBreaker:
+    """Stops calling a target that is failing, and fails fast instead.
+    
+    While closed, the outcomes of the last ``window`` calls are kept. Once
+    at least ``min_calls`` are in, the breaker opens if the share of
+    failures reaches ``failure_rate`` percent, or the share of calls slower
+    than ``slow_call_seconds`` reaches ``slow_call_rate`` percent. An open
+    breaker takes no calls for ``open_time`` seconds, then lets
+    ``half_open_calls`` probe calls through: if they all succeed in time it
+    closes, and the first failure opens it again.
+    """
+    
+    def __init__(self, config: Config, name: str):
+        self.name = name
+        self.enabled = config.circuit_breaker_enabled
+        self.window = config.circuit_window
+        self.min_calls = config.circuit_min_calls
+        self.failure_rate = config.circuit_failure_rate
+        self.slow_call_seconds = config.circuit_slow_call_seconds
+        self.slow_call_rate = config.circuit_slow_call_rate
+        self.open_time = config.circuit_open_time
+        self.half_open_calls = config.circuit_half_open_calls
+        
+        self._state = CLOSED
+        # (failed, slow) per call
+        self._outcomes: Deque[Tuple[bool, bool]] = deque(maxlen=self.window)
+        self._failures = 0
+        self._slow = 0
+        self._opened_at = 0.0
+        self._half_opened_at = 0.0
+        self._probes_left = 0
+        self._probes_passed = 0
+        self.opened = 0
+    
+    def state(self, now: float) -> str:
+        if self._state == OPEN and now >= self._opened_at + self.open_time:
+            self._half_open(now)
+        elif self._state == HALF_OPEN and not self._probes_left and now >= self._half_opened_at + self.open_time:
+            # Probes that never reported back, e.g. cancelled by their client
+            self._half_open(now)
+        return self._state
+    
+    def _half_open(self, now: float) -> None:
+        if self._state == OPEN:
+            logger.info(f"Upstream {self.name} circuit half-open, probing")
+        self._state = HALF_OPEN
+        self._half_opened_at = now
+        self._probes_left = self.half_open_calls
+        self._probes_passed = 0
+    
+    def available(self, now: float) -> bool:
+        """Whether the target would take a call now"""
+        if not self.enabled:
+            return True
+        state = self.state(now)
+        return state == CLOSED or (state == HALF_OPEN and self._probes_left > 0)
+    
+    def acquire(self, now: float) -> None:
+        """Account for a call the balancer is about to make"""
+        if self.enabled and self.state(now) == HALF_OPEN:
+            self._probes_left -= 1
+    
+    def retry_after(self, now: float) -> float:
+        """Seconds until the breaker lets calls through again"""
+        return max(0.0, self._opened_at + self.open_time - now)
+    
+    def record(self, failed: bool, latency: Optional[float] = None) -> None:
+        """Report how a call went"""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        slow = latency is not None and latency >= self.slow_call_seconds
+        state = self.state(now)
+        
+        if state == HALF_OPEN:
+            if failed or slow:
+                self._open(now, "a probe call failed" if failed else "a probe call was slow")
+                return
+            self._probes_passed += 1
+            if self._probes_passed >= self.half_open_calls:
+                logger.info(f"Upstream {self.name} circuit closed")
+                self._state = CLOSED
+            return
+        if state == OPEN:
+            # Started before the breaker opened
+            return
+        
+        if len(self._outcomes) == self._outcomes.maxlen:
+            old_failed, old_slow = self._outcomes[0]
+            self._failures -= old_failed
+            self._slow -= old_slow
+        self._outcomes.append((failed, slow))
+        self._failures += failed
+        self._slow += slow
+        
+        calls = len(self._outcomes)
+        if calls < self.min_calls:
+            return
+        if self._failures * 100 >= self.failure_rate * calls:
+            self._open(now, f"{self._failures} of the last {calls} calls failed")
+        elif self._slow * 100 >= self.slow_call_rate * calls:
+            self._open(now, f"{self._slow} of the last {calls} calls took over {self.slow_call_seconds:g}s")
+    
+    def _open(self, now: float, reason: str) -> None:
+        logger.warning(f"Upstream {self.name} circuit open for {self.open_time:g}s: {reason}")
+        self._state = OPEN
+        self._opened_at = now
+        self._outcomes.clear()
+        self._failures = 0
+        self._slow = 0
+        self.opened += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        state = self.state(now) if self.enabled else CLOSED
+        calls = len(self._outcomes)
+        return {
+            "state": state,
+            "retry_after": round(self.retry_after(now), 1) if state == OPEN else None,
+            "calls": calls,
+            "failure_rate": round(self._failures * 100 / calls, 1) if calls else 0.0,
+            "slow_call_rate": round(self._slow * 100 / calls, 1) if calls else 0.0,
+            "opened": self.opened,
+        }
@@ -0,0 +1,154 @@
+"""
+Single-flight coalescing of identical in-flight requests
+"""
+
+import asyncio
+import logging
+import weakref
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+from .cache import request_key
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class StreamBroadcast:
+    """Fans one upstream SSE stream out to every subscriber.
+
+    Chunks are buffered for the lifetime of the stream so late joiners first
+    receive the prefix they missed and then follow along live. The upstream
+    stream is cancelled once every subscriber has gone away.
+    """
+
+    def __init__(self, source: AsyncIterator[str]):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+        self.task = asyncio.ensure_future(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[str]) -> None:
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                self._notify()
+        except asyncio.CancelledError:
+            self.error = ConnectionAbortedError("Upstream stream cancelled")
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+    def _notify(self) -> None:
+        # Wake every waiter; later waiters block on the fresh event
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def subscribe(self) -> AsyncIterator[str]:
+        """Register a subscriber and return its chunk iterator"""
+        self.subscribers += 1
+        state = {"started": False}
+        iterator = self._iterate(state)
+        # An iterator dropped before its first chunk, e.g. when the client went
+        # away before the response started, never runs _iterate's finally
+        weakref.finalize(iterator, self._dropped, state)
+        return iterator
+
+    def _dropped(self, state: Dict[str, bool]) -> None:
+        if not state["started"]:
+            self._leave()
+
+    def _leave(self) -> None:
+        self.subscribers -= 1
+        if self.subscribers == 0 and not self.done:
+            self.task.cancel()
+
+    async def _iterate(self, state: Dict[str, bool]) -> AsyncIterator[str]:
+        state["started"] = True
+        index = 0
+        try:
+            while True:
+                changed = self._changed
+                while index < len(self.chunks):
+                    yield self.chunks[index]
+                    index += 1
+                if self.done and index >= len(self.chunks):
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await changed.wait()
+        finally:
+            self._leave()
+
+
+class SingleFlight:
+    """Shares one upstream call between concurrent identical requests"""
+
+    def __init__(self, config: Config):
+        self.enabled = config.coalesce_enabled
+        self.max_temperature = config.coalesce_max_temperature
+        self.leaders = 0
+        self.coalesced = 0
+        self.stream_leaders = 0
+        self.stream_coalesced = 0
+        self._calls: Dict[str, "asyncio.Future[Any]"] = {}
+        self._streams: Dict[str, StreamBroadcast] = {}
+
+    def key_for(self, zai_request: Dict[str, Any]) -> Optional[str]:
+        """Coalescing key, or None when identical requests should stay independent"""
+        if not self.enabled:
+            return None
+        temperature = zai_request.get("temperature")
+        if temperature is not None and temperature > self.max_temperature:
+            return None
+        return request_key(zai_request)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """Await ``fn`` once per key; concurrent callers share its result"""
+        future = self._calls.get(key)
+        if future is None:
+            self.leaders += 1
+            future = asyncio.ensure_future(fn())
+            self._calls[key] = future
+            future.add_done_callback(lambda f: self._forget(self._calls, key, f))
+        else:
+            self.coalesced += 1
+            logger.debug(f"Coalesced request {key[:12]} onto in-flight call")
+        # Shielded so one waiter disconnecting does not cancel the others
+        return await asyncio.shield(future)
+
+    def stream(self, key: str, factory: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """Subscribe to the in-flight stream for ``key``, starting it if needed"""
+        broadcast = self._streams.get(key)
+        if broadcast is None or broadcast.done:
+            self.stream_leaders += 1
+            broadcast = StreamBroadcast(factory())
+            self._streams[key] = broadcast
+            broadcast.task.add_done_callback(lambda f: self._forget(self._streams, key, broadcast))
+        else:
+            self.stream_coalesced += 1
+            logger.debug(f"Coalesced stream {key[:12]} onto in-flight stream")
+        return broadcast.subscribe()
+
+    @staticmethod
+    def _forget(flights: Dict[str, Any], key: str, flight: Any) -> None:
+        if flights.get(key) is flight:
+            del flights[key]
+        if isinstance(flight, asyncio.Future) and not flight.cancelled():
+            flight.exception()  # Mark retrieved when every waiter went away
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "stream_leaders": self.stream_leaders,
+            "stream_coalesced": self.stream_coalesced,
+            "in_flight": len(self._calls) + len(self._streams),
+        }
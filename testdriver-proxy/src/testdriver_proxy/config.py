@@ -2,8 +2,9 @@
 Configuration management for TestDriver Proxy
 """
 
-from typing import Optional
+from typing import Any, Dict, List, Optional
 from dataclasses import dataclass, field
+import json
 import os
 
 
@@ -19,15 +20,120 @@ class Config:
     zai_api_key: Optional[str] = field(default=None)
     zai_base_url: str = field(default="https://api.z.ai/v1")
     
+    # Upstream targets to balance across, each a dict with "base_url" and
+    # optionally "api_key", "weight", "name" and "max_connections"; when
+    # empty, zai_base_url and zai_api_key are the only target
+    upstreams: List[Dict[str, Any]] = field(default_factory=list)
+    upstream_eject_failures: int = field(default=5)  # 0 never ejects
+    upstream_eject_time: float = field(default=30.0)
+    upstream_slow_start: float = field(default=30.0)
+    
+    # Circuit breaker per upstream target
+    circuit_breaker_enabled: bool = field(default=False)
+    circuit_window: int = field(default=20)  # Calls
+    circuit_min_calls: int = field(default=10)
+    circuit_failure_rate: float = field(default=50.0)  # Percent
+    circuit_slow_call_seconds: float = field(default=30.0)
+    circuit_slow_call_rate: float = field(default=80.0)  # Percent
+    circuit_open_time: float = field(default=15.0)
+    circuit_half_open_calls: int = field(default=3)
+    
     # Model settings
     default_model: str = field(default="glm-4.5")
     vision_model: str = field(default="glm-4.5v")
     max_tokens: int = field(default=2000)
     temperature: float = field(default=0.7)
     
+    # Model routing (see routing.ModelRouter)
+    model_routing_enabled: bool = field(default=False)
+    model_aliases: Dict[str, str] = field(default_factory=dict)
+    route_fast_model: Optional[str] = field(default=None)
+    route_fast_max_chars: int = field(default=2000)
+    route_long_prompt_model: Optional[str] = field(default=None)
+    route_long_prompt_chars: int = field(default=100000)
+    
     # Request settings
     timeout: int = field(default=60)
     max_retries: int = field(default=3)
+    retry_base_delay: float = field(default=0.5)
+    retry_max_delay: float = field(default=8.0)
+    retry_budget_percent: float = field(default=20.0)
+    retry_budget_reserve: int = field(default=10)
+    single_pass_parsing: bool = field(default=False)
+    max_choices: int = field(default=8)
+    
+    # Hedged requests (non-streaming only)
+    hedge_enabled: bool = field(default=False)
+    hedge_percentile: float = field(default=95.0)
+    hedge_min_delay: float = field(default=1.0)
+    hedge_budget_percent: float = field(default=5.0)
+    
+    # Upstream connection pool
+    pool_max_connections: int = field(default=100)
+    pool_max_keepalive: int = field(default=20)
+    pool_keepalive_expiry: float = field(default=30.0)
+    http2: bool = field(default=True)
+    
+    # Upstream concurrency limit
+    upstream_limit_mode: str = field(default="off")
+    upstream_limit: int = field(default=32)
+    upstream_limit_min: int = field(default=4)
+    upstream_limit_max: int = field(default=256)
+    upstream_queue_size: int = field(default=256)
+    upstream_queue_timeout: float = field(default=30.0)
+    upstream_reject_status: int = field(default=503)
+    upstream_latency_tolerance: float = field(default=2.0)
+    
+    # Per-client quotas (0 disables)
+    quota_requests_per_minute: int = field(default=0)
+    quota_tokens_per_minute: int = field(default=0)
+    
+    # Response cache
+    cache_enabled: bool = field(default=False)
+    cache_max_bytes: int = field(default=64 * 1024 * 1024)
+    cache_ttl: int = field(default=3600)
+    cache_max_temperature: float = field(default=0.0)
+    cache_disk_path: Optional[str] = field(default=None)
+    cache_disk_max_bytes: int = field(default=1024 * 1024 * 1024)
+    
+    # Upstream prompt caching (see promptcache.PromptCache)
+    prompt_cache_strategy: str = field(default="off")
+    prompt_cache_min_tokens: int = field(default=1024)
+    
+    # Request coalescing
+    coalesce_enabled: bool = field(default=True)
+    coalesce_max_temperature: float = field(default=0.0)
+    
+    # Image handling
+    image_store_max_bytes: int = field(default=256 * 1024 * 1024)
+    image_max_edge: int = field(default=0)
+    image_format: str = field(default="")
+    image_quality: int = field(default=85)
+    image_workers: int = field(default=4)
+    
+    # Worker processes
+    workers: int = field(default=1)
+    worker_max_requests: int = field(default=0)
+    event_loop: str = field(default="auto")
+    http_parser: str = field(default="auto")
+    state_dir: Optional[str] = field(default=None)
+    
+    # Request timing
+    server_timing: bool = field(default=False)
+    trace_export_path: Optional[str] = field(default=None)
+    trace_export_max_bytes: int = field(default=64 * 1024 * 1024)
+    trace_export_backups: int = field(default=3)
+    
+    # Batch jobs (/v1/files and /v1/batches)
+    batch_enabled: bool = field(default=False)
+    batch_dir: Optional[str] = field(default=None)  # Defaults to state_dir/batches
+    batch_concurrency: int = field(default=8)
+    batch_max_requests: int = field(default=50000)
+    batch_max_file_bytes: int = field(default=200 * 1024 * 1024)
+    
+    # Traffic capture for replay
+    traffic_capture_path: Optional[str] = field(default=None)
+    traffic_capture_max_bytes: int = field(default=64 * 1024 * 1024)
     
     # Logging
     log_level: str = field(default="INFO")
@@ -41,12 +147,85 @@ class Config:
             port=int(os.getenv("PORT", "8000")),
             zai_api_key=os.getenv("ZAI_API_KEY"),
             zai_base_url=os.getenv("ZAI_BASE_URL", "https://api.z.ai/v1"),
+            upstreams=json.loads(os.getenv("UPSTREAMS") or "[]"),
+            upstream_eject_failures=int(os.getenv("UPSTREAM_EJECT_FAILURES", "5")),
+            upstream_eject_time=float(os.getenv("UPSTREAM_EJECT_TIME", "30")),
+            upstream_slow_start=float(os.getenv("UPSTREAM_SLOW_START", "30")),
+            circuit_breaker_enabled=os.getenv("CIRCUIT_BREAKER_ENABLED", "false").lower() == "true",
+            circuit_window=int(os.getenv("CIRCUIT_WINDOW", "20")),
+            circuit_min_calls=int(os.getenv("CIRCUIT_MIN_CALLS", "10")),
+            circuit_failure_rate=float(os.getenv("CIRCUIT_FAILURE_RATE", "50")),
+            circuit_slow_call_seconds=float(os.getenv("CIRCUIT_SLOW_CALL_SECONDS", "30")),
+            circuit_slow_call_rate=float(os.getenv("CIRCUIT_SLOW_CALL_RATE", "80")),
+            circuit_open_time=float(os.getenv("CIRCUIT_OPEN_TIME", "15")),
+            circuit_half_open_calls=int(os.getenv("CIRCUIT_HALF_OPEN_CALLS", "3")),
             default_model=os.getenv("DEFAULT_MODEL", "glm-4.5"),
             vision_model=os.getenv("VISION_MODEL", "glm-4.5v"),
             max_tokens=int(os.getenv("MAX_TOKENS", "2000")),
             temperature=float(os.getenv("TEMPERATURE", "0.7")),
+            model_routing_enabled=os.getenv("MODEL_ROUTING_ENABLED", "false").lower() == "true",
+            model_aliases=json.loads(os.getenv("MODEL_ALIASES") or "{}"),
+            route_fast_model=os.getenv("ROUTE_FAST_MODEL") or None,
+            route_fast_max_chars=int(os.getenv("ROUTE_FAST_MAX_CHARS", "2000")),
+            route_long_prompt_model=os.getenv("ROUTE_LONG_PROMPT_MODEL") or None,
+            route_long_prompt_chars=int(os.getenv("ROUTE_LONG_PROMPT_CHARS", "100000")),
             timeout=int(os.getenv("TIMEOUT", "60")),
             max_retries=int(os.getenv("MAX_RETRIES", "3")),
+            retry_base_delay=float(os.getenv("RETRY_BASE_DELAY", "0.5")),
+            retry_max_delay=float(os.getenv("RETRY_MAX_DELAY", "8")),
+            retry_budget_percent=float(os.getenv("RETRY_BUDGET_PERCENT", "20")),
+            retry_budget_reserve=int(os.getenv("RETRY_BUDGET_RESERVE", "10")),
+            single_pass_parsing=os.getenv("SINGLE_PASS_PARSING", "false").lower() == "true",
+            max_choices=int(os.getenv("MAX_CHOICES", "8")),
+            hedge_enabled=os.getenv("HEDGE_ENABLED", "false").lower() == "true",
+            hedge_percentile=float(os.getenv("HEDGE_PERCENTILE", "95")),
+            hedge_min_delay=float(os.getenv("HEDGE_MIN_DELAY", "1")),
+            hedge_budget_percent=float(os.getenv("HEDGE_BUDGET_PERCENT", "5")),
+            pool_max_connections=int(os.getenv("POOL_MAX_CONNECTIONS", "100")),
+            pool_max_keepalive=int(os.getenv("POOL_MAX_KEEPALIVE", "20")),
+            pool_keepalive_expiry=float(os.getenv("POOL_KEEPALIVE_EXPIRY", "30")),
+            http2=os.getenv("HTTP2", "true").lower() == "true",
+            upstream_limit_mode=os.getenv("UPSTREAM_LIMIT_MODE", "off"),
+            upstream_limit=int(os.getenv("UPSTREAM_LIMIT", "32")),
+            upstream_limit_min=int(os.getenv("UPSTREAM_LIMIT_MIN", "4")),
+            upstream_limit_max=int(os.getenv("UPSTREAM_LIMIT_MAX", "256")),
+            upstream_queue_size=int(os.getenv("UPSTREAM_QUEUE_SIZE", "256")),
+            upstream_queue_timeout=float(os.getenv("UPSTREAM_QUEUE_TIMEOUT", "30")),
+            upstream_reject_status=int(os.getenv("UPSTREAM_REJECT_STATUS", "503")),
+            upstream_latency_tolerance=float(os.getenv("UPSTREAM_LATENCY_TOLERANCE", "2")),
+            quota_requests_per_minute=int(os.getenv("QUOTA_REQUESTS_PER_MINUTE", "0")),
+            quota_tokens_per_minute=int(os.getenv("QUOTA_TOKENS_PER_MINUTE", "0")),
+            cache_enabled=os.getenv("CACHE_ENABLED", "false").lower() == "true",
+            cache_max_bytes=int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+            cache_ttl=int(os.getenv("CACHE_TTL", "3600")),
+            cache_max_temperature=float(os.getenv("CACHE_MAX_TEMPERATURE", "0")),
+            cache_disk_path=os.getenv("CACHE_DISK_PATH") or None,
+            cache_disk_max_bytes=int(os.getenv("CACHE_DISK_MAX_BYTES", str(1024 * 1024 * 1024))),
+            prompt_cache_strategy=os.getenv("PROMPT_CACHE_STRATEGY", "off").lower(),
+            prompt_cache_min_tokens=int(os.getenv("PROMPT_CACHE_MIN_TOKENS", "1024")),
+            coalesce_enabled=os.getenv("COALESCE_ENABLED", "true").lower() == "true",
+            coalesce_max_temperature=float(os.getenv("COALESCE_MAX_TEMPERATURE", "0")),
+            image_store_max_bytes=int(os.getenv("IMAGE_STORE_MAX_BYTES", str(256 * 1024 * 1024))),
+            image_max_edge=int(os.getenv("IMAGE_MAX_EDGE", "0")),
+            image_format=os.getenv("IMAGE_FORMAT", ""),
+            image_quality=int(os.getenv("IMAGE_QUALITY", "85")),
+            image_workers=int(os.getenv("IMAGE_WORKERS", "4")),
+            workers=int(os.getenv("WORKERS", "1")),
+            worker_max_requests=int(os.getenv("WORKER_MAX_REQUESTS", "0")),
+            event_loop=os.getenv("EVENT_LOOP", "auto"),
+            http_parser=os.getenv("HTTP_PARSER", "auto"),
+            state_dir=os.getenv("STATE_DIR") or None,
+            server_timing=os.getenv("SERVER_TIMING", "false").lower() == "true",
+            trace_export_path=os.getenv("TRACE_EXPORT_PATH") or None,
+            trace_export_max_bytes=int(os.getenv("TRACE_EXPORT_MAX_BYTES", str(64 * 1024 * 1024))),
+            trace_export_backups=int(os.getenv("TRACE_EXPORT_BACKUPS", "3")),
+            batch_enabled=os.getenv("BATCH_ENABLED", "false").lower() == "true",
+            batch_dir=os.getenv("BATCH_DIR") or None,
+            batch_concurrency=int(os.getenv("BATCH_CONCURRENCY", "8")),
+            batch_max_requests=int(os.getenv("BATCH_MAX_REQUESTS", "50000")),
+            batch_max_file_bytes=int(os.getenv("BATCH_MAX_FILE_BYTES", str(200 * 1024 * 1024))),
+            traffic_capture_path=os.getenv("TRAFFIC_CAPTURE_PATH") or None,
+            traffic_capture_max_bytes=int(os.getenv("TRAFFIC_CAPTURE_MAX_BYTES", str(64 * 1024 * 1024))),
             log_level=os.getenv("LOG_LEVEL", "INFO"),
             log_requests=os.getenv("LOG_REQUESTS", "true").lower() == "true",
         )
@@ -64,4 +243,189 @@ class Config:
         
         if self.timeout < 1:
             raise ValueError(f"timeout must be positive: {self.timeout}")
-
+        
+        if self.max_retries < 0:
+            raise ValueError(f"max_retries must not be negative: {self.max_retries}")
+        
+        if not 0 < self.retry_base_delay <= self.retry_max_delay:
+            raise ValueError(
+                f"retry_base_delay must be positive and at most retry_max_delay: {self.retry_base_delay}"
+            )
+        
+        if not 0 <= self.retry_budget_percent <= 100:
+            raise ValueError(f"retry_budget_percent must be between 0 and 100: {self.retry_budget_percent}")
+        
+        if self.cache_max_bytes < 1:
+            raise ValueError(f"cache_max_bytes must be positive: {self.cache_max_bytes}")
+        
+        if self.cache_disk_max_bytes < 1:
+            raise ValueError(f"cache_disk_max_bytes must be positive: {self.cache_disk_max_bytes}")
+        
+        if self.cache_ttl < 1:
+            raise ValueError(f"cache_ttl must be positive: {self.cache_ttl}")
+        
+        if self.image_store_max_bytes < 0:
+            raise ValueError(f"image_store_max_bytes must not be negative: {self.image_store_max_bytes}")
+        
+        if self.image_max_edge < 0:
+            raise ValueError(f"image_max_edge must not be negative: {self.image_max_edge}")
+        
+        if self.image_format.lower() not in ("", "jpeg", "webp", "png"):
+            raise ValueError(f"image_format must be one of jpeg, webp, png: {self.image_format}")
+        
+        if not 1 <= self.image_quality <= 100:
+            raise ValueError(f"image_quality must be between 1 and 100: {self.image_quality}")
+        
+        if self.image_workers < 1:
+            raise ValueError(f"image_workers must be positive: {self.image_workers}")
+        
+        if self.pool_max_connections < 1:
+            raise ValueError(f"pool_max_connections must be positive: {self.pool_max_connections}")
+        
+        if not 0 <= self.pool_max_keepalive <= self.pool_max_connections:
+            raise ValueError(
+                f"pool_max_keepalive must be between 0 and pool_max_connections: {self.pool_max_keepalive}"
+            )
+        
+        if self.pool_keepalive_expiry < 0:
+            raise ValueError(f"pool_keepalive_expiry must not be negative: {self.pool_keepalive_expiry}")
+        
+        if self.workers < 1:
+            raise ValueError(f"workers must be positive: {self.workers}")
+        
+        if self.worker_max_requests < 0:
+            raise ValueError(f"worker_max_requests must not be negative: {self.worker_max_requests}")
+        
+        if self.event_loop not in ("auto", "asyncio", "uvloop"):
+            raise ValueError(f"event_loop must be one of auto, asyncio, uvloop: {self.event_loop}")
+        
+        if self.http_parser not in ("auto", "h11", "httptools"):
+            raise ValueError(f"http_parser must be one of auto, h11, httptools: {self.http_parser}")
+        
+        if self.upstream_limit_mode not in ("off", "static", "adaptive"):
+            raise ValueError(
+                f"upstream_limit_mode must be one of off, static, adaptive: {self.upstream_limit_mode}"
+            )
+        
+        if not 1 <= self.upstream_limit_min <= self.upstream_limit <= self.upstream_limit_max:
+            raise ValueError(
+                "upstream_limit must be between upstream_limit_min and upstream_limit_max "
+                f"(and the minimum at least 1): {self.upstream_limit}"
+            )
+        
+        if self.upstream_queue_size < 0:
+            raise ValueError(f"upstream_queue_size must not be negative: {self.upstream_queue_size}")
+        
+        if self.upstream_queue_timeout <= 0:
+            raise ValueError(f"upstream_queue_timeout must be positive: {self.upstream_queue_timeout}")
+        
+        if self.upstream_reject_status not in (429, 503):
+            raise ValueError(f"upstream_reject_status must be 429 or 503: {self.upstream_reject_status}")
+        
+        if self.upstream_latency_tolerance <= 1:
+            raise ValueError(
+                f"upstream_latency_tolerance must be greater than 1: {self.upstream_latency_tolerance}"
+            )
+        
+        if self.quota_requests_per_minute < 0:
+            raise ValueError(
+                f"quota_requests_per_minute must not be negative: {self.quota_requests_per_minute}"
+            )
+        
+        if self.quota_tokens_per_minute < 0:
+            raise ValueError(
+                f"quota_tokens_per_minute must not be negative: {self.quota_tokens_per_minute}"
+            )
+        
+        if self.trace_export_max_bytes < 1:
+            raise ValueError(f"trace_export_max_bytes must be positive: {self.trace_export_max_bytes}")
+        
+        if self.trace_export_backups < 0:
+            raise ValueError(f"trace_export_backups must not be negative: {self.trace_export_backups}")
+        
+        if self.traffic_capture_max_bytes < 1:
+            raise ValueError(f"traffic_capture_max_bytes must be positive: {self.traffic_capture_max_bytes}")
+        
+        if self.max_choices < 1:
+            raise ValueError(f"max_choices must be positive: {self.max_choices}")
+        
+        if self.batch_enabled and not (self.batch_dir or self.state_dir):
+            raise ValueError("batch_enabled requires batch_dir or state_dir")
+        
+        if self.batch_concurrency < 1:
+            raise ValueError(f"batch_concurrency must be positive: {self.batch_concurrency}")
+        
+        if self.batch_max_requests < 1:
+            raise ValueError(f"batch_max_requests must be positive: {self.batch_max_requests}")
+        
+        if self.batch_max_file_bytes < 1:
+            raise ValueError(f"batch_max_file_bytes must be positive: {self.batch_max_file_bytes}")
+        
+        if not 0 < self.hedge_percentile < 100:
+            raise ValueError(f"hedge_percentile must be between 0 and 100: {self.hedge_percentile}")
+        
+        if self.hedge_min_delay < 0:
+            raise ValueError(f"hedge_min_delay must not be negative: {self.hedge_min_delay}")
+        
+        if self.hedge_budget_percent < 0:
+            raise ValueError(f"hedge_budget_percent must not be negative: {self.hedge_budget_percent}")
+        
+        if not isinstance(self.upstreams, list):
+            raise ValueError(f"upstreams must be a list: {self.upstreams}")
+        
+        for upstream in self.upstreams:
+            if not isinstance(upstream, dict) or not isinstance(upstream.get("base_url"), str):
+                raise ValueError(f"Each upstream needs a base_url: {upstream}")
+            unknown = set(upstream) - {"base_url", "api_key", "weight", "name", "max_connections"}
+            if unknown:
+                raise ValueError(f"Unknown upstream settings: {', '.join(sorted(unknown))}")
+            if float(upstream.get("weight", 1.0)) <= 0:
+                raise ValueError(f"Upstream weight must be positive: {upstream['weight']}")
+            if int(upstream.get("max_connections", 1)) < 1:
+                raise ValueError(f"Upstream max_connections must be positive: {upstream['max_connections']}")
+        
+        if self.upstream_eject_failures < 0:
+            raise ValueError(f"upstream_eject_failures must not be negative: {self.upstream_eject_failures}")
+        
+        if self.upstream_eject_time <= 0:
+            raise ValueError(f"upstream_eject_time must be positive: {self.upstream_eject_time}")
+        
+        if self.upstream_slow_start < 0:
+            raise ValueError(f"upstream_slow_start must not be negative: {self.upstream_slow_start}")
+        
+        if not 1 <= self.circuit_min_calls <= self.circuit_window:
+            raise ValueError(
+                f"circuit_min_calls must be between 1 and circuit_window: {self.circuit_min_calls}"
+            )
+        
+        if not 0 < self.circuit_failure_rate <= 100:
+            raise ValueError(f"circuit_failure_rate must be between 0 and 100: {self.circuit_failure_rate}")
+        
+        if not 0 < self.circuit_slow_call_rate <= 100:
+            raise ValueError(f"circuit_slow_call_rate must be between 0 and 100: {self.circuit_slow_call_rate}")
+        
+        if self.circuit_slow_call_seconds <= 0:
+            raise ValueError(f"circuit_slow_call_seconds must be positive: {self.circuit_slow_call_seconds}")
+        
+        if self.circuit_open_time <= 0:
+            raise ValueError(f"circuit_open_time must be positive: {self.circuit_open_time}")
+        
+        if self.circuit_half_open_calls < 1:
+            raise ValueError(f"circuit_half_open_calls must be positive: {self.circuit_half_open_calls}")
+        
+        if not isinstance(self.model_aliases, dict) or not all(
+            isinstance(alias, str) and isinstance(model, str) for alias, model in self.model_aliases.items()
+        ):
+            raise ValueError(f"model_aliases must map model names to model names: {self.model_aliases}")
+        
+        if self.route_fast_max_chars < 0:
+            raise ValueError(f"route_fast_max_chars must not be negative: {self.route_fast_max_chars}")
+        
+        if self.route_long_prompt_chars < 0:
+            raise ValueError(f"route_long_prompt_chars must not be negative: {self.route_long_prompt_chars}")
+        
+        if self.prompt_cache_strategy not in ("off", "system", "history"):
+            raise ValueError(f"prompt_cache_strategy must be off, system or history: {self.prompt_cache_strategy}")
+        
+        if self.prompt_cache_min_tokens < 0:
+            raise ValueError(f"prompt_cache_min_tokens must not be negative: {self.prompt_cache_min_tokens}")
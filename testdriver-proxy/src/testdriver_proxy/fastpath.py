@@ -0,0 +1,29 @@
+"""
+Raw-body parsing for chat completion requests
+"""
+
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+
+from .models import ChatCompletionRequest
+
+
+def parse_chat_request(body: bytes) -> ChatCompletionRequest:
+    """Parse and validate a raw request body in a single pass.
+
+    FastAPI decodes the body with ``json.loads`` and then validates the
+    resulting dict tree, so every multi-megabyte image string exists as a
+    Python object before the model is even built. Here pydantic-core reads the
+    bytes directly and builds the model as it goes; content parts end up as
+    plain dicts referenced by the upstream request. Validation is as full as
+    on the regular endpoint: skipping it for ``messages`` saves nothing, since
+    building the image strings is what costs time and memory. Raises
+    ``RequestValidationError`` so clients get the same 422 response as with
+    the regular endpoint.
+    """
+    try:
+        return ChatCompletionRequest.model_validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError(
+            [{**error, "loc": ("body", *error["loc"])} for error in e.errors(include_input=False)]
+        ) from e
@@ -0,0 +1,136 @@
+"""
+Hedged upstream requests
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, TypeVar
+
+from .config import Config
+from .metrics import MAX_MODELS, OTHER_MODEL, Metrics
+from .retry import RetryBudget
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class HedgePolicy:
+    """Sends a second copy of a slow request and keeps whichever answers first.
+    
+    The hedge delay is the ``percentile`` of recent latencies for the same
+    model (never below ``min_delay``), so only the slowest few requests are
+    duplicated. Hedges withdraw from a token bucket filled by
+    ``budget_percent / 100`` per request, which caps the extra upstream
+    load even when the whole upstream slows down.
+    """
+    
+    WINDOW = 512  # Latencies kept per model
+    MIN_SAMPLES = 20  # No hedging until a model has this many
+    RESERVE = 5
+    
+    def __init__(self, config: Config, metrics: Optional[Metrics] = None):
+        self.enabled = config.hedge_enabled
+        self.percentile = config.hedge_percentile
+        self.min_delay = config.hedge_min_delay
+        self.budget = RetryBudget(config.hedge_budget_percent, self.RESERVE)
+        self.metrics = metrics
+        self.hedged = 0
+        self.won = 0
+        self.budget_exhausted = 0
+        self._latencies: Dict[str, Deque[float]] = {}
+    
+    def _window(self, model: str) -> Deque[float]:
+        window = self._latencies.get(model)
+        if window is None:
+            # Models are client-supplied; past this many they share a window
+            if len(self._latencies) >= MAX_MODELS:
+                model = OTHER_MODEL
+            window = self._latencies.setdefault(model, deque(maxlen=self.WINDOW))
+        return window
+    
+    def observe(self, model: str, latency: float) -> None:
+        self._window(model).append(latency)
+    
+    def delay(self, model: str) -> Optional[float]:
+        """How long to wait for a response before hedging, or None to never hedge"""
+        if not self.enabled:
+            return None
+        window = self._window(model)
+        if len(window) < self.MIN_SAMPLES:
+            return None
+        ordered = sorted(window)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return max(self.min_delay, ordered[index])
+    
+    async def call(
+        self,
+        model: str,
+        send: Callable[[], Awaitable[T]],
+        may_hedge: Callable[[], bool] = lambda: True,
+    ) -> T:
+        """Run ``send``, and again in parallel if the first is slow; returns the first success
+        
+        ``may_hedge`` is asked at the moment a hedge would be sent, so the
+        caller can hold back when the upstream is already saturated. The
+        request still running once the other succeeded is cancelled. If
+        both fail, the first request's error is raised.
+        """
+        delay = self.delay(model)
+        started = time.monotonic()
+        if delay is None:
+            result = await send()
+            if self.enabled:
+                self.observe(model, time.monotonic() - started)
+            return result
+        
+        self.budget.deposit()
+        tasks: List["asyncio.Task[T]"] = [asyncio.ensure_future(send())]
+        try:
+            await asyncio.wait(tasks, timeout=delay)
+            if not tasks[0].done() and may_hedge():
+                if self.budget.withdraw():
+                    logger.debug(f"No {model} response after {delay:.2f}s, sending a hedged request")
+                    self.hedged += 1
+                    tasks.append(asyncio.ensure_future(send()))
+                else:
+                    self.budget_exhausted += 1
+            
+            pending = set(tasks)
+            while pending:
+                _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for winner, task in enumerate(tasks):
+                    if task.done() and not task.cancelled() and task.exception() is None:
+                        # For a hedge win this is only a lower bound of the first
+                        # request's latency, which is what the window needs
+                        self.observe(model, time.monotonic() - started)
+                        if len(tasks) > 1:
+                            self._record(winner)
+                        return task.result()
+            return tasks[0].result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    # Mark the loser's error as seen
+                    task.exception()
+    
+    def _record(self, winner: int) -> None:
+        """Count which request of a hedged pair answered first"""
+        if winner:
+            self.won += 1
+        if self.metrics is not None:
+            self.metrics.hedges.inc(("hedge" if winner else "original",))
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "hedged": self.hedged,
+            "won": self.won,
+            "budget_exhausted": self.budget_exhausted,
+            "budget_balance": round(self.budget.balance, 2),
+            "delays": {model: self.delay(model) for model in sorted(self._latencies)},
+        }
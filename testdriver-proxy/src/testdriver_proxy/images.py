@@ -0,0 +1,274 @@
+"""
+Image handling for vision requests: content-addressed store and preprocessing
+"""
+
+import asyncio
+import base64
+import hashlib
+import io
+import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ImageEntry:
+    """The upstream form of an image, shared by every request that carries it.
+
+    ``key`` is the digest of the payload when images are preprocessed, or
+    the client's data URL itself when they are only converted.
+    """
+    key: str
+    media_type: str
+    data: str
+
+    @property
+    def size(self) -> int:
+        return len(self.key) + len(self.data)
+
+
+def image_digest(data: str) -> str:
+    """Content address of a base64 payload; hashes megabytes, so run it off the loop"""
+    return hashlib.blake2b(data.encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
+
+
+def parse_data_url(url: str) -> Optional[Tuple[str, str]]:
+    """Split ``data:<media_type>;base64,<data>`` into its media type and payload"""
+    if not url.startswith("data:"):
+        return None
+    header, sep, data = url.partition(",")
+    if not sep or not header.endswith(";base64"):
+        return None
+    return header[len("data:"):-len(";base64")] or "application/octet-stream", data
+
+
+def image_payload(part: Dict[str, Any]) -> Optional[Tuple[str, str]]:
+    """Return ``(media_type, base64_data)`` for an inline image content part"""
+    part_type = part.get("type")
+    if part_type == "image_url":
+        image_url = part.get("image_url")
+        url = image_url.get("url") if isinstance(image_url, dict) else image_url
+        return parse_data_url(url) if isinstance(url, str) else None
+    if part_type == "image":
+        source = part.get("source") or {}
+        if source.get("type") == "base64" and isinstance(source.get("data"), str):
+            return source.get("media_type", "image/png"), source["data"]
+    return None
+
+
+class ImageStore:
+    """Bounded LRU of the upstream form of images.
+
+    Agent conversations resend the same screenshots on every turn, so each
+    is converted, resized and re-encoded once. Preprocessed images are keyed
+    by the digest of their payload, so neither the client's payload nor the
+    decoded pixels stay resident. Images sent as is are keyed by their data
+    URL: Python caches a string's hash and compares equal strings without
+    allocating, so a repeat costs no copy of its payload.
+    """
+
+    def __init__(self, config: Config):
+        self.max_bytes = config.image_store_max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_deduplicated = 0
+        self._entries: "OrderedDict[str, ImageEntry]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str, payload_bytes: int = 0) -> Optional[ImageEntry]:
+        """Look up an image by the digest of its payload or by its data URL"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        self.bytes_deduplicated += payload_bytes
+        return entry
+
+    def put(self, entry: ImageEntry) -> None:
+        """Store an image, evicting the least recently used ones"""
+        if entry.size > self.max_bytes:
+            return
+        previous = self._entries.pop(entry.key, None)
+        if previous is not None:
+            self.size -= previous.size
+        self._entries[entry.key] = entry
+        self.size += entry.size
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= evicted.size
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "bytes_deduplicated": self.bytes_deduplicated,
+        }
+
+
+class ImagePipeline:
+    """Converts image parts to Anthropic ``image`` blocks and shrinks them.
+
+    With no resizing or re-encoding configured, parts are only converted to
+    the native block format: payloads are never decoded or hashed, and the
+    converted form is kept in the ``ImageStore`` under the data URL so a
+    repeated screenshot is not sliced out of it again. Otherwise hashing,
+    decoding, resizing and re-encoding run in a thread pool (hashlib and
+    Pillow release the GIL for the heavy work) so the event loop is never
+    blocked, and results are kept in the ``ImageStore`` so a screenshot
+    repeated across turns is processed once. Resizing needs the optional
+    ``pillow`` package.
+    """
+
+    FORMATS = {"jpeg": "image/jpeg", "webp": "image/webp", "png": "image/png"}
+
+    def __init__(self, config: Config, store: ImageStore):
+        self.store = store
+        self.max_edge = config.image_max_edge
+        self.format = config.image_format.lower()
+        self.quality = config.image_quality
+        self.executor = ThreadPoolExecutor(
+            max_workers=config.image_workers, thread_name_prefix="image-pipeline"
+        )
+        self.processed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+        self.failed = 0
+
+        if self.resizing and Image is None:
+            logger.warning("Image preprocessing requested but Pillow is not installed; images are sent as is")
+
+    @property
+    def resizing(self) -> bool:
+        return bool(self.max_edge or self.format)
+
+    async def process_part(self, part: Dict[str, Any]) -> Dict[str, Any]:
+        """Return the upstream form of a content part"""
+        part_type = part.get("type")
+        if part_type not in ("image_url", "image"):
+            return part
+
+        if not self.resizing or Image is None:
+            entry = self._convert(part)
+            if entry is not None:
+                return {
+                    "type": "image",
+                    "source": {"type": "base64", "media_type": entry.media_type, "data": entry.data},
+                }
+
+        payload = image_payload(part)
+        if payload is None:
+            url = part.get("image_url")
+            url = url.get("url") if isinstance(url, dict) else url
+            if part_type == "image_url" and isinstance(url, str):
+                return {"type": "image", "source": {"type": "url", "url": url}}
+            return part
+
+        media_type, data = payload
+        if self.resizing and Image is not None:
+            media_type, data = await self._preprocess(media_type, data)
+        return {
+            "type": "image",
+            "source": {"type": "base64", "media_type": media_type, "data": data},
+        }
+
+    def _convert(self, part: Dict[str, Any]) -> Optional[ImageEntry]:
+        """The converted form of a data URL part, from the store if it was seen before"""
+        if part.get("type") != "image_url":
+            return None
+        url = part.get("image_url")
+        url = url.get("url") if isinstance(url, dict) else url
+        if not isinstance(url, str) or not url.startswith("data:"):
+            return None
+        entry = self.store.get(url, len(url))
+        if entry is None:
+            payload = parse_data_url(url)
+            if payload is None:
+                return None
+            entry = ImageEntry(url, *payload)
+            self.store.put(entry)
+        return entry
+
+    async def _preprocess(self, media_type: str, data: str) -> Tuple[str, str]:
+        """The shrunk form of a payload, from the store if it was seen before"""
+        loop = asyncio.get_running_loop()
+        digest = await loop.run_in_executor(self.executor, image_digest, data)
+        entry = self.store.get(digest, len(data))
+        if entry is None:
+            try:
+                shrunk = await loop.run_in_executor(self.executor, self._shrink, media_type, data)
+            except (OSError, ValueError, Image.DecompressionBombError) as e:
+                # Also invalid base64; stored as is so it is not retried every turn
+                logger.warning(f"Failed to preprocess image {digest}: {e}")
+                self.failed += 1
+                shrunk = media_type, data
+            entry = ImageEntry(digest, *shrunk)
+            self.store.put(entry)
+        return entry.media_type, entry.data
+
+    def _shrink(self, media_type: str, data: str) -> Tuple[str, str]:
+        """Resize and re-encode an image; keeps an unresized original if that is smaller"""
+        started = time.perf_counter()
+        decoded = base64.b64decode(data, validate=True)
+        with Image.open(io.BytesIO(decoded)) as image:
+            image.load()
+            resized = bool(self.max_edge) and max(image.size) > self.max_edge
+            if resized:
+                image.thumbnail((self.max_edge, self.max_edge), Image.Resampling.LANCZOS)
+
+            target = self.format or (image.format or "png").lower()
+            target_type = self.FORMATS.get(target, media_type)
+            if target == "jpeg" and image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+
+            buffer = io.BytesIO()
+            save_args = {"optimize": True} if target == "png" else {"quality": self.quality}
+            image.save(buffer, format=target.upper(), **save_args)
+
+        encoded = buffer.getvalue()
+        self.processed += 1
+        self.bytes_in += len(decoded)
+        self.seconds += time.perf_counter() - started
+        if not resized and len(encoded) >= len(decoded):
+            self.bytes_out += len(decoded)
+            return media_type, data
+        self.bytes_out += len(encoded)
+        return target_type, base64.b64encode(encoded).decode("ascii")
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_edge": self.max_edge,
+            "format": self.format or None,
+            "processed": self.processed,
+            "failed": self.failed,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "bytes_saved": self.bytes_in - self.bytes_out,
+            "seconds": round(self.seconds, 3),
+        }
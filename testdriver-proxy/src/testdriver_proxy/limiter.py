@@ -0,0 +1,220 @@
+"""
+Upstream concurrency limiting with a bounded wait queue
+"""
+
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+import httpx
+
+from .config import Config
+from .timing import phase
+
+logger = logging.getLogger(__name__)
+
+# Upstream statuses that mean "send less"
+OVERLOAD_STATUS_CODES = frozenset({429, 503, 529})
+
+
+class LimitExceeded(Exception):
+    """Raised when a request cannot get an upstream slot in time"""
+    
+    def __init__(self, status_code: int, reason: str, retry_after: int = 1):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Slot:
+    """An acquired upstream slot; ``record`` reports how the call went"""
+    
+    __slots__ = ("started", "status_code", "latency")
+    
+    def __init__(self) -> None:
+        self.started = time.monotonic()
+        self.status_code: Optional[int] = None
+        self.latency: Optional[float] = None
+    
+    def record(self, status_code: int) -> None:
+        """Report the upstream status once response headers arrived"""
+        self.status_code = status_code
+        self.latency = time.monotonic() - self.started
+
+
+class ConcurrencyLimiter:
+    """Caps concurrent upstream calls and queues the excess.
+    
+    In ``static`` mode the limit is fixed. In ``adaptive`` mode it follows
+    AIMD: it grows by about one per round trip while the limit is in use and
+    shrinks multiplicatively when the upstream answers 429/503/529, times out,
+    or when short-term latency rises above ``latency_tolerance`` times the
+    long-term average (requests are queueing upstream). Decreases are spaced
+    by at least one round trip so a burst of 429s counts as one signal.
+    
+    Requests beyond the limit wait in a FIFO queue of ``queue_size`` entries
+    for up to ``queue_timeout`` seconds; when the queue is full they are
+    rejected immediately.
+    """
+    
+    BACKOFF_RATIO = 0.9
+    SHORT_ALPHA = 0.2
+    LONG_ALPHA = 0.02
+    WARMUP_SAMPLES = 10
+    
+    def __init__(self, config: Config):
+        self.mode = config.upstream_limit_mode
+        self.enabled = self.mode != "off"
+        self.adaptive = self.mode == "adaptive"
+        self.limit = float(config.upstream_limit)
+        self.min_limit = config.upstream_limit_min
+        self.max_limit = config.upstream_limit_max
+        self.queue_size = config.upstream_queue_size
+        self.queue_timeout = config.upstream_queue_timeout
+        self.reject_status = config.upstream_reject_status
+        self.latency_tolerance = config.upstream_latency_tolerance
+        
+        self.in_flight = 0
+        self.queued_total = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.increases = 0
+        self.decreases = 0
+        self.short_latency: Optional[float] = None
+        self.long_latency: Optional[float] = None
+        self._samples = 0
+        self._last_decrease = 0.0
+        self._waiters: Deque["asyncio.Future[None]"] = deque()
+    
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+    
+    @property
+    def current_limit(self) -> int:
+        return max(1, int(self.limit))
+    
+    def check(self) -> None:
+        """Reject immediately when a new request could not even be queued"""
+        if not self.enabled:
+            return
+        saturated = self.in_flight >= self.current_limit or self._waiters
+        if saturated and len(self._waiters) >= self.queue_size:
+            self.rejected += 1
+            raise LimitExceeded(self.reject_status, "Upstream concurrency limit reached and queue is full")
+    
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[Slot]:
+        """Hold an upstream slot for the duration of the block"""
+        if not self.enabled:
+            yield Slot()
+            return
+        
+        if self.in_flight < self.current_limit and not self._waiters:
+            self.in_flight += 1
+        else:
+            with phase("queue"):
+                await self._wait()
+        
+        slot = Slot()
+        failed = False
+        try:
+            yield slot
+        except (httpx.TimeoutException, asyncio.TimeoutError):
+            failed = True
+            raise
+        finally:
+            self.in_flight -= 1
+            if self.adaptive:
+                self._update(slot, failed)
+            self._wake()
+    
+    async def _wait(self) -> None:
+        """Queue until ``_wake`` hands this request a slot"""
+        self.check()
+        future: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        self.queued_total += 1
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise LimitExceeded(
+                self.reject_status,
+                f"Timed out after {self.queue_timeout:g}s waiting for an upstream slot",
+                retry_after=max(1, math.ceil(self.queue_timeout)),
+            ) from None
+        except BaseException:
+            # Cancelled after being handed a slot: pass it on
+            if future.done() and not future.cancelled():
+                self.in_flight -= 1
+                self._wake()
+            raise
+        finally:
+            if future in self._waiters:
+                self._waiters.remove(future)
+    
+    def _wake(self) -> None:
+        # Hand freed slots to waiters in FIFO order, counting them as taken
+        # right away so new arrivals cannot jump the queue
+        while self.in_flight < self.current_limit and self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+    
+    def _update(self, slot: Slot, failed: bool) -> None:
+        now = time.monotonic()
+        if failed or slot.status_code in OVERLOAD_STATUS_CODES:
+            self._decrease(now, "upstream overloaded" if not failed else "upstream timeout")
+            return
+        if slot.latency is None:
+            return  # Cancelled or errored before headers: no signal
+        
+        self._samples += 1
+        if self.short_latency is None:
+            self.short_latency = self.long_latency = slot.latency
+        else:
+            self.short_latency += self.SHORT_ALPHA * (slot.latency - self.short_latency)
+            self.long_latency += self.LONG_ALPHA * (slot.latency - self.long_latency)
+        
+        if (
+            self._samples >= self.WARMUP_SAMPLES
+            and self.short_latency > self.long_latency * self.latency_tolerance
+        ):
+            self._decrease(now, "latency rising")
+        elif self.in_flight + 1 >= self.limit / 2 and self.limit < self.max_limit:
+            # Only grow while the limit is actually being used
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.increases += 1
+    
+    def _decrease(self, now: float, reason: str) -> None:
+        if now - self._last_decrease < (self.short_latency or 0.0):
+            return
+        self._last_decrease = now
+        previous = self.current_limit
+        self.limit = max(float(self.min_limit), self.limit * self.BACKOFF_RATIO)
+        self.decreases += 1
+        if self.current_limit != previous:
+            logger.info(f"Upstream concurrency limit {previous} -> {self.current_limit} ({reason})")
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "limit": self.current_limit,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "queue_size": self.queue_size,
+            "queued_total": self.queued_total,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "increases": self.increases,
+            "decreases": self.decreases,
+            "short_latency": round(self.short_latency, 4) if self.short_latency is not None else None,
+            "long_latency": round(self.long_latency, 4) if self.long_latency is not None else None,
+        }
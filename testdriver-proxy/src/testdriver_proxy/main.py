@@ -3,10 +3,26 @@ Main entry point for TestDriver Proxy
 """
 
 import logging
+import multiprocessing
+import random
+import shutil
+import signal
+import socket
 import sys
+import tempfile
+import time
+from dataclasses import replace
+from multiprocessing.connection import wait
+from typing import Dict, Optional
 from .config import Config
 from .proxy import create_app
 
+# A worker that dies sooner than this after starting is treated as a boot failure
+MIN_WORKER_UPTIME = 1.0
+
+# Seconds a worker gets to finish in-flight requests on shutdown
+GRACEFUL_SHUTDOWN_TIMEOUT = 30.0
+
 
 def setup_logging(log_level: str) -> None:
     """Configure logging"""
@@ -17,6 +33,130 @@ def setup_logging(log_level: str) -> None:
     )
 
 
+def bind_socket(host: str, port: int, reuse_port: bool = False) -> socket.socket:
+    """Create a listening TCP socket, optionally with SO_REUSEPORT"""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def serve(config: Config, sock: Optional[socket.socket] = None, max_requests: Optional[int] = None) -> None:
+    """Run one server process; binds its own SO_REUSEPORT socket if none is given"""
+    import uvicorn
+    
+    setup_logging(config.log_level)
+    if sock is None:
+        sock = bind_socket(config.host, config.port, reuse_port=True)
+    
+    server = uvicorn.Server(
+        uvicorn.Config(
+            create_app(config),
+            loop=config.event_loop,
+            http=config.http_parser,
+            log_level=config.log_level.lower(),
+            limit_max_requests=max_requests,
+            timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_TIMEOUT,
+        )
+    )
+    server.run(sockets=[sock])
+
+
+class WorkerSupervisor:
+    """Preforks worker processes and replaces them when they exit.
+    
+    Each worker binds its own listening socket with SO_REUSEPORT so the kernel
+    spreads connections across processes; where SO_REUSEPORT is unavailable a
+    single socket is bound here and shared with every worker. Workers are
+    recycled after ``worker_max_requests`` requests (with up to 10% jitter so
+    they do not all restart at once). State that has to be shared, such as the
+    response cache, lives in SQLite files under ``state_dir``, which defaults
+    to a temporary directory removed on exit.
+    """
+    
+    def __init__(self, config: Config):
+        self.config = config
+        self.reuse_port = hasattr(socket, "SO_REUSEPORT")
+        self.restarts = 0
+        self._context = multiprocessing.get_context("spawn")
+        self._processes: Dict[int, multiprocessing.process.BaseProcess] = {}
+        self._started_at: Dict[int, float] = {}
+        self._stopping = False
+        self._logger = logging.getLogger(__name__)
+    
+    def _max_requests(self) -> Optional[int]:
+        limit = self.config.worker_max_requests
+        if not limit:
+            return None
+        return limit + random.randint(0, limit // 10)
+    
+    def _spawn(self, index: int, sock: Optional[socket.socket]) -> None:
+        process = self._context.Process(
+            target=serve,
+            args=(self.config, sock, self._max_requests()),
+            name=f"testdriver-proxy-worker-{index}",
+        )
+        process.start()
+        self._processes[index] = process
+        self._started_at[index] = time.monotonic()
+        self._logger.info(f"Started worker {index} (pid {process.pid})")
+    
+    def _stop(self, signum: int, frame: object) -> None:
+        self._stopping = True
+    
+    def run(self) -> None:
+        temp_dir = None
+        if self.config.state_dir is None:
+            temp_dir = tempfile.mkdtemp(prefix="testdriver-proxy-")
+            self.config = replace(self.config, state_dir=temp_dir)
+        
+        sock = None if self.reuse_port else bind_socket(self.config.host, self.config.port)
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGTERM, self._stop)
+        
+        try:
+            for index in range(self.config.workers):
+                self._spawn(index, sock)
+            
+            while not self._stopping:
+                wait([p.sentinel for p in self._processes.values()], timeout=1.0)
+                for index, process in list(self._processes.items()):
+                    if process.is_alive() or self._stopping:
+                        continue
+                    uptime = time.monotonic() - self._started_at[index]
+                    if process.exitcode and uptime < MIN_WORKER_UPTIME:
+                        raise RuntimeError(
+                            f"Worker {index} failed to boot (exit code {process.exitcode})"
+                        )
+                    self._logger.info(
+                        f"Worker {index} (pid {process.pid}) exited with code {process.exitcode}, restarting"
+                    )
+                    self.restarts += 1
+                    self._spawn(index, sock)
+        finally:
+            self._shutdown()
+            if sock is not None:
+                sock.close()
+            if temp_dir is not None:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+    
+    def _shutdown(self) -> None:
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + GRACEFUL_SHUTDOWN_TIMEOUT + 5
+        for process in self._processes.values():
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.kill()
+                process.join()
+
+
 def main() -> None:
     """Main entry point"""
     try:
@@ -33,6 +173,12 @@ def main() -> None:
         logger.info(f"Default model: {config.default_model}")
         logger.info(f"Vision model: {config.vision_model}")
         
+        # Several workers, or recycled workers, need the supervisor
+        if config.workers > 1 or config.worker_max_requests:
+            logger.info(f"Workers: {config.workers}")
+            WorkerSupervisor(config).run()
+            return
+        
         # Create and run app
         app = create_app(config)
         
@@ -41,6 +187,8 @@ def main() -> None:
             app,
             host=config.host,
             port=config.port,
+            loop=config.event_loop,
+            http=config.http_parser,
             log_level=config.log_level.lower(),
         )
     
@@ -51,4 +199,3 @@ def main() -> None:
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,510 @@
+"""
+Prometheus metrics
+"""
+
+import asyncio
+import glob
+import json
+import logging
+import os
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not on Windows
+    fcntl = None
+
+from .cache import Completion
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TOKEN_RATE_BUCKETS = (1.0, 5.0, 10.0, 20.0, 30.0, 50.0, 75.0, 100.0, 150.0, 200.0, 300.0, 500.0, 1000.0)
+SIZE_BUCKETS = tuple(float(4 ** n * 256) for n in range(10))  # 256 B .. 64 MiB
+
+# Counters and histograms of every worker that has exited, added up
+EXITED_SNAPSHOT = "exited.json"
+
+# Models are client-supplied; past this many distinct names they share a label
+MAX_MODELS = 32
+OTHER_MODEL = "other"
+
+Labels = Tuple[str, ...]
+
+_current: ContextVar[Optional["RequestTracker"]] = ContextVar("testdriver_proxy_tracker", default=None)
+
+
+def current_tracker() -> Optional["RequestTracker"]:
+    """Tracker of the client request being handled, if any"""
+    return _current.get()
+
+
+class Counter:
+    """Monotonic counter; series are keyed by label values"""
+    
+    kind = "counter"
+    
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.series: Dict[Labels, float] = {}
+    
+    def inc(self, labels: Labels = (), amount: float = 1.0) -> None:
+        self.series[labels] = self.series.get(labels, 0.0) + amount
+    
+    def samples(self, series: Dict[Labels, Any]) -> Iterable[Tuple[str, Labels, Tuple[str, ...], float]]:
+        for labels, value in sorted(series.items()):
+            yield self.name, labels, self.labelnames, value
+    
+    @staticmethod
+    def merge(total: Any, value: Any) -> Any:
+        return total + value
+
+
+class Gauge(Counter):
+    """Value that goes up and down"""
+    
+    kind = "gauge"
+    
+    def set(self, value: float, labels: Labels = ()) -> None:
+        self.series[labels] = value
+
+
+class Histogram:
+    """Histogram with fixed buckets.
+    
+    Each series is one preallocated list: a count per bucket, one for values
+    above the last bucket, then the running sum. Observing is a bisect and two
+    increments; counts are made cumulative only when rendered.
+    """
+    
+    kind = "histogram"
+    
+    def __init__(
+        self, name: str, help: str, buckets: Tuple[float, ...], labelnames: Tuple[str, ...] = ()
+    ):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.labelnames = labelnames
+        self.series: Dict[Labels, List[float]] = {}
+    
+    def observe(self, value: float, labels: Labels = ()) -> None:
+        counts = self.series.get(labels)
+        if counts is None:
+            counts = self.series[labels] = [0.0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+    
+    def samples(self, series: Dict[Labels, Any]) -> Iterable[Tuple[str, Labels, Tuple[str, ...], float]]:
+        bucket_labelnames = (*self.labelnames, "le")
+        bounds = [_format(bound) for bound in self.buckets] + ["+Inf"]
+        for labels, counts in sorted(series.items()):
+            cumulative = 0.0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                yield f"{self.name}_bucket", (*labels, bound), bucket_labelnames, cumulative
+            yield f"{self.name}_sum", labels, self.labelnames, counts[-1]
+            yield f"{self.name}_count", labels, self.labelnames, cumulative
+    
+    @staticmethod
+    def merge(total: Any, value: Any) -> Any:
+        return [a + b for a, b in zip(total, value)]
+
+
+Metric = Counter | Histogram
+
+
+class RequestTracker:
+    """Timings and sizes of one client request, recorded as it progresses"""
+    
+    __slots__ = (
+        "metrics", "model", "stream", "started", "first_token", "finished", "request_size",
+        "response_size", "status", "duration", "prompt_tokens", "completion_tokens", "upstream_ttfb",
+        "on_finish",
+    )
+    
+    def __init__(self, metrics: "Metrics", model: str, stream: bool, request_size: Optional[int]):
+        self.metrics = metrics
+        self.model = metrics.model_label(model)
+        self.stream = "true" if stream else "false"
+        self.started = time.perf_counter()
+        self.first_token: Optional[float] = None
+        self.finished = False
+        self.request_size = request_size
+        self.response_size = 0
+        self.status: Optional[int] = None
+        self.duration = 0.0
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+        # Seconds from sending the last upstream call to its response headers
+        self.upstream_ttfb: Optional[float] = None
+        # Called with the tracker once the request has finished
+        self.on_finish: Optional[Callable[["RequestTracker"], None]] = None
+        metrics.in_flight.inc()
+        if request_size is not None:
+            metrics.request_size.observe(request_size)
+    
+    async def complete(self, completion: Optional[Completion]) -> None:
+        """Record token usage once the completion is known"""
+        if completion is None:
+            return
+        self.prompt_tokens = completion.prompt_tokens
+        self.completion_tokens = completion.completion_tokens
+        metrics = self.metrics
+        metrics.tokens.inc((self.model, "prompt"), completion.prompt_tokens)
+        metrics.tokens.inc((self.model, "completion"), completion.completion_tokens)
+        if completion.cache_read_tokens or completion.cache_write_tokens:
+            metrics.tokens.inc((self.model, "cache_read"), completion.cache_read_tokens)
+            metrics.tokens.inc((self.model, "cache_write"), completion.cache_write_tokens)
+        # Streams generate from the first token on; a whole response from the start
+        elapsed = time.perf_counter() - (self.first_token or self.started)
+        if completion.completion_tokens and elapsed > 0:
+            metrics.output_tokens_per_second.observe(
+                completion.completion_tokens / elapsed, (self.model, self.stream)
+            )
+    
+    async def frames(self, frames: AsyncIterator[str]) -> AsyncIterator[str]:
+        """Pass a stream through, timing its first token and counting bytes"""
+        size = 0
+        try:
+            async for frame in frames:
+                if self.first_token is None and '"delta":{"content":' in frame:
+                    self.first_token = time.perf_counter()
+                    self.metrics.time_to_first_token.observe(
+                        self.first_token - self.started, (self.model,)
+                    )
+                size += len(frame.encode())
+                yield frame
+        finally:
+            self.finish(200, size)
+    
+    def finish(self, status: int, response_size: int = 0) -> None:
+        if self.finished:
+            return
+        self.finished = True
+        self.status = status
+        self.response_size = response_size
+        self.duration = time.perf_counter() - self.started
+        metrics = self.metrics
+        metrics.in_flight.inc(amount=-1)
+        metrics.requests.inc((self.model, self.stream, str(status)))
+        metrics.request_duration.observe(self.duration, (self.model, self.stream))
+        metrics.response_size.observe(response_size, (self.stream,))
+        if self.on_finish is not None:
+            self.on_finish(self)
+
+
+class Metrics:
+    """Request, latency and throughput metrics in Prometheus text format.
+    
+    Everything is recorded on the event loop, so counters are plain floats and
+    histogram buckets plain lists with no locking. Gauges describing other
+    components are refreshed by ``sample`` right before they are read.
+    
+    With several worker processes a scrape reaches just one of them, so when
+    ``state_dir`` is set every worker writes a snapshot to
+    ``state_dir/metrics`` each second and on shutdown, and ``render`` adds up
+    the snapshots of all workers. Counters and histograms of workers that have
+    exited are kept so totals never go backwards; their gauges are dropped.
+    Their snapshots are folded into one ``exited.json`` and deleted, so
+    recycled workers do not leave a file each behind.
+    """
+    
+    FLUSH_INTERVAL = 1.0
+    
+    def __init__(self, config: Config, sample: Optional[Callable[[], None]] = None):
+        self.sample = sample
+        self.snapshot_dir = os.path.join(config.state_dir, "metrics") if config.state_dir else None
+        self.snapshot_path = (
+            os.path.join(self.snapshot_dir, f"worker-{os.getpid()}.json") if self.snapshot_dir else None
+        )
+        self._models: set = set()
+        self._flusher: Optional[asyncio.Task] = None
+        
+        self.requests = Counter(
+            "testdriver_proxy_requests_total",
+            "Chat completion requests by response status",
+            ("model", "stream", "status"),
+        )
+        self.request_duration = Histogram(
+            "testdriver_proxy_request_duration_seconds",
+            "Time from receiving a request to sending the last byte of its response",
+            LATENCY_BUCKETS,
+            ("model", "stream"),
+        )
+        self.time_to_first_token = Histogram(
+            "testdriver_proxy_time_to_first_token_seconds",
+            "Time from receiving a streaming request to sending its first content chunk",
+            LATENCY_BUCKETS,
+            ("model",),
+        )
+        self.output_tokens_per_second = Histogram(
+            "testdriver_proxy_output_tokens_per_second",
+            "Completion tokens per second of generation",
+            TOKEN_RATE_BUCKETS,
+            ("model", "stream"),
+        )
+        self.tokens = Counter(
+            "testdriver_proxy_tokens_total",
+            "Tokens reported by the upstream",
+            ("model", "type"),
+        )
+        self.model_routes = Counter(
+            "testdriver_proxy_model_routes_total",
+            "Routed chat completion requests by the model chosen and why",
+            ("model", "reason"),
+        )
+        self.upstream_ttfb = Histogram(
+            "testdriver_proxy_upstream_ttfb_seconds",
+            "Time from sending an upstream request to receiving its response headers",
+            LATENCY_BUCKETS,
+            ("status",),
+        )
+        self.request_size = Histogram(
+            "testdriver_proxy_request_size_bytes",
+            "Chat completion request body size",
+            SIZE_BUCKETS,
+        )
+        self.response_size = Histogram(
+            "testdriver_proxy_response_size_bytes",
+            "Chat completion response body size",
+            SIZE_BUCKETS,
+            ("stream",),
+        )
+        self.in_flight = Gauge(
+            "testdriver_proxy_requests_in_flight",
+            "Chat completion requests being handled",
+        )
+        self.upstream_connections = Gauge(
+            "testdriver_proxy_upstream_connections",
+            "Upstream pool connections by state",
+            ("state",),
+        )
+        self.upstream_in_flight = Gauge(
+            "testdriver_proxy_upstream_requests_in_flight",
+            "Requests holding an upstream pool client",
+        )
+        self.upstream_queue_depth = Gauge(
+            "testdriver_proxy_upstream_queue_depth",
+            "Requests waiting for an upstream concurrency slot",
+        )
+        self.upstream_concurrency_limit = Gauge(
+            "testdriver_proxy_upstream_concurrency_limit",
+            "Current upstream concurrency limit; 0 when no limit is enforced",
+        )
+        self.upstream_healthy = Gauge(
+            "testdriver_proxy_upstream_healthy",
+            "Whether an upstream target is taking traffic (0 while ejected)",
+            ("upstream",),
+        )
+        self.upstream_circuit_state = Gauge(
+            "testdriver_proxy_upstream_circuit_state",
+            "Circuit breaker state of an upstream target (0 closed, 1 half-open, 2 open)",
+            ("upstream",),
+        )
+        self.hedges = Counter(
+            "testdriver_proxy_upstream_hedges_total",
+            "Hedged upstream requests by which copy answered first",
+            ("winner",),
+        )
+        self.in_flight.set(0)
+        
+        self.metrics: List[Metric] = [
+            self.requests,
+            self.request_duration,
+            self.time_to_first_token,
+            self.output_tokens_per_second,
+            self.tokens,
+            self.model_routes,
+            self.upstream_ttfb,
+            self.request_size,
+            self.response_size,
+            self.in_flight,
+            self.upstream_connections,
+            self.upstream_in_flight,
+            self.upstream_queue_depth,
+            self.upstream_concurrency_limit,
+            self.upstream_healthy,
+            self.upstream_circuit_state,
+            self.hedges,
+        ]
+    
+    def model_label(self, model: str) -> str:
+        if model in self._models:
+            return model
+        if len(self._models) >= MAX_MODELS:
+            return OTHER_MODEL
+        self._models.add(model)
+        return model
+    
+    def track(self, model: str, stream: bool, request_size: Optional[int] = None) -> RequestTracker:
+        """Start tracking a client request, which becomes the current one"""
+        tracker = RequestTracker(self, model, stream, request_size)
+        _current.set(tracker)
+        return tracker
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """This worker's series in a JSON-serializable form"""
+        if self.sample is not None:
+            self.sample()
+        return {
+            "pid": os.getpid(),
+            "series": {
+                metric.name: [[list(labels), value] for labels, value in metric.series.items()]
+                for metric in self.metrics
+            },
+        }
+    
+    def render(self, others: Iterable[Dict[str, Any]] = ()) -> str:
+        """Text exposition of this worker plus the snapshots of ``others``"""
+        snapshots = [(True, self.snapshot()), *((_alive(s.get("pid")), s) for s in others)]
+        lines = []
+        for metric in self.metrics:
+            series: Dict[Labels, Any] = {}
+            for alive, snapshot in snapshots:
+                if metric.kind == "gauge" and not alive:
+                    continue
+                for labels, value in snapshot["series"].get(metric.name, ()):
+                    labels = tuple(labels)
+                    series[labels] = metric.merge(series[labels], value) if labels in series else value
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, labelnames, value in metric.samples(series):
+                lines.append(f"{name}{_format_labels(labelnames, labels)} {_format(value)}")
+        return "\n".join(lines) + "\n"
+    
+    def read_snapshots(self) -> List[Dict[str, Any]]:
+        """Snapshots written by the other workers, and the totals of exited ones
+        
+        Exited workers' snapshots are folded into ``exited.json`` under a
+        lock on the directory, so two scrapes never fold the same one twice
+        or see it both folded and not.
+        """
+        if self.snapshot_dir is None:
+            return []
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        with open(os.path.join(self.snapshot_dir, "lock"), "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)  # Released when the file is closed
+            exited_path = os.path.join(self.snapshot_dir, EXITED_SNAPSHOT)
+            exited = _read_snapshot(exited_path) or {"pid": None, "series": {}}
+            snapshots = []
+            folded = []
+            for path in glob.glob(os.path.join(self.snapshot_dir, "worker-*.json")):
+                if path == self.snapshot_path:
+                    continue
+                snapshot = _read_snapshot(path)
+                if snapshot is None:
+                    continue  # Being replaced or truncated; picked up next scrape
+                if _alive(snapshot.get("pid")):
+                    snapshots.append(snapshot)
+                else:
+                    self._fold(exited["series"], snapshot.get("series", {}))
+                    folded.append(path)
+            if folded:
+                _write_atomic(exited_path, json.dumps(exited, separators=(",", ":")))
+                for path in folded:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+        if exited["series"]:
+            snapshots.append(exited)
+        return snapshots
+    
+    def _fold(self, totals: Dict[str, Any], series: Dict[str, Any]) -> None:
+        """Add the counters and histograms of one snapshot's ``series`` to ``totals``"""
+        for metric in self.metrics:
+            if metric.kind == "gauge" or metric.name not in series:
+                continue
+            merged = {tuple(labels): value for labels, value in totals.get(metric.name, ())}
+            for labels, value in series[metric.name]:
+                labels = tuple(labels)
+                merged[labels] = metric.merge(merged[labels], value) if labels in merged else value
+            totals[metric.name] = [[list(labels), value] for labels, value in merged.items()]
+    
+    def write_snapshot(self) -> None:
+        if self.snapshot_path is not None:
+            _write_atomic(self.snapshot_path, json.dumps(self.snapshot(), separators=(",", ":")))
+    
+    async def exposition(self) -> str:
+        """Render the metrics of every worker"""
+        others = await asyncio.to_thread(self.read_snapshots) if self.snapshot_dir else []
+        return self.render(others)
+    
+    def start(self) -> None:
+        """Start writing snapshots for the other workers"""
+        if self.snapshot_dir is not None and self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+    
+    async def aclose(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+            # Keep this worker's totals once it has exited
+            self.write_snapshot()
+    
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                snapshot = json.dumps(self.snapshot(), separators=(",", ":"))
+                await asyncio.to_thread(_write_atomic, self.snapshot_path, snapshot)
+            except OSError as e:
+                logger.warning(f"Failed to write metrics snapshot: {e}")
+            await asyncio.sleep(self.FLUSH_INTERVAL)
+
+
+def _write_atomic(path: str, content: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+
+def _read_snapshot(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "rb") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _alive(pid: Any) -> bool:
+    if not isinstance(pid, int):
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Exists but belongs to someone else
+    return True
+
+
+def _format(value: float) -> str:
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Tuple[str, ...], values: Labels) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
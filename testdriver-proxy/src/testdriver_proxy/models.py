@@ -3,7 +3,7 @@ Data models for OpenAI-compatible API
 """
 
 from typing import List, Optional, Dict, Any, Literal
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_serializer
 
 
 class Message(BaseModel):
@@ -36,11 +36,26 @@ class Choice(BaseModel):
     finish_reason: Optional[str] = None
 
 
+class PromptTokensDetails(BaseModel):
+    """Prompt tokens served from and added to the upstream's prompt cache"""
+    cached_tokens: int = 0
+    cache_write_tokens: int = 0
+
+
 class Usage(BaseModel):
     """Token usage statistics"""
     prompt_tokens: int
     completion_tokens: int
     total_tokens: int
+    prompt_tokens_details: Optional[PromptTokensDetails] = None
+    
+    @model_serializer(mode="wrap")
+    def _omit_details(self, handler):
+        # Only present when the upstream's prompt cache was used
+        data = handler(self)
+        if data.get("prompt_tokens_details") is None:
+            data.pop("prompt_tokens_details", None)
+        return data
 
 
 class ChatCompletionResponse(BaseModel):
@@ -71,6 +86,14 @@ class ChatCompletionChunk(BaseModel):
     system_fingerprint: Optional[str] = None
 
 
+class BatchCreateRequest(BaseModel):
+    """OpenAI batch creation request"""
+    input_file_id: str
+    endpoint: str
+    completion_window: str = "24h"
+    metadata: Optional[Dict[str, str]] = None
+
+
 class ErrorResponse(BaseModel):
     """Error response"""
     error: Dict[str, Any]
@@ -0,0 +1,113 @@
+"""
+Streaming ``multipart/form-data`` parsing for file uploads
+"""
+
+import asyncio
+from email.message import Message
+from typing import AsyncIterator, BinaryIO, Callable, Dict, Optional
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_FIELD_BYTES = 64 * 1024
+
+
+class MultipartError(ValueError):
+    """Raised for a malformed or oversized multipart body"""
+
+
+def boundary_of(content_type: Optional[str]) -> bytes:
+    """The boundary of a ``multipart/form-data`` content type"""
+    message = Message()
+    message["content-type"] = content_type or ""
+    boundary = message.get_param("boundary")
+    if message.get_content_type() != "multipart/form-data" or not isinstance(boundary, str) or not boundary:
+        raise MultipartError("Expected a multipart/form-data body")
+    return boundary.encode("latin-1")
+
+
+def _disposition(headers: bytes) -> Message:
+    message = Message()
+    for line in headers.split(b"\r\n"):
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"content-disposition":
+            message["content-disposition"] = value.strip().decode("utf-8", "replace")
+    return message
+
+
+async def read_multipart(
+    chunks: AsyncIterator[bytes],
+    boundary: bytes,
+    open_file: Callable[[str, str], BinaryIO],
+    max_file_bytes: int,
+) -> Dict[str, str]:
+    """Parse a form as it arrives, without holding file parts in memory.
+    
+    File parts (those with a filename) are written to the file returned by
+    ``open_file(field, filename)``; the form's other fields are returned.
+    Raises ``MultipartError`` if the body is malformed or a file part is
+    larger than ``max_file_bytes``.
+    """
+    delimiter = b"\r\n--" + boundary
+    # The first delimiter has no line break before it
+    buffer = b"\r\n"
+    state = "preamble"
+    fields: Dict[str, str] = {}
+    name = ""
+    sink: Optional[BinaryIO] = None
+    value = bytearray()
+    written = 0
+    
+    async def emit(data: bytes) -> None:
+        nonlocal written
+        if not data:
+            return
+        if sink is not None:
+            written += len(data)
+            if written > max_file_bytes:
+                raise MultipartError(f"File is larger than {max_file_bytes} bytes")
+            # A file part can be hundreds of megabytes; keep disk writes off the loop
+            await asyncio.to_thread(sink.write, data)
+        else:
+            value.extend(data)
+            if len(value) > MAX_FIELD_BYTES:
+                raise MultipartError(f"Field {name!r} is larger than {MAX_FIELD_BYTES} bytes")
+    
+    async for chunk in chunks:
+        buffer += chunk
+        while state != "done":
+            if state in ("preamble", "body"):
+                index = buffer.find(delimiter)
+                if index < 0:
+                    # Keep what could be the start of a delimiter split across chunks
+                    keep = min(len(buffer), len(delimiter) - 1)
+                    if state == "body":
+                        await emit(buffer[:len(buffer) - keep])
+                    buffer = buffer[len(buffer) - keep:]
+                    break
+                if state == "body":
+                    await emit(buffer[:index])
+                    if sink is None:
+                        fields[name] = value.decode("utf-8", "replace")
+                buffer = buffer[index + len(delimiter):]
+                state = "delimiter"
+            if state == "delimiter":
+                if len(buffer) < 2:
+                    break
+                state = "done" if buffer.startswith(b"--") else "headers"
+            if state == "headers":
+                end = buffer.find(b"\r\n\r\n")
+                if end < 0:
+                    if len(buffer) > MAX_HEADER_BYTES:
+                        raise MultipartError("Part headers are too large")
+                    break
+                disposition = _disposition(buffer[:end])
+                buffer = buffer[end + 4:]
+                name = disposition.get_param("name", "", header="content-disposition")
+                filename = disposition.get_param("filename", None, header="content-disposition")
+                sink = open_file(name, filename) if isinstance(filename, str) else None
+                value = bytearray()
+                written = 0
+                state = "body"
+    
+    if state != "done":
+        raise MultipartError("Multipart body ended before its closing boundary")
+    return fields
@@ -0,0 +1,158 @@
+"""
+Managed upstream connection pool
+"""
+
+import importlib.util
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+
+from .config import Config
+from .metrics import Metrics, current_tracker
+from .timing import KIND_CLIENT, current_timing
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamPool:
+    """Shared HTTP client for all upstream calls.
+
+    The client is opened in the application lifespan and closed on shutdown.
+    It is also opened lazily on first use so the proxy keeps working when it
+    is driven without a lifespan (e.g. a plain ``TestClient``). When given
+    ``metrics``, the time to each upstream response's headers is recorded,
+    also on the tracker of the client request that made the call;
+    when the request is being timed, each call becomes an ``upstream`` span.
+    """
+
+    def __init__(
+        self,
+        config: Config,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        metrics: Optional[Metrics] = None,
+    ):
+        self.config = config
+        self.transport = transport
+        self.metrics = metrics
+        self.http2 = config.http2 and _h2_available()
+        self.limits = httpx.Limits(
+            max_connections=config.pool_max_connections,
+            max_keepalive_connections=config.pool_max_keepalive,
+            keepalive_expiry=config.pool_keepalive_expiry,
+        )
+        self._client: Optional[httpx.AsyncClient] = None
+        self._in_flight = 0
+        self._requests_total = 0
+
+        if config.http2 and not self.http2:
+            logger.warning("HTTP/2 requested but the 'h2' package is not installed; using HTTP/1.1")
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Return the pooled client, opening it if needed"""
+        if self._client is None:
+            return self.open()
+        return self._client
+
+    @property
+    def is_open(self) -> bool:
+        return self._client is not None
+
+    def open(self) -> httpx.AsyncClient:
+        """Open the pooled client"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.config.timeout,
+                limits=self.limits,
+                http2=self.http2,
+                transport=self.transport,
+                event_hooks=self._event_hooks(),
+            )
+            logger.debug(
+                f"Upstream pool opened: max_connections={self.limits.max_connections}, "
+                f"max_keepalive={self.limits.max_keepalive_connections}, http2={self.http2}"
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        """Close the pooled client and drop all connections"""
+        if self._client is not None:
+            client, self._client = self._client, None
+            await client.aclose()
+            logger.debug("Upstream pool closed")
+
+    def _event_hooks(self) -> Dict[str, list]:
+        ttfb = self.metrics.upstream_ttfb if self.metrics is not None else None
+
+        async def on_request(request: httpx.Request) -> None:
+            request.extensions["testdriver_proxy.started"] = time.perf_counter()
+            timing = current_timing()
+            if timing is not None:
+                span = timing.start("upstream", kind=KIND_CLIENT)
+                request.extensions["testdriver_proxy.span"] = span
+                request.extensions["trace"] = timing.httpcore_trace(span)
+
+        # Called once headers arrive, before the body is read
+        async def on_response(response: httpx.Response) -> None:
+            extensions = response.request.extensions
+            started = extensions.get("testdriver_proxy.started")
+            if started is not None:
+                elapsed = time.perf_counter() - started
+                if ttfb is not None:
+                    ttfb.observe(elapsed, (str(response.status_code),))
+                tracker = current_tracker()
+                if tracker is not None:
+                    tracker.upstream_ttfb = elapsed
+            span = extensions.get("testdriver_proxy.span")
+            if span is not None:
+                span.end = time.perf_counter_ns()
+                span.attributes["http.response.status_code"] = response.status_code
+
+        return {"request": [on_request], "response": [on_response]}
+
+    @asynccontextmanager
+    async def track(self) -> AsyncIterator[httpx.AsyncClient]:
+        """Yield the client while counting the request as in flight"""
+        self._in_flight += 1
+        self._requests_total += 1
+        try:
+            yield self.client
+        finally:
+            self._in_flight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool occupancy statistics"""
+        connections = _pool_connections(self._client)
+        idle = sum(1 for conn in connections if _call(conn, "is_idle"))
+        return {
+            "open": self.is_open,
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive": self.limits.max_keepalive_connections,
+            "keepalive_expiry": self.limits.keepalive_expiry,
+            "connections": len(connections),
+            "active_connections": len(connections) - idle,
+            "idle_connections": idle,
+            "in_flight": self._in_flight,
+            "requests_total": self._requests_total,
+        }
+
+
+def _h2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+def _pool_connections(client: Optional[httpx.AsyncClient]) -> list:
+    """Best-effort view of the connections held by httpcore"""
+    transport = getattr(client, "_transport", None)
+    pool = getattr(transport, "_pool", None)
+    connections = getattr(pool, "connections", None)
+    return list(connections) if isinstance(connections, (list, tuple)) else []
+
+
+def _call(obj: Any, name: str) -> bool:
+    method = getattr(obj, name, None)
+    return bool(method()) if callable(method) else False
@@ -0,0 +1,126 @@
+"""
+Automatic prompt-cache breakpoints for upstream requests
+"""
+
+from typing import Any, Dict, List, Optional
+
+from .config import Config
+from .quota import CHARS_PER_TOKEN, IMAGE_TOKENS, MESSAGE_OVERHEAD_TOKENS
+
+# Anthropic's only cache type: kept for a few minutes, refreshed on every hit
+EPHEMERAL = {"type": "ephemeral"}
+
+
+def estimate_tokens(content: Any) -> int:
+    """Rough token count of a system prompt or message content"""
+    if isinstance(content, str):
+        return len(content) // CHARS_PER_TOKEN
+    tokens = 0
+    for block in content or ():
+        if block.get("type") in ("image_url", "image"):
+            tokens += IMAGE_TOKENS
+        else:
+            tokens += len(str(block.get("text", ""))) // CHARS_PER_TOKEN
+    return tokens
+
+
+def has_breakpoints(zai_request: Dict[str, Any]) -> bool:
+    """Whether the client placed ``cache_control`` breakpoints of its own"""
+    contents = [zai_request.get("system")]
+    contents.extend(message["content"] for message in zai_request["messages"])
+    return any(
+        "cache_control" in block
+        for content in contents
+        if isinstance(content, list)
+        for block in content
+    )
+
+
+def mark(content: Any) -> List[Dict[str, Any]]:
+    """Content as blocks with a breakpoint on the last one
+    
+    The blocks are copied, so client parts shared with the request are left
+    as they were.
+    """
+    if isinstance(content, str):
+        return [{"type": "text", "text": content, "cache_control": EPHEMERAL}]
+    blocks = list(content)
+    blocks[-1] = {**blocks[-1], "cache_control": EPHEMERAL}
+    return blocks
+
+
+def stable_prefix_end(messages: List[Dict[str, Any]]) -> Optional[int]:
+    """Index of the last message before the newest turn, if there is one
+    
+    That is the last assistant message before the final message: the
+    client sent everything up to it on the previous step, and will send it
+    again on the next one.
+    """
+    for index in range(len(messages) - 2, -1, -1):
+        if messages[index]["role"] == "assistant":
+            return index
+    return None
+
+
+class PromptCache:
+    """Inserts Anthropic ``cache_control`` breakpoints so repeated prefixes
+    are served from the upstream's prompt cache instead of being prefilled.
+    
+    Strategies:
+    
+    - ``system``: a breakpoint on the system prompt;
+    - ``history``: that, and one on the last assistant message before the
+      newest turn. Each step then reads the prefix the previous step wrote
+      and writes one that ends at its own reply, while the newest user turn,
+      typically a fresh screenshot, is never written to the cache.
+    
+    A breakpoint is only placed once the prefix it ends is estimated at
+    ``min_tokens``, as the upstream will not cache shorter ones. Requests
+    that already carry breakpoints are left to the client.
+    """
+    
+    def __init__(self, config: Config):
+        self.strategy = config.prompt_cache_strategy
+        self.min_tokens = config.prompt_cache_min_tokens
+        self.requests = 0
+        self.breakpoints = 0
+        self.client_managed = 0
+    
+    def apply(self, zai_request: Dict[str, Any]) -> int:
+        """Add breakpoints to a transformed request; returns how many"""
+        if self.strategy == "off":
+            return 0
+        if has_breakpoints(zai_request):
+            self.client_managed += 1
+            return 0
+        
+        added = 0
+        system = zai_request.get("system")
+        prefix = estimate_tokens(system)
+        if system and prefix >= self.min_tokens:
+            zai_request["system"] = mark(system)
+            added += 1
+        
+        if self.strategy == "history":
+            messages = zai_request["messages"]
+            end = stable_prefix_end(messages)
+            if end is not None:
+                for message in messages[:end + 1]:
+                    prefix += MESSAGE_OVERHEAD_TOKENS + estimate_tokens(message["content"])
+                message = messages[end]
+                if message["content"] and prefix >= self.min_tokens:
+                    message["content"] = mark(message["content"])
+                    added += 1
+        
+        if added:
+            self.requests += 1
+            self.breakpoints += added
+        return added
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "strategy": self.strategy,
+            "requests": self.requests,
+            "breakpoints": self.breakpoints,
+            "client_managed": self.client_managed,
+        }
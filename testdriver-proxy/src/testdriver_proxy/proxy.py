@@ -3,36 +3,140 @@ Main proxy server implementation
 """
 
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import httpx
-import json
+import asyncio
+import os
 import time
 import uuid
 import logging
-from typing import AsyncGenerator, Dict, Optional, Any
+from contextlib import asynccontextmanager
+from dataclasses import replace
+from functools import partial
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from pydantic import ValidationError
 
 from .models import (
     ChatCompletionRequest,
     ChatCompletionResponse,
-    ChatCompletionChunk,
     Choice,
     Message,
+    PromptTokensDetails,
     Usage,
-    StreamChoice,
+    BatchCreateRequest,
     ErrorResponse,
 )
+from .batches import BatchError, BatchManager
+from .cache import Completion, ResponseCache
+from .circuit import CIRCUIT_STATES, CLOSED
+from .capture import TrafficCapture, request_shape
+from .coalesce import SingleFlight
 from .config import Config
+from .hedge import HedgePolicy
+from .images import ImagePipeline, ImageStore
+from .limiter import ConcurrencyLimiter, LimitExceeded
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Metrics, RequestTracker
+from .promptcache import PromptCache
+from .quota import QuotaExceeded, QuotaManager
+from .retry import RETRYABLE_ERRORS, RetryPolicy
+from .routing import AUTO_MODEL, ModelRouter, Route
+from .fastpath import parse_chat_request
+from .serialization import FastJSONResponse, dumps
+from .sse import DONE_FRAME, FINISH_REASON_MAP, ChunkEncoder, SSEParser, StreamTranslator
+from .timing import TimingMiddleware, TraceExporter, current_timing, phase
+from .upstreams import UpstreamBalancer
 
 logger = logging.getLogger(__name__)
 
+# Receives the finished completion of a request (None if it is not known)
+CompletionCallback = Callable[[Optional[Completion]], Awaitable[None]]
+
+# Whether the client of a request has gone away, e.g. Request.is_disconnected
+DisconnectCheck = Callable[[], Awaitable[bool]]
+
+# Seconds between checks for a departed client while choices are generated
+DISCONNECT_POLL_INTERVAL = 1.0
+
+
+class ClientDisconnected(Exception):
+    """Raised when a request's client went away before its response was ready"""
+
 
 class ZAIProxy:
     """Proxy handler for Z.ai API"""
     
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, transport: Optional[httpx.AsyncBaseTransport] = None):
         self.config = config
-        self.client = httpx.AsyncClient(timeout=config.timeout)
+        self.metrics = Metrics(config, self._sample_gauges)
+        self.upstreams = UpstreamBalancer(config, transport, self.metrics)
+        # The first target's pool, which is the only one without UPSTREAMS
+        self.pool = self.upstreams.targets[0].pool
+        self.retry = RetryPolicy(config)
+        self.hedging = HedgePolicy(config, self.metrics)
+        self.router = ModelRouter(config)
+        self.prompt_cache = PromptCache(config)
+        self.limiter = ConcurrencyLimiter(config)
+        self.cache = ResponseCache(config)
+        self.images = ImageStore(config)
+        self.image_pipeline = ImagePipeline(config, self.images)
+        self.flights = SingleFlight(config)
+        self.quotas = QuotaManager(config)
+        self.traces = TraceExporter(config) if config.trace_export_path else None
+        self.capture = TrafficCapture(config) if config.traffic_capture_path else None
+        self.batches = (
+            BatchManager(config, self.run_batch_request, lambda: self.limiter.queue_depth)
+            if config.batch_enabled
+            else None
+        )
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Shared upstream client"""
+        return self.pool.client
+    
+    async def startup(self) -> None:
+        """Open upstream resources"""
+        self.upstreams.open()
+        self.metrics.start()
+        if self.batches is not None:
+            self.batches.start()
+    
+    async def aclose(self) -> None:
+        """Release upstream resources"""
+        if self.batches is not None:
+            await self.batches.aclose()
+        await self.metrics.aclose()
+        await self.upstreams.aclose()
+        self.cache.close()
+        self.quotas.close()
+        self.image_pipeline.close()
+        if self.traces is not None:
+            self.traces.close()
+        if self.capture is not None:
+            self.capture.close()
+    
+    def _sample_gauges(self) -> None:
+        """Copy pool and limiter occupancy into the metrics gauges"""
+        pools = [target.pool.stats() for target in self.upstreams.targets]
+        self.metrics.upstream_connections.set(sum(pool["active_connections"] for pool in pools), ("active",))
+        self.metrics.upstream_connections.set(sum(pool["idle_connections"] for pool in pools), ("idle",))
+        self.metrics.upstream_in_flight.set(sum(pool["in_flight"] for pool in pools))
+        self.metrics.upstream_queue_depth.set(self.limiter.queue_depth)
+        self.metrics.upstream_concurrency_limit.set(self.limiter.current_limit if self.limiter.enabled else 0)
+        now = time.monotonic()
+        for target in self.upstreams.targets:
+            self.metrics.upstream_healthy.set(1 if target.available(now) else 0, (target.name,))
+            state = target.breaker.state(now) if target.breaker.enabled else CLOSED
+            self.metrics.upstream_circuit_state.set(CIRCUIT_STATES.index(state), (target.name,))
+    
+    def route(self, request: ChatCompletionRequest) -> Tuple[ChatCompletionRequest, Optional[Route]]:
+        """Pick the model a request is sent to; see ``ModelRouter``"""
+        routed, route = self.router.apply(request)
+        if route is not None:
+            self.metrics.model_routes.inc((route.model, route.reason))
+        return routed, route
     
     async def transform_request(self, request: ChatCompletionRequest) -> Dict:
         """Transform OpenAI request to Anthropic Messages API format"""
@@ -42,7 +146,13 @@ class ZAIProxy:
         messages = []
         
         for msg in request.messages:
-            msg_dict = msg.model_dump()
+            # Built by hand rather than with model_dump() so multi-megabyte
+            # image parts are referenced instead of deep-copied every turn;
+            # images are converted to Anthropic blocks and optionally shrunk
+            content = msg.content
+            if not isinstance(content, str):
+                content = [await self.image_pipeline.process_part(part) for part in content]
+            msg_dict = {"role": msg.role, "content": content, "name": msg.name}
             if msg.role == "system":
                 # Anthropic uses separate system parameter
                 system_content = msg.content if isinstance(msg.content, str) else msg.content
@@ -68,47 +178,201 @@ class ZAIProxy:
         if request.stop:
             zai_request["stop_sequences"] = request.stop if isinstance(request.stop, list) else [request.stop]
         
+        self.prompt_cache.apply(zai_request)
         return zai_request
     
+    async def run_batch_request(self, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        """Run one request of a batch; returns the status and body a client would have got
+        
+        ``LimitExceeded`` is raised rather than answered, so the scheduler can
+        retry the request once the upstream queue has room.
+        """
+        try:
+            request = ChatCompletionRequest.model_validate({**body, "stream": False})
+        except ValidationError as e:
+            return 400, ErrorResponse.create(message=str(e), code="invalid_request").model_dump()
+        if not 1 <= (1 if request.n is None else request.n) <= self.config.max_choices:
+            message = f"n must be between 1 and {self.config.max_choices}: {request.n}"
+            return 400, ErrorResponse.create(message=message, code="invalid_n").model_dump()
+        request, _ = self.route(request)
+        
+        try:
+            response = await self.chat_completion(request)
+        except HTTPException as e:
+            return e.status_code, ErrorResponse.create(message=str(e.detail), type="api_error").model_dump()
+        return 200, response.model_dump()
+    
     async def chat_completion(
-        self, request: ChatCompletionRequest
+        self,
+        request: ChatCompletionRequest,
+        on_complete: Optional[CompletionCallback] = None,
+        disconnected: Optional[DisconnectCheck] = None,
     ) -> ChatCompletionResponse | AsyncGenerator:
-        """Handle chat completion request"""
+        """Handle chat completion request
+        
+        ``on_complete`` is awaited with the completion once it is known, which
+        for streams is after the last frame. ``disconnected`` is polled while
+        several choices are generated, to stop them once nobody is waiting.
+        """
         
         try:
-            zai_request = await self.transform_request(request)
+            with phase("transform"):
+                zai_request = await self.transform_request(request)
+            
+            # Choices of one request are sampled independently, so a request
+            # for several bypasses the cache and coalescing
+            choices = request.n or 1
+            cache_key = self.cache.key_for(zai_request) if choices == 1 else None
+            cached = None
+            if cache_key:
+                with phase("cache"):
+                    cached = await self.cache.get(cache_key)
+            if cached is not None:
+                if request.stream:
+                    return self._frames(self._replay_stream(request, cached), on_complete)
+                if on_complete is not None:
+                    await on_complete(cached)
+                return self._build_response(request, cached)
+            
+            # Identical concurrent requests share a single upstream call
+            flight_key = self.flights.key_for(zai_request) if choices == 1 else None
             
             if request.stream:
-                return self._stream_response(request, zai_request)
+                # Streams cannot change their status once started, so a full
+                # upstream queue, or an upstream behind open circuit breakers,
+                # is rejected before the response begins
+                self.limiter.check()
+                self.upstreams.check()
+                if choices > 1:
+                    stream = self._fan_out_stream(request, zai_request, choices)
+                elif flight_key:
+                    stream = self.flights.stream(
+                        flight_key, lambda: self._stream_response(request, zai_request, cache_key)
+                    )
+                else:
+                    stream = self._stream_response(request, zai_request, cache_key)
+                return self._frames(stream, on_complete)
+            elif choices > 1:
+                return await self._fan_out_response(request, zai_request, choices, on_complete, disconnected)
             else:
-                return await self._non_stream_response(request, zai_request)
+                return await self._non_stream_response(
+                    request, zai_request, cache_key, flight_key, on_complete
+                )
+        
+        except (LimitExceeded, ClientDisconnected):
+            raise
         
         except Exception as e:
             logger.error(f"Error in chat completion: {e}")
             raise HTTPException(status_code=500, detail=str(e))
     
     async def _non_stream_response(
-        self, request: ChatCompletionRequest, zai_request: Dict
+        self,
+        request: ChatCompletionRequest,
+        zai_request: Dict,
+        cache_key: Optional[str] = None,
+        flight_key: Optional[str] = None,
+        on_complete: Optional[CompletionCallback] = None,
     ) -> ChatCompletionResponse:
         """Handle non-streaming response"""
         
-        url = f"{self.config.zai_base_url}/v1/messages"
-        headers = {
-            "anthropic-version": "2023-06-01",
-        }
-        if self.config.zai_api_key:
-            headers["x-api-key"] = self.config.zai_api_key
+        if flight_key:
+            completion = await self.flights.do(
+                flight_key, lambda: self._hedged_completion(zai_request, cache_key)
+            )
+        else:
+            completion = await self._hedged_completion(zai_request, cache_key)
+        
+        if on_complete is not None:
+            await on_complete(completion)
+        return self._build_response(request, completion)
+    
+    async def _fan_out_response(
+        self,
+        request: ChatCompletionRequest,
+        zai_request: Dict,
+        choices: int,
+        on_complete: Optional[CompletionCallback] = None,
+        disconnected: Optional[DisconnectCheck] = None,
+    ) -> ChatCompletionResponse:
+        """Handle a non-streaming request for several choices
+        
+        Every choice is a separate upstream call over the shared pool, all
+        made at once. If one fails the others are cancelled. Servers do not
+        cancel a non-streaming handler whose client goes away, so
+        ``disconnected`` is polled meanwhile, and the calls are cancelled
+        with ``ClientDisconnected`` once it reports the client gone.
+        """
+        tasks = [asyncio.ensure_future(self._fetch_completion(zai_request)) for _ in range(choices)]
+        gathered = asyncio.gather(*tasks)
+        try:
+            while disconnected is not None:
+                done, _ = await asyncio.wait({gathered}, timeout=DISCONNECT_POLL_INTERVAL)
+                if done:
+                    break
+                if await disconnected():
+                    raise ClientDisconnected()
+            completions = await gathered
+        finally:
+            for task in tasks:
+                task.cancel()
+        
+        if on_complete is not None:
+            await on_complete(self._combine(completions))
+        return self._build_response(request, *completions)
+    
+    @staticmethod
+    def _combine(completions: List[Completion]) -> Completion:
+        """The first completion with the usage of all of them, for accounting"""
+        return replace(
+            completions[0],
+            prompt_tokens=sum(completion.prompt_tokens for completion in completions),
+            completion_tokens=sum(completion.completion_tokens for completion in completions),
+            cache_read_tokens=sum(completion.cache_read_tokens for completion in completions),
+            cache_write_tokens=sum(completion.cache_write_tokens for completion in completions),
+        )
+    
+    async def _hedged_completion(self, zai_request: Dict, cache_key: Optional[str] = None) -> Completion:
+        """Fetch a completion, hedging it if the upstream is slower than usual
         
-        response = await self.client.post(
-            url,
-            json=zai_request,
-            headers=headers,
+        No hedge is sent while requests are queued for an upstream slot: the
+        upstream is then slow because it is busy, and duplicates would only
+        add to the queue.
+        """
+        completion = await self.hedging.call(
+            zai_request["model"],
+            lambda: self._fetch_completion(zai_request),
+            lambda: not self.limiter.queue_depth,
         )
+        if cache_key:
+            await self.cache.set(cache_key, completion)
+        return completion
+    
+    async def _fetch_completion(self, zai_request: Dict) -> Completion:
+        """Call the upstream and parse its completion"""
+        
+        # Encoded once and reused by every retry attempt
+        body = dumps(zai_request)
+        
+        async def send() -> httpx.Response:
+            # The slot is released between attempts, while backing off, and
+            # each attempt may go to a different target
+            upstream = self.upstreams.choose()
+            async with self.limiter.acquire() as slot, upstream.track() as call:
+                response = await call.client.post(upstream.url, content=body, headers=upstream.headers)
+                slot.record(response.status_code)
+                call.record(response.status_code, slot.latency)
+                return response
+        
+        response = await self.retry.call(send)
         response.raise_for_status()
         
-        zai_response = response.json()
+        with phase("decode"):
+            return self._parse_completion(response.json())
+    
+    def _parse_completion(self, zai_response: Dict) -> Completion:
+        """Extract the completion from an Anthropic Messages API response"""
         
-        # Transform Anthropic Messages API response to OpenAI format
         # Anthropic response format:
         # {
         #   "id": "msg_xxx",
@@ -116,7 +380,8 @@ class ZAIProxy:
         #   "role": "assistant",
         #   "content": [{"type": "text", "text": "..."}],
         #   "stop_reason": "end_turn",
-        #   "usage": {"input_tokens": X, "output_tokens": Y}
+        #   "usage": {"input_tokens": X, "output_tokens": Y,
+        #             "cache_read_input_tokens": R, "cache_creation_input_tokens": W}
         # }
         
         # Extract text content from Anthropic format
@@ -128,133 +393,230 @@ class ZAIProxy:
         
         # Map stop_reason to finish_reason
         stop_reason = zai_response.get("stop_reason", "stop")
-        finish_reason_map = {
-            "end_turn": "stop",
-            "max_tokens": "length",
-            "stop_sequence": "stop",
-        }
-        finish_reason = finish_reason_map.get(stop_reason, "stop")
+        usage = zai_response.get("usage", {})
         
-        return ChatCompletionResponse(
+        return Completion.from_usage(
+            usage,
             id=f"chatcmpl-{zai_response.get('id', uuid.uuid4().hex[:8])}",
+            content=content_text,
+            finish_reason=FINISH_REASON_MAP.get(stop_reason, "stop"),
+        )
+    
+    def _build_response(
+        self, request: ChatCompletionRequest, *completions: Completion
+    ) -> ChatCompletionResponse:
+        """Transform completions to OpenAI format, one choice each"""
+        
+        usage = completions[0] if len(completions) == 1 else self._combine(completions)
+        # Built from trusted, already-shaped data, so validation is skipped
+        return ChatCompletionResponse.model_construct(
+            id=usage.id,
             created=int(time.time()),
             model=request.model,
             choices=[
-                Choice(
-                    index=0,
-                    message=Message(
+                Choice.model_construct(
+                    index=index,
+                    message=Message.model_construct(
                         role="assistant",
-                        content=content_text,
+                        content=completion.content,
+                        name=None,
                     ),
-                    finish_reason=finish_reason,
+                    finish_reason=completion.finish_reason,
                 )
+                for index, completion in enumerate(completions)
             ],
-            usage=Usage(
-                prompt_tokens=zai_response.get("usage", {}).get("input_tokens", 0),
-                completion_tokens=zai_response.get("usage", {}).get("output_tokens", 0),
-                total_tokens=(
-                    zai_response.get("usage", {}).get("input_tokens", 0) +
-                    zai_response.get("usage", {}).get("output_tokens", 0)
-                ),
+            usage=Usage.model_construct(
+                prompt_tokens=usage.prompt_tokens,
+                completion_tokens=usage.completion_tokens,
+                total_tokens=usage.prompt_tokens + usage.completion_tokens,
+                prompt_tokens_details=PromptTokensDetails.model_construct(
+                    cached_tokens=usage.cache_read_tokens,
+                    cache_write_tokens=usage.cache_write_tokens,
+                )
+                if usage.cache_read_tokens or usage.cache_write_tokens
+                else None,
             ),
         )
     
-    async def _stream_response(
-        self, request: ChatCompletionRequest, zai_request: Dict
+    async def _frames(
+        self, stream: AsyncIterator[Any], on_complete: Optional[CompletionCallback] = None
     ) -> AsyncGenerator[str, None]:
-        """Handle streaming response"""
+        """Client-facing frames of an internal stream
         
-        url = f"{self.config.zai_base_url}/v1/messages"
-        headers = {
-            "anthropic-version": "2023-06-01",
-        }
-        if self.config.zai_api_key:
-            headers["x-api-key"] = self.config.zai_api_key
+        Internal streams end with their ``Completion`` after the SSE frames so
+        that usage reaches every subscriber of a coalesced stream; it is
+        handed to ``on_complete`` here instead of being sent.
+        """
+        try:
+            async for item in stream:
+                if isinstance(item, Completion):
+                    if on_complete is not None:
+                        await on_complete(item)
+                    continue
+                yield item
+        finally:
+            aclose = getattr(stream, "aclose", None)
+            if aclose is not None:
+                await aclose()
+    
+    async def _replay_stream(
+        self, request: ChatCompletionRequest, completion: Completion
+    ) -> AsyncGenerator[str | Completion, None]:
+        """Replay a cached completion as OpenAI streaming chunks"""
+        
+        for frame in ChunkEncoder(completion.id, request.model).replay(completion):
+            yield frame
+        yield completion
+    
+    async def _fan_out_stream(
+        self, request: ChatCompletionRequest, zai_request: Dict, choices: int
+    ) -> AsyncGenerator[str | Completion, None]:
+        """Stream several choices at once, interleaving their frames as they arrive
         
+        Each choice has its own upstream stream, and its frames carry its
+        index under a chunk id shared by all. A single ``[DONE]`` follows the
+        last choice, then a completion with their usage added up. Closing the
+        stream cancels the upstream calls still running.
+        """
         chunk_id = f"chatcmpl-{uuid.uuid4().hex[:8]}"
+        # Bounded, so a slow client holds back the upstream reads
+        queue: asyncio.Queue = asyncio.Queue(maxsize=16 * choices)
+        
+        async def pump(index: int) -> None:
+            stream = self._stream_response(request, zai_request, index=index, chunk_id=chunk_id)
+            try:
+                async for item in stream:
+                    await queue.put(item)
+                await queue.put(None)
+            except Exception as e:
+                await queue.put(e)
+            finally:
+                await stream.aclose()
         
-        async with self.client.stream(
-            "POST",
-            url,
-            json=zai_request,
-            headers=headers,
-        ) as response:
-            response.raise_for_status()
+        tasks = [asyncio.create_task(pump(index)) for index in range(choices)]
+        completions: List[Completion] = []
+        try:
+            running = choices
+            while running:
+                item = await queue.get()
+                if item is None:
+                    running -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                elif isinstance(item, Completion):
+                    completions.append(item)
+                elif item != DONE_FRAME:
+                    yield item
+            yield DONE_FRAME
+            if len(completions) == choices:
+                yield self._combine(completions)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    
+    async def _stream_response(
+        self,
+        request: ChatCompletionRequest,
+        zai_request: Dict,
+        cache_key: Optional[str] = None,
+        index: int = 0,
+        chunk_id: Optional[str] = None,
+    ) -> AsyncGenerator[str | Completion, None]:
+        """Handle streaming response"""
+        
+        chunk_id = chunk_id or f"chatcmpl-{uuid.uuid4().hex[:8]}"
+        body = dumps(zai_request)
+        
+        # Retry only while nothing has been sent to the client yet
+        self.retry.record_request()
+        attempt = 0
+        while True:
+            emitted = False
+            upstream = self.upstreams.choose()
+            try:
+                async with (
+                    self.limiter.acquire() as slot,
+                    upstream.track() as call,
+                    call.client.stream("POST", upstream.url, content=body, headers=upstream.headers) as response,
+                ):
+                    slot.record(response.status_code)
+                    call.record(response.status_code, slot.latency)
+                    delay = (
+                        self.retry.backoff(attempt, response)
+                        if self.retry.is_retryable(response)
+                        else None
+                    )
+                    if delay is None:
+                        response.raise_for_status()
+                        async for chunk in self._translate_stream(
+                            request, response, chunk_id, cache_key, index
+                        ):
+                            emitted = True
+                            yield chunk
+                        return
+                    logger.warning(
+                        f"Upstream returned {response.status_code}, retrying stream in {delay:.2f}s"
+                    )
+            except RETRYABLE_ERRORS as e:
+                delay = None if emitted else self.retry.backoff(attempt)
+                if delay is None:
+                    raise
+                logger.warning(f"Upstream error ({e!r}), retrying stream in {delay:.2f}s")
             
-            async for line in response.aiter_lines():
-                if not line or line.strip() == "":
-                    continue
-                
-                if line.startswith("data: "):
-                    line = line[6:]
-                
-                if line.strip() == "[DONE]":
-                    yield "data: [DONE]\n\n"
+            attempt += 1
+            await asyncio.sleep(delay)
+    
+    async def _translate_stream(
+        self,
+        request: ChatCompletionRequest,
+        response: httpx.Response,
+        chunk_id: str,
+        cache_key: Optional[str] = None,
+        index: int = 0,
+    ) -> AsyncGenerator[str | Completion, None]:
+        """Translate Anthropic SSE events into OpenAI chunks"""
+        
+        # Anthropic streaming format:
+        # event: message_start/content_block_start/content_block_delta/content_block_stop/message_delta/message_stop
+        # data: {...}
+        parser = SSEParser()
+        translator = StreamTranslator(chunk_id, request.model, index)
+        timing = current_timing()
+        
+        async for raw in response.aiter_bytes():
+            # Frames of a network chunk are built before any is sent so that
+            # our own translation time can be measured apart from the client's
+            started = time.perf_counter() if timing is not None else 0.0
+            frames = []
+            for event, data in parser.feed(raw):
+                frame = translator.feed(event, data)
+                if frame is not None:
+                    frames.append(frame)
+                if translator.done:
                     break
-                
-                try:
-                    # Anthropic streaming format:
-                    # event: message_start/content_block_start/content_block_delta/content_block_stop/message_delta/message_stop
-                    # data: {...}
-                    
-                    # Check if this is an event line
-                    if line.startswith("event: "):
-                        continue
-                    
-                    zai_chunk = json.loads(line)
-                    event_type = zai_chunk.get("type")
-                    
-                    # Handle different event types
-                    delta = {}
-                    finish_reason = None
-                    
-                    if event_type == "content_block_start":
-                        # First content block
-                        delta = {"role": "assistant", "content": ""}
-                    
-                    elif event_type == "content_block_delta":
-                        # Content delta
-                        delta_data = zai_chunk.get("delta", {})
-                        if delta_data.get("type") == "text_delta":
-                            delta = {"content": delta_data.get("text", "")}
-                    
-                    elif event_type == "message_delta":
-                        # Message completion
-                        stop_reason = zai_chunk.get("delta", {}).get("stop_reason")
-                        if stop_reason:
-                            finish_reason_map = {
-                                "end_turn": "stop",
-                                "max_tokens": "length",
-                                "stop_sequence": "stop",
-                            }
-                            finish_reason = finish_reason_map.get(stop_reason, "stop")
-                    
-                    elif event_type == "message_stop":
-                        # Stream complete
-                        continue
-                    
-                    # Transform to OpenAI streaming format
-                    chunk = ChatCompletionChunk(
-                        id=chunk_id,
-                        created=int(time.time()),
-                        model=request.model,
-                        choices=[
-                            StreamChoice(
-                                index=0,
-                                delta=delta,
-                                finish_reason=finish_reason,
-                            )
-                        ],
-                    )
-                    
-                    yield f"data: {chunk.model_dump_json()}\n\n"
-                
-                except json.JSONDecodeError:
-                    logger.warning(f"Failed to parse streaming line: {line}")
-                    continue
+            if timing is not None:
+                timing.add("translate", time.perf_counter() - started)
+            for frame in frames:
+                yield frame
+            if translator.done:
+                break
+        else:
+            for event, data in parser.flush():
+                frame = translator.feed(event, data)
+                if frame is not None:
+                    yield frame
+        
+        completion = translator.completion()
+        if completion is not None:
+            if cache_key:
+                await self.cache.set(cache_key, completion)
+            yield completion
 
 
-def create_app(config: Optional[Config] = None) -> FastAPI:
+def create_app(
+    config: Optional[Config] = None, transport: Optional[httpx.AsyncBaseTransport] = None
+) -> FastAPI:
     """Create FastAPI application"""
     
     if config is None:
@@ -262,11 +624,24 @@ def create_app(config: Optional[Config] = None) -> FastAPI:
     
     config.validate()
     
+    proxy = ZAIProxy(config, transport)
+    
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        await proxy.startup()
+        try:
+            yield
+        finally:
+            await proxy.aclose()
+    
     app = FastAPI(
         title="TestDriver Proxy",
         description="OpenAI-compatible API proxy for Z.ai GLM models",
         version="0.1.0",
+        lifespan=lifespan,
+        default_response_class=FastJSONResponse,
     )
+    app.state.proxy = proxy
     
     # CORS
     app.add_middleware(
@@ -277,7 +652,8 @@ def create_app(config: Optional[Config] = None) -> FastAPI:
         allow_headers=["*"],
     )
     
-    proxy = ZAIProxy(config)
+    if config.server_timing or config.trace_export_path:
+        app.add_middleware(TimingMiddleware, path="/v1/chat/completions", exporter=proxy.traces)
     
     @app.get("/")
     async def root():
@@ -290,41 +666,135 @@ def create_app(config: Optional[Config] = None) -> FastAPI:
     @app.get("/v1/models")
     async def list_models():
         """List available models"""
-        return {
-            "object": "list",
-            "data": [
-                {
-                    "id": "glm-4.5",
-                    "object": "model",
-                    "created": int(time.time()),
-                    "owned_by": "zai",
-                },
-                {
-                    "id": "glm-4.5v",
-                    "object": "model",
-                    "created": int(time.time()),
-                    "owned_by": "zai",
-                },
-            ],
-        }
+        data = [
+            {
+                "id": "glm-4.5",
+                "object": "model",
+                "created": int(time.time()),
+                "owned_by": "zai",
+            },
+            {
+                "id": "glm-4.5v",
+                "object": "model",
+                "created": int(time.time()),
+                "owned_by": "zai",
+            },
+        ]
+        # Names the router resolves to one of the models above
+        aliases = list(proxy.router.aliases)
+        if proxy.router.enabled:
+            aliases.append(AUTO_MODEL)
+        for alias in aliases:
+            data.append({"id": alias, "object": "model", "created": int(time.time()), "owned_by": "testdriver-proxy"})
+        return {"object": "list", "data": data}
     
-    @app.post("/v1/chat/completions")
-    async def chat_completions(request: ChatCompletionRequest):
-        """OpenAI-compatible chat completions endpoint"""
-        
+    async def complete(request: ChatCompletionRequest, http_request: Request):
+        """Run a chat completion and record its metrics and timings"""
+        timing = current_timing()
+        if timing is not None:
+            timing.mark("parse")  # Receiving and validating the body
+        content_length = http_request.headers.get("content-length")
+        tracker = proxy.metrics.track(
+            request.model, request.stream, int(content_length) if content_length else None
+        )
+        if proxy.capture is not None:
+            tracker.on_finish = partial(proxy.capture.record, request_shape(request))
+        try:
+            response = await respond(request, http_request, tracker)
+        except BaseException:
+            tracker.finish(499)  # Client went away before a response was made
+            raise
+        if not isinstance(response, StreamingResponse):
+            tracker.finish(response.status_code, len(response.body))
+            if timing is not None and config.server_timing:
+                response.headers["server-timing"] = timing.server_timing()
+        return response
+    
+    async def respond(request: ChatCompletionRequest, http_request: Request, tracker: RequestTracker):
+        """Run a chat completion and shape the HTTP response"""
         if config.log_requests:
             logger.info(f"Chat completion request: model={request.model}, stream={request.stream}")
         
         try:
-            result = await proxy.chat_completion(request)
+            if not 1 <= (1 if request.n is None else request.n) <= config.max_choices:
+                error = ErrorResponse.create(
+                    message=f"n must be between 1 and {config.max_choices}: {request.n}",
+                    type="invalid_request_error",
+                    code="invalid_n",
+                )
+                return FastJSONResponse(status_code=400, content=error.model_dump())
+            
+            request, route = proxy.route(request)
+            
+            reservation = None
+            if proxy.quotas.enabled:
+                client_key = proxy.quotas.key_for(
+                    request,
+                    http_request.headers.get("authorization"),
+                    http_request.client.host if http_request.client else None,
+                )
+                with phase("quota"):
+                    reservation = await proxy.quotas.reserve(client_key, request)
+            
+            async def on_complete(completion: Optional[Completion]) -> None:
+                await tracker.complete(completion)
+                if reservation is not None:
+                    await reservation.settle(completion)
+            
+            try:
+                result = await proxy.chat_completion(request, on_complete, http_request.is_disconnected)
+            except BaseException:
+                if reservation is not None:
+                    await reservation.settle(None)  # Nothing was generated
+                raise
+            headers = reservation.headers() if reservation else {}
+            if route is not None:
+                headers["x-model-route"] = route.header()
             
             if request.stream:
+                # Headers are already sent when a stream ends, so its
+                # timings follow the last chunk as an SSE comment
+                timing = current_timing()
+                if timing is not None and config.server_timing:
+                    result = timing.trailer(result)
                 return StreamingResponse(
-                    result,
+                    tracker.frames(result),
                     media_type="text/event-stream",
+                    headers=headers,
                 )
             else:
-                return result
+                with phase("serialize"):
+                    return FastJSONResponse(content=result, headers=headers)
+        
+        except ClientDisconnected:
+            logger.info("Client disconnected, chat completion cancelled")
+            return Response(status_code=499)  # Never received; recorded as such
+        
+        except QuotaExceeded as e:
+            logger.warning(f"Rejected chat completion: {e}")
+            error = ErrorResponse.create(
+                message=f"Rate limit reached for {e.key}, retry in {e.retry_after}s",
+                type="rate_limit_error",
+                code="rate_limit_exceeded",
+            )
+            return FastJSONResponse(
+                status_code=429,
+                content=error.model_dump(),
+                headers={"Retry-After": str(e.retry_after), **proxy.quotas.headers(e.remaining)},
+            )
+        
+        except LimitExceeded as e:
+            logger.warning(f"Rejected chat completion: {e.reason}")
+            error = ErrorResponse.create(
+                message=e.reason,
+                type="overloaded_error",
+                code=str(e.status_code),
+            )
+            return FastJSONResponse(
+                status_code=e.status_code,
+                content=error.model_dump(),
+                headers={"Retry-After": str(e.retry_after)},
+            )
         
         except httpx.HTTPStatusError as e:
             logger.error(f"Z.ai API error: {e.response.status_code} - {e.response.text}")
@@ -333,7 +803,7 @@ def create_app(config: Optional[Config] = None) -> FastAPI:
                 type="api_error",
                 code=str(e.response.status_code),
             )
-            return JSONResponse(
+            return FastJSONResponse(
                 status_code=e.response.status_code,
                 content=error.model_dump(),
             )
@@ -344,14 +814,148 @@ def create_app(config: Optional[Config] = None) -> FastAPI:
                 message=str(e),
                 type="internal_error",
             )
-            return JSONResponse(
+            return FastJSONResponse(
                 status_code=500,
                 content=error.model_dump(),
             )
     
+    if config.single_pass_parsing:
+        @app.post("/v1/chat/completions")
+        async def chat_completions(raw: Request):
+            """OpenAI-compatible chat completions endpoint (single-pass body parsing)"""
+            return await complete(parse_chat_request(await raw.body()), raw)
+    else:
+        @app.post("/v1/chat/completions")
+        async def chat_completions(request: ChatCompletionRequest, http_request: Request):
+            """OpenAI-compatible chat completions endpoint"""
+            return await complete(request, http_request)
+    
+    if proxy.batches is not None:
+        batches = proxy.batches
+        
+        def batch_error(e: BatchError) -> FastJSONResponse:
+            error = ErrorResponse.create(message=str(e), type="invalid_request_error", code=e.code)
+            return FastJSONResponse(status_code=e.status_code, content=error.model_dump())
+        
+        @app.post("/v1/files")
+        async def upload_file(http_request: Request):
+            """Upload a JSONL file of batch requests as multipart/form-data"""
+            try:
+                return await batches.upload(http_request.stream(), http_request.headers.get("content-type"))
+            except BatchError as e:
+                return batch_error(e)
+        
+        @app.get("/v1/files")
+        async def list_files(purpose: Optional[str] = None):
+            """List uploaded and result files"""
+            return await batches.list_files(purpose)
+        
+        @app.get("/v1/files/{file_id}")
+        async def get_file(file_id: str):
+            """Describe a file"""
+            try:
+                file, _ = await batches.get_file(file_id)
+            except BatchError as e:
+                return batch_error(e)
+            return file
+        
+        @app.get("/v1/files/{file_id}/content")
+        async def get_file_content(file_id: str):
+            """Download a file's contents"""
+            try:
+                file, path = await batches.get_file(file_id)
+            except BatchError as e:
+                return batch_error(e)
+            return FileResponse(path, media_type="application/jsonl", filename=file["filename"])
+        
+        @app.delete("/v1/files/{file_id}")
+        async def delete_file(file_id: str):
+            """Delete a file"""
+            try:
+                return await batches.delete_file(file_id)
+            except BatchError as e:
+                return batch_error(e)
+        
+        @app.post("/v1/batches")
+        async def create_batch(request: BatchCreateRequest):
+            """Queue a batch of requests from an uploaded file"""
+            try:
+                return await batches.create_batch(
+                    request.input_file_id, request.endpoint, request.completion_window, request.metadata
+                )
+            except BatchError as e:
+                return batch_error(e)
+        
+        @app.get("/v1/batches")
+        async def list_batches(limit: int = 20, after: Optional[str] = None):
+            """List batches, newest first"""
+            return await batches.list_batches(limit, after)
+        
+        @app.get("/v1/batches/{batch_id}")
+        async def get_batch(batch_id: str):
+            """Describe a batch and its progress"""
+            try:
+                return await batches.get_batch(batch_id)
+            except BatchError as e:
+                return batch_error(e)
+        
+        @app.post("/v1/batches/{batch_id}/cancel")
+        async def cancel_batch(batch_id: str):
+            """Stop a batch; results so far are kept"""
+            try:
+                return await batches.cancel_batch(batch_id)
+            except BatchError as e:
+                return batch_error(e)
+    
     @app.get("/health")
     async def health():
-        """Health check endpoint"""
-        return {"status": "healthy"}
+        """Health check endpoint
+        
+        Always answers 200 while the proxy is up; ``status`` is "degraded"
+        when some upstream circuit breakers are not closed and "unavailable"
+        when every one is open, so calls are being failed fast.
+        """
+        now = time.monotonic()
+        upstreams = {}
+        for target in proxy.upstreams.targets:
+            circuit = target.breaker.stats()
+            upstreams[target.name] = {
+                "circuit": circuit["state"],
+                "retry_after": circuit["retry_after"],
+                "ejected": not target.available(now),
+            }
+        status = "healthy"
+        if any(upstream["circuit"] != CLOSED for upstream in upstreams.values()):
+            status = "degraded"
+        if not any(target.breaker.available(now) for target in proxy.upstreams.targets):
+            status = "unavailable"
+        return {"status": status, "upstreams": upstreams}
+    
+    @app.get("/metrics")
+    async def metrics():
+        """Prometheus metrics"""
+        return Response(await proxy.metrics.exposition(), media_type=METRICS_CONTENT_TYPE)
+    
+    @app.get("/stats")
+    async def stats():
+        """Runtime statistics"""
+        return {
+            "worker": {"pid": os.getpid(), "state_dir": config.state_dir},
+            "pool": proxy.pool.stats(),
+            "upstreams": proxy.upstreams.stats(),
+            "retry": proxy.retry.stats(),
+            "hedging": proxy.hedging.stats(),
+            "routing": proxy.router.stats(),
+            "prompt_cache": proxy.prompt_cache.stats(),
+            "limiter": proxy.limiter.stats(),
+            "cache": await proxy.cache.stats(),
+            "images": proxy.images.stats(),
+            "image_pipeline": proxy.image_pipeline.stats(),
+            "coalescing": proxy.flights.stats(),
+            "quotas": await proxy.quotas.stats(),
+            "traces": proxy.traces.stats() if proxy.traces is not None else None,
+            "capture": proxy.capture.stats() if proxy.capture is not None else None,
+            "batches": proxy.batches.stats() if proxy.batches is not None else None,
+        }
     
     return app
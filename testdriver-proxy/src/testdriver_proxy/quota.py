@@ -0,0 +1,295 @@
+"""
+Per-client request and token quotas
+"""
+
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+from .cache import Completion
+from .config import Config
+from .models import ChatCompletionRequest
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Rough prompt size heuristics; the estimate is corrected from actual usage
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+IMAGE_TOKENS = 1600  # Upper end for an image scaled to the upstream's 1568px limit
+
+# (requests, tokens, updated_at) left in a client's buckets
+BucketState = Tuple[float, float, float]
+
+
+class QuotaExceeded(Exception):
+    """Raised when a client has used up its request or token quota"""
+    
+    def __init__(self, key: str, wait: float, remaining: Dict[str, int]):
+        super().__init__(f"Quota exceeded for {key}, retry in {wait:.1f}s")
+        self.key = key
+        self.retry_after = max(1, math.ceil(wait))
+        self.remaining = remaining
+
+
+def take(
+    state: Optional[BucketState], now: float, rpm: int, tpm: int, cost: float
+) -> Tuple[BucketState, float]:
+    """Refill a client's buckets and try to take one request and ``cost`` tokens.
+    
+    Returns the new state and 0 when allowed, or the unchanged (refilled)
+    state and the seconds until the request would fit. Each bucket holds a
+    minute's worth of quota; a limit of 0 disables that bucket. A request that
+    costs more than the whole token bucket is let through once it is full.
+    """
+    requests, tokens, updated_at = state if state is not None else (rpm, tpm, now)
+    elapsed = max(0.0, now - updated_at)
+    requests = min(rpm, requests + elapsed * rpm / 60)
+    tokens = min(tpm, tokens + elapsed * tpm / 60)
+    
+    wait = 0.0
+    if rpm and requests < 1:
+        wait = (1 - requests) * 60 / rpm
+    if tpm and tokens < min(cost, tpm):
+        wait = max(wait, (min(cost, tpm) - tokens) * 60 / tpm)
+    if wait:
+        return (requests, tokens, now), wait
+    return (requests - 1 if rpm else 0.0, tokens - cost if tpm else 0.0, now), 0.0
+
+
+class MemoryBuckets:
+    """Buckets for a single process, one tuple per client"""
+    
+    MAX_CLIENTS = 10_000
+    
+    def __init__(self) -> None:
+        self._state: Dict[str, BucketState] = {}
+    
+    def __len__(self) -> int:
+        return len(self._state)
+    
+    def take(self, key: str, now: float, rpm: int, tpm: int, cost: float) -> Tuple[BucketState, float]:
+        state, wait = take(self._state.get(key), now, rpm, tpm, cost)
+        self._state[key] = state
+        if len(self._state) > self.MAX_CLIENTS:
+            self._prune(now, rpm, tpm)
+        return state, wait
+    
+    def adjust(self, key: str, now: float, tpm: int, tokens: float) -> None:
+        state = self._state.get(key)
+        if state is not None:
+            self._state[key] = (state[0], min(tpm, state[1] + tokens), state[2])
+    
+    def _prune(self, now: float, rpm: int, tpm: int) -> None:
+        # Clients whose buckets have refilled completely carry no information
+        for key, (requests, tokens, updated_at) in list(self._state.items()):
+            elapsed = now - updated_at
+            if requests + elapsed * rpm / 60 >= rpm and tokens + elapsed * tpm / 60 >= tpm:
+                del self._state[key]
+
+
+class SQLiteBuckets:
+    """Buckets shared by every worker process through a SQLite file"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+    
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(
+                self.path, timeout=5.0, check_same_thread=False, isolation_level=None
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS quota_buckets ("
+                "key TEXT PRIMARY KEY, requests REAL NOT NULL, tokens REAL NOT NULL, "
+                "updated_at REAL NOT NULL)"
+            )
+            self._conn = conn
+        return self._conn
+    
+    def __len__(self) -> int:
+        with self._lock:
+            (count,) = self._connect().execute("SELECT COUNT(*) FROM quota_buckets").fetchone()
+        return count
+    
+    def take(self, key: str, now: float, rpm: int, tpm: int, cost: float) -> Tuple[BucketState, float]:
+        with self._lock:
+            conn = self._connect()
+            # IMMEDIATE takes the write lock up front so read-modify-write is atomic
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT requests, tokens, updated_at FROM quota_buckets WHERE key = ?", (key,)
+                ).fetchone()
+                state, wait = take(row, now, rpm, tpm, cost)
+                conn.execute(
+                    "INSERT OR REPLACE INTO quota_buckets (key, requests, tokens, updated_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (key, *state),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return state, wait
+    
+    def adjust(self, key: str, now: float, tpm: int, tokens: float) -> None:
+        with self._lock:
+            self._connect().execute(
+                "UPDATE quota_buckets SET tokens = MIN(?, tokens + ?) WHERE key = ?",
+                (tpm, tokens, key),
+            )
+    
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+@dataclass
+class Reservation:
+    """Quota taken for one request, settled once its usage is known"""
+    quotas: "QuotaManager"
+    key: str
+    estimate: int
+    remaining: Dict[str, int]
+    settled: bool = False
+    
+    async def settle(self, completion: Optional[Completion]) -> None:
+        """Replace the estimate with actual usage; None refunds the tokens"""
+        if self.settled:
+            return
+        self.settled = True
+        if completion is None:
+            actual = 0
+        else:
+            actual = completion.prompt_tokens + completion.completion_tokens
+            if not actual:
+                return  # Upstream reported no usage: keep the estimate
+        await self.quotas.adjust(self.key, self.estimate - actual)
+    
+    def headers(self) -> Dict[str, str]:
+        return self.quotas.headers(self.remaining)
+
+
+class QuotaManager:
+    """Token-bucket quotas per client in requests/min and tokens/min.
+    
+    Clients are identified by a hash of their bearer key, else by their
+    address, and within that by the request's ``user`` field, so one runaway
+    test suite sharing a key with others only uses up its own bucket. The
+    token cost is estimated up front from the prompt size and ``max_tokens``
+    and corrected once the actual usage is known. Buckets live in memory, or
+    in a SQLite file under ``state_dir`` when one is set so that every worker
+    enforces the same quota.
+    """
+    
+    def __init__(self, config: Config):
+        self.rpm = config.quota_requests_per_minute
+        self.tpm = config.quota_tokens_per_minute
+        self.enabled = bool(self.rpm or self.tpm)
+        self.default_max_tokens = config.max_tokens
+        self.buckets = (
+            SQLiteBuckets(os.path.join(config.state_dir, "quotas.sqlite3"))
+            if config.state_dir
+            else MemoryBuckets()
+        )
+        self.allowed = 0
+        self.rejected = 0
+    
+    def key_for(
+        self,
+        request: ChatCompletionRequest,
+        authorization: Optional[str] = None,
+        client_host: Optional[str] = None,
+    ) -> str:
+        """Identify the client a request is billed to"""
+        key = f"addr:{client_host or 'unknown'}"
+        if authorization:
+            scheme, _, credentials = authorization.partition(" ")
+            if scheme.lower() == "bearer" and credentials:
+                key = "key:" + hashlib.sha256(credentials.encode()).hexdigest()[:16]
+        if request.user:
+            key += f"/user:{request.user}"
+        return key
+    
+    def estimate(self, request: ChatCompletionRequest) -> int:
+        """Upper-bound token cost of a request before it is sent"""
+        prompt = 0
+        for message in request.messages:
+            prompt += MESSAGE_OVERHEAD_TOKENS
+            if isinstance(message.content, str):
+                prompt += len(message.content) // CHARS_PER_TOKEN
+                continue
+            for part in message.content:
+                if part.get("type") in ("image_url", "image"):
+                    prompt += IMAGE_TOKENS
+                else:
+                    prompt += len(str(part.get("text", ""))) // CHARS_PER_TOKEN
+        # Every choice is a separate upstream call that pays for the prompt
+        return (prompt + (request.max_tokens or self.default_max_tokens)) * (request.n or 1)
+    
+    async def reserve(self, key: str, request: ChatCompletionRequest) -> Reservation:
+        """Take quota for a request or raise ``QuotaExceeded``"""
+        cost = self.estimate(request)
+        state, wait = await self._call(self.buckets.take, key, time.time(), self.rpm, self.tpm, cost)
+        remaining = {"requests": max(0, int(state[0])), "tokens": max(0, int(state[1]))}
+        if wait:
+            self.rejected += 1
+            logger.debug(f"Quota exceeded for {key}: cost {cost} tokens, remaining {remaining}")
+            raise QuotaExceeded(key, wait, remaining)
+        self.allowed += 1
+        return Reservation(self, key, cost, remaining)
+    
+    def headers(self, remaining: Dict[str, int]) -> Dict[str, str]:
+        """OpenAI-style rate limit headers"""
+        headers = {}
+        if self.rpm:
+            headers["x-ratelimit-limit-requests"] = str(self.rpm)
+            headers["x-ratelimit-remaining-requests"] = str(remaining["requests"])
+        if self.tpm:
+            headers["x-ratelimit-limit-tokens"] = str(self.tpm)
+            headers["x-ratelimit-remaining-tokens"] = str(remaining["tokens"])
+        return headers
+    
+    async def adjust(self, key: str, tokens: float) -> None:
+        """Return (or charge, if negative) tokens to a client's bucket"""
+        if tokens and self.tpm:
+            await self._call(self.buckets.adjust, key, time.time(), self.tpm, tokens)
+    
+    async def _call(self, fn: Callable[..., T], *args: Any) -> T:
+        # SQLite may block on another worker's write lock, so it runs off-loop
+        if isinstance(self.buckets, MemoryBuckets):
+            return fn(*args)
+        return await asyncio.to_thread(fn, *args)
+    
+    def close(self) -> None:
+        if isinstance(self.buckets, SQLiteBuckets):
+            self.buckets.close()
+    
+    async def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "requests_per_minute": self.rpm,
+            "tokens_per_minute": self.tpm,
+            "shared": isinstance(self.buckets, SQLiteBuckets),
+            "clients": await self._call(len, self.buckets) if self.enabled else 0,
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,138 @@
+"""
+Retry policy for upstream calls
+"""
+
+import asyncio
+import logging
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import httpx
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+# Upstream statuses worth another attempt (529 is Anthropic's "overloaded")
+RETRYABLE_STATUS_CODES = frozenset({408, 429, 500, 502, 503, 504, 529})
+
+# Transport errors raised before the upstream produced a usable response
+RETRYABLE_ERRORS = (
+    httpx.ConnectError,
+    httpx.ConnectTimeout,
+    httpx.PoolTimeout,
+    httpx.ReadTimeout,
+    httpx.RemoteProtocolError,
+)
+
+
+class RetryBudget:
+    """Token bucket that caps retries to a percentage of traffic.
+
+    Every request deposits ``percent / 100`` tokens and every retry withdraws
+    one, so a sustained upstream outage cannot multiply load by more than the
+    configured percentage. ``reserve`` tokens allow short bursts on low traffic.
+    """
+
+    def __init__(self, percent: float, reserve: int):
+        self.ratio = percent / 100
+        self.capacity = float(max(reserve, 1))
+        self.balance = float(reserve)
+
+    def deposit(self) -> None:
+        self.balance = min(self.capacity, self.balance + self.ratio)
+
+    def withdraw(self) -> bool:
+        # Tolerate float drift from repeated fractional deposits
+        if self.balance < 1 - 1e-9:
+            return False
+        self.balance = max(0.0, self.balance - 1)
+        return True
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter and a global retry budget"""
+
+    def __init__(self, config: Config):
+        self.max_retries = config.max_retries
+        self.base_delay = config.retry_base_delay
+        self.max_delay = config.retry_max_delay
+        self.budget = RetryBudget(config.retry_budget_percent, config.retry_budget_reserve)
+        self.retries = 0
+        self.budget_exhausted = 0
+
+    def record_request(self) -> None:
+        """Account for a new client request in the retry budget"""
+        self.budget.deposit()
+
+    def is_retryable(self, response: httpx.Response) -> bool:
+        return response.status_code in RETRYABLE_STATUS_CODES
+
+    def backoff(self, attempt: int, response: Optional[httpx.Response] = None) -> Optional[float]:
+        """Delay before the next attempt, or None if the request must not be retried"""
+        if attempt >= self.max_retries:
+            return None
+
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        if response is not None:
+            retry_after = parse_retry_after(response.headers.get("retry-after"))
+            if retry_after is not None:
+                if retry_after > self.max_delay:
+                    return None
+                delay = retry_after
+
+        if not self.budget.withdraw():
+            self.budget_exhausted += 1
+            logger.warning("Retry budget exhausted, not retrying upstream request")
+            return None
+
+        self.retries += 1
+        return delay
+
+    async def call(self, send: Callable[[], Awaitable[httpx.Response]]) -> httpx.Response:
+        """Run ``send`` until it returns a non-retryable response or retries run out"""
+        self.record_request()
+        attempt = 0
+        while True:
+            try:
+                response = await send()
+            except RETRYABLE_ERRORS as e:
+                delay = self.backoff(attempt)
+                if delay is None:
+                    raise
+                logger.warning(f"Upstream error ({e!r}), retrying in {delay:.2f}s")
+            else:
+                if not self.is_retryable(response):
+                    return response
+                delay = self.backoff(attempt, response)
+                if delay is None:
+                    return response
+                logger.warning(f"Upstream returned {response.status_code}, retrying in {delay:.2f}s")
+                await response.aclose()
+
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_retries": self.max_retries,
+            "retries": self.retries,
+            "budget_exhausted": self.budget_exhausted,
+            "budget_balance": round(self.budget.balance, 2),
+        }
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given in seconds or as an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,112 @@
+"""
+Content-aware model routing
+"""
+
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from .config import Config
+from .models import ChatCompletionRequest
+
+# Clients asking for this model leave the choice to the router
+AUTO_MODEL = "auto"
+
+IMAGE_PART_TYPES = frozenset({"image_url", "image"})
+
+
+@dataclass(frozen=True)
+class Route:
+    """Where a request was sent and why"""
+    requested: str
+    model: str
+    reason: str
+    
+    def header(self) -> str:
+        """Value of the ``X-Model-Route`` response header"""
+        return f"{self.model}; reason={self.reason}"
+
+
+def inspect_messages(request: ChatCompletionRequest) -> Tuple[bool, int]:
+    """Whether the request has image parts, and the characters of its text"""
+    images = False
+    chars = 0
+    for message in request.messages:
+        content = message.content
+        if isinstance(content, str):
+            chars += len(content)
+            continue
+        for part in content:
+            kind = part.get("type")
+            if kind in IMAGE_PART_TYPES:
+                images = True
+            elif kind == "text":
+                chars += len(part.get("text") or "")
+    return images, chars
+
+
+class ModelRouter:
+    """Picks the upstream model for a request from what it contains.
+    
+    ``model_aliases`` are resolved first and always apply. With routing on,
+    a request for ``default_model``, ``vision_model`` or ``"auto"`` then
+    goes to:
+    
+    - ``vision_model`` when any message has an image part;
+    - ``route_fast_model``, if set, when its text is at most
+      ``route_fast_max_chars`` characters (the low-latency tier);
+    - ``route_long_prompt_model``, if set, when its text is over
+      ``route_long_prompt_chars`` characters;
+    - ``default_model`` otherwise.
+    
+    Requests naming any other model are sent to that model.
+    """
+    
+    def __init__(self, config: Config):
+        self.enabled = config.model_routing_enabled
+        self.aliases: Dict[str, str] = dict(config.model_aliases)
+        self.default_model = config.default_model
+        self.vision_model = config.vision_model
+        self.fast_model = config.route_fast_model
+        self.fast_max_chars = config.route_fast_max_chars
+        self.long_prompt_model = config.route_long_prompt_model
+        self.long_prompt_chars = config.route_long_prompt_chars
+        self.routed_models = frozenset({config.default_model, config.vision_model, AUTO_MODEL})
+        self.routes: Dict[Tuple[str, str], int] = {}
+    
+    def route(self, request: ChatCompletionRequest) -> Optional[Route]:
+        """The route for a request, or None when it goes to the model it names"""
+        requested = request.model
+        model = self.aliases.get(requested, requested)
+        if not self.enabled or model not in self.routed_models:
+            return Route(requested, model, "alias") if model != requested else None
+        
+        images, chars = inspect_messages(request)
+        if images:
+            return Route(requested, self.vision_model, "vision")
+        if self.fast_model and chars <= self.fast_max_chars:
+            return Route(requested, self.fast_model, "fast")
+        if self.long_prompt_model and chars > self.long_prompt_chars:
+            return Route(requested, self.long_prompt_model, "long_prompt")
+        return Route(requested, self.default_model, "text")
+    
+    def apply(self, request: ChatCompletionRequest) -> Tuple[ChatCompletionRequest, Optional[Route]]:
+        """The request as it should be sent upstream, and its route"""
+        route = self.route(request)
+        if route is None:
+            return request, None
+        key = (route.model, route.reason)
+        self.routes[key] = self.routes.get(key, 0) + 1
+        if route.model == request.model:
+            return request, route
+        # Shallow: the messages, and their images, are shared with the original
+        return request.model_copy(update={"model": route.model}), route
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "aliases": len(self.aliases),
+            "routes": [
+                {"model": model, "reason": reason, "requests": count}
+                for (model, reason), count in sorted(self.routes.items())
+            ],
+        }
@@ -0,0 +1,35 @@
+"""
+Fast JSON serialization for API responses
+"""
+
+import json
+from typing import Any
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    """Serialize plain JSON data, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response that skips FastAPI's ``jsonable_encoder`` pass.
+
+    Pydantic models are written straight to bytes by pydantic-core, which also
+    works for models built with ``model_construct()``; anything else goes
+    through ``dumps``.
+    """
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, BaseModel):
+            return content.__pydantic_serializer__.to_json(content)
+        return dumps(content)
@@ -0,0 +1,222 @@
+"""
+Incremental SSE parsing and Anthropic-to-OpenAI stream translation
+"""
+
+import json
+import logging
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .cache import Completion
+
+logger = logging.getLogger(__name__)
+
+DONE_FRAME = "data: [DONE]\n\n"
+
+# Anthropic stop_reason -> OpenAI finish_reason
+FINISH_REASON_MAP = {
+    "end_turn": "stop",
+    "max_tokens": "length",
+    "stop_sequence": "stop",
+}
+
+# Events that never change the OpenAI view of the stream
+_NOOP_EVENTS = frozenset({"ping", "content_block_stop"})
+
+# Already JSON-escaped text of a text_delta, spliced into the output frame as is
+_TEXT_DELTA = re.compile(rb'"text"\s*:\s*("(?:[^"\\]|\\.)*")')
+
+
+class SSEParser:
+    """Incremental ``text/event-stream`` parser working on raw bytes.
+
+    ``feed`` accepts arbitrary network chunks and returns the events completed
+    so far as ``(event, data)`` pairs. Multi-line ``data:`` fields are joined
+    with newlines and comment lines are ignored, as per the SSE spec.
+    """
+
+    def __init__(self) -> None:
+        self._buffer = b""
+        self._event: Optional[bytes] = None
+        self._data: List[bytes] = []
+
+    def feed(self, chunk: bytes) -> List[Tuple[Optional[str], bytes]]:
+        events: List[Tuple[Optional[str], bytes]] = []
+        buffer = self._buffer + chunk if self._buffer else chunk
+        start = 0
+        while True:
+            end = buffer.find(b"\n", start)
+            if end < 0:
+                break
+            line = buffer[start:end]
+            start = end + 1
+            if line.endswith(b"\r"):
+                line = line[:-1]
+
+            if not line:
+                if self._data:
+                    event = self._event.decode() if self._event is not None else None
+                    events.append((event, b"\n".join(self._data)))
+                self._event = None
+                self._data = []
+                continue
+
+            field, _, value = line.partition(b":")
+            if value.startswith(b" "):
+                value = value[1:]
+            if field == b"data":
+                self._data.append(value)
+            elif field == b"event":
+                self._event = value
+            # Comments (empty field) and unknown fields are ignored
+
+        self._buffer = buffer[start:]
+        return events
+
+    def flush(self) -> List[Tuple[Optional[str], bytes]]:
+        """Dispatch a trailing event that was not followed by a blank line"""
+        events = self.feed(b"\n\n") if self._buffer else []
+        if self._data:
+            event = self._event.decode() if self._event is not None else None
+            events.append((event, b"\n".join(self._data)))
+            self._event = None
+            self._data = []
+        return events
+
+
+class ChunkEncoder:
+    """Formats OpenAI ``chat.completion.chunk`` frames from a pre-built template.
+
+    The output is byte-for-byte what ``ChatCompletionChunk.model_dump_json()``
+    produces, without constructing and validating a model per token.
+    """
+
+    __slots__ = ("_prefix",)
+
+    ROLE_DELTA = '{"role":"assistant","content":""}'
+
+    def __init__(self, chunk_id: str, model: str, created: Optional[int] = None, index: int = 0):
+        created = int(time.time()) if created is None else created
+        self._prefix = (
+            f'data: {{"id":{json.dumps(chunk_id, ensure_ascii=False)},'
+            f'"object":"chat.completion.chunk","created":{created},'
+            f'"model":{json.dumps(model, ensure_ascii=False)},'
+            f'"choices":[{{"index":{index},"delta":'
+        )
+
+    def frame(self, delta: str, finish_reason: Optional[str] = None) -> str:
+        reason = f'"{finish_reason}"' if finish_reason else "null"
+        return f'{self._prefix}{delta},"finish_reason":{reason}}}],"system_fingerprint":null}}\n\n'
+
+    def content(self, text: str) -> str:
+        return self.content_json(json.dumps(text, ensure_ascii=False))
+
+    def content_json(self, encoded: str) -> str:
+        """Content frame from an already JSON-encoded string"""
+        return self.frame('{"content":' + encoded + "}")
+
+    def replay(self, completion: Completion) -> List[str]:
+        """Frames that stream a finished completion"""
+        return [
+            self.frame(self.ROLE_DELTA),
+            self.content(completion.content),
+            self.frame("{}", completion.finish_reason),
+            DONE_FRAME,
+        ]
+
+
+class StreamTranslator:
+    """Turns Anthropic Messages SSE events into OpenAI chunk frames.
+
+    Events that carry nothing for an OpenAI client (pings, block stops, usage
+    only deltas) are dropped. When the upstream names its events, text deltas
+    skip JSON decoding entirely: the escaped text is copied into the frame.
+    Text, stop reason and usage are accumulated so the finished stream can be
+    stored as a ``Completion``. ``index`` is the choice the frames belong to
+    when several are streamed together.
+    """
+
+    def __init__(self, chunk_id: str, model: str, index: int = 0):
+        self.chunk_id = chunk_id
+        self.encoder = ChunkEncoder(chunk_id, model, index=index)
+        self.done = False
+        self.finish_reason: Optional[str] = None
+        self.usage: Dict[str, Any] = {}
+        # JSON-encoded text pieces, decoded only if the completion is needed
+        self._encoded_parts: List[str] = []
+        self._started = False
+
+    def feed(self, event: Optional[str], data: bytes) -> Optional[str]:
+        """Translate one SSE event; returns the frame to emit, if any"""
+        if event in _NOOP_EVENTS:
+            return None
+        if data == b"[DONE]":
+            self.done = True
+            return DONE_FRAME
+
+        # Hot path: text deltas are forwarded without decoding the JSON
+        if event == "content_block_delta" and b'"text_delta"' in data:
+            match = _TEXT_DELTA.search(data)
+            if match is not None:
+                encoded = match.group(1).decode()
+                if encoded == '""':
+                    return None
+                self._encoded_parts.append(encoded)
+                return self.encoder.content_json(encoded)
+
+        try:
+            payload = json.loads(data)
+        except json.JSONDecodeError:
+            logger.warning(f"Failed to parse streaming event: {data[:200]!r}")
+            return None
+
+        event_type = payload.get("type") if isinstance(payload, dict) else None
+
+        if event_type == "content_block_delta":
+            delta = payload.get("delta", {})
+            if delta.get("type") == "text_delta":
+                text = delta.get("text", "")
+                if text:
+                    encoded = json.dumps(text, ensure_ascii=False)
+                    self._encoded_parts.append(encoded)
+                    return self.encoder.content_json(encoded)
+            return None
+
+        if event_type == "content_block_start":
+            if self._started:
+                return None
+            self._started = True
+            return self.encoder.frame(ChunkEncoder.ROLE_DELTA)
+
+        if event_type == "message_start":
+            self.usage.update(payload.get("message", {}).get("usage", {}))
+            return None
+
+        if event_type == "message_delta":
+            self.usage.update(payload.get("usage", {}))
+            stop_reason = payload.get("delta", {}).get("stop_reason")
+            if not stop_reason:
+                return None
+            self.finish_reason = FINISH_REASON_MAP.get(stop_reason, "stop")
+            return self.encoder.frame("{}", self.finish_reason)
+
+        if event_type == "message_stop":
+            self.done = True
+            return DONE_FRAME
+
+        if event_type == "error":
+            logger.warning(f"Upstream stream error: {payload.get('error')}")
+
+        return None
+
+    def completion(self) -> Optional[Completion]:
+        """The finished completion, or None if the stream did not complete"""
+        if not self.finish_reason:
+            return None
+        return Completion.from_usage(
+            self.usage,
+            id=self.chunk_id,
+            content="".join(json.loads("[" + ",".join(self._encoded_parts) + "]")),
+            finish_reason=self.finish_reason,
+        )
@@ -0,0 +1,290 @@
+"""
+Per-request phase timing and trace export
+"""
+
+import json
+import logging
+import os
+import secrets
+import time
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional
+
+from .config import Config
+from .sse import DONE_FRAME
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "testdriver-proxy"
+
+# OpenTelemetry span kinds
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+
+_current: ContextVar[Optional["RequestTiming"]] = ContextVar("testdriver_proxy_timing", default=None)
+_NO_PHASE = nullcontext()
+
+
+class Span:
+    """One timed phase; times are ``perf_counter_ns`` readings"""
+    
+    __slots__ = ("name", "span_id", "parent", "kind", "start", "end", "attributes")
+    
+    def __init__(self, name: str, parent: Optional["Span"], kind: int = KIND_INTERNAL):
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent = parent
+        self.kind = kind
+        self.start = time.perf_counter_ns()
+        self.end: Optional[int] = None
+        self.attributes: Dict[str, Any] = {}
+    
+    @property
+    def duration_ms(self) -> float:
+        end = self.end if self.end is not None else time.perf_counter_ns()
+        return (end - self.start) / 1e6
+
+
+class RequestTiming:
+    """Span tree of one request.
+    
+    The timing of the request being handled is found through a context
+    variable, so deeply nested code records phases without it being passed
+    around; with no timing active ``phase`` returns a shared no-op context.
+    Work that is spread over many small slices, like translating a stream
+    chunk by chunk, is summed with ``add`` instead of getting a span each.
+    """
+    
+    def __init__(self, name: str = "POST /v1/chat/completions"):
+        self.trace_id = secrets.token_hex(16)
+        # Anchors perf_counter readings to wall clock time for export
+        self.unix_ns = time.time_ns()
+        self.root = Span(name, None, KIND_SERVER)
+        self.spans: List[Span] = [self.root]
+        self.totals: Dict[str, float] = {}
+    
+    def start(self, name: str, parent: Optional[Span] = None, kind: int = KIND_INTERNAL) -> Span:
+        span = Span(name, parent or self.root, kind)
+        self.spans.append(span)
+        return span
+    
+    @contextmanager
+    def span(self, name: str, parent: Optional[Span] = None, kind: int = KIND_INTERNAL) -> Iterator[Span]:
+        span = self.start(name, parent, kind)
+        try:
+            yield span
+        finally:
+            span.end = time.perf_counter_ns()
+    
+    def mark(self, name: str) -> Span:
+        """Record a phase that began with the request and ends now"""
+        span = self.start(name)
+        span.start, span.end = self.root.start, time.perf_counter_ns()
+        return span
+    
+    def add(self, name: str, seconds: float) -> None:
+        """Add time to a phase that is measured in slices"""
+        self.totals[name] = self.totals.get(name, 0.0) + seconds
+    
+    def finish(self) -> None:
+        """End the root span and any span left open by an error"""
+        end = time.perf_counter_ns()
+        for span in self.spans:
+            if span.end is None:
+                span.end = end
+                if span is not self.root:
+                    span.attributes.setdefault("error", True)
+        for name, seconds in self.totals.items():
+            self.root.attributes[f"{name}.duration_ms"] = round(seconds * 1e3, 3)
+    
+    def server_timing(self) -> str:
+        """``Server-Timing`` value: milliseconds per phase, then the total"""
+        durations: Dict[str, float] = {}
+        for span in self.spans[1:]:
+            durations[span.name] = durations.get(span.name, 0.0) + span.duration_ms
+        for name, seconds in self.totals.items():
+            durations[name] = durations.get(name, 0.0) + seconds * 1e3
+        durations["total"] = self.root.duration_ms
+        return ", ".join(f"{name};dur={duration:.2f}" for name, duration in durations.items())
+    
+    async def trailer(self, frames: AsyncIterator[str]) -> AsyncIterator[str]:
+        """Pass a stream through, adding the timings as an SSE comment before ``[DONE]``"""
+        sent = False
+        async for frame in frames:
+            if frame == DONE_FRAME and not sent:
+                sent = True
+                yield f": server-timing {self.server_timing()}\n\n"
+            yield frame
+        if not sent:
+            yield f": server-timing {self.server_timing()}\n\n"
+    
+    def httpcore_trace(self, upstream: Span) -> Callable[[str, Dict[str, Any]], Awaitable[None]]:
+        """httpcore ``trace`` callback splitting an upstream call into its phases.
+        
+        httpcore reports nothing while a request waits for a pooled
+        connection, so that wait ends at the first event of any kind.
+        """
+        state: Dict[str, Span] = {}
+        
+        async def trace(event: str, info: Dict[str, Any]) -> None:
+            now = time.perf_counter_ns()
+            if not state:
+                pool = state["pool"] = self.start("pool", upstream)
+                pool.start, pool.end = upstream.start, now
+            _, _, step = event.partition(".")
+            if step == "connect_tcp.started":
+                state["connect"] = self.start("connect", upstream)
+            elif step in ("connect_tcp.complete", "start_tls.complete") and "connect" in state:
+                state["connect"].end = now
+            elif step == "send_request_headers.started":
+                state["ttfb"] = self.start("ttfb", upstream)
+            elif step == "receive_response_headers.complete" and "ttfb" in state:
+                state["ttfb"].end = now
+        
+        return trace
+    
+    def to_otlp(self) -> Dict[str, Any]:
+        """The span tree in the OTLP/JSON shape used by OpenTelemetry file exporters"""
+        offset = self.unix_ns - self.root.start
+        spans = []
+        for span in self.spans:
+            record = {
+                "traceId": self.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": span.kind,
+                "startTimeUnixNano": str(span.start + offset),
+                "endTimeUnixNano": str((span.end or span.start) + offset),
+                "attributes": [
+                    {"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()
+                ],
+            }
+            if span.parent is not None:
+                record["parentSpanId"] = span.parent.span_id
+            spans.append(record)
+        return {
+            "resourceSpans": [{
+                "resource": {
+                    "attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}],
+                },
+                "scopeSpans": [{"scope": {"name": "testdriver_proxy"}, "spans": spans}],
+            }],
+        }
+
+
+def current_timing() -> Optional[RequestTiming]:
+    """Timing of the request being handled, if timing is on"""
+    return _current.get()
+
+
+def phase(name: str, kind: int = KIND_INTERNAL) -> AbstractContextManager:
+    """Time a block as a phase of the current request; a no-op when timing is off"""
+    timing = _current.get()
+    if timing is None:
+        return _NO_PHASE
+    return timing.span(name, kind=kind)
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class TraceExporter:
+    """Appends span trees as JSON lines to a size-rotated file.
+    
+    With several workers each process writes its own file, named after its
+    pid, so rotation never races.
+    """
+    
+    def __init__(self, config: Config):
+        path = config.trace_export_path
+        if config.workers > 1:
+            root, ext = os.path.splitext(path)
+            path = f"{root}.{os.getpid()}{ext}"
+        self.path = path
+        self.max_bytes = config.trace_export_max_bytes
+        self.backups = config.trace_export_backups
+        self.exported = 0
+        self._file = None
+        self._size = 0
+    
+    def export(self, timing: RequestTiming) -> None:
+        line = json.dumps(timing.to_otlp(), separators=(",", ":")) + "\n"
+        try:
+            if self._file is None:
+                self._open()
+            elif self._size + len(line) > self.max_bytes:
+                self._rotate()
+            self._file.write(line)
+            self._size += len(line)
+            self.exported += 1
+        except OSError as e:
+            logger.warning(f"Failed to export trace to {self.path}: {e}")
+    
+    def _open(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._size = self._file.tell()
+    
+    def _rotate(self) -> None:
+        self.close()
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._open()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {"path": self.path, "exported": self.exported}
+    
+    def flush(self) -> None:
+        if self._file is not None:
+            self._file.flush()
+    
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class TimingMiddleware:
+    """Times every request to ``path`` from its arrival to its last byte"""
+    
+    def __init__(self, app: Callable, path: str, exporter: Optional[TraceExporter] = None):
+        self.app = app
+        self.path = path
+        self.exporter = exporter
+    
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http" or scope["path"] != self.path:
+            await self.app(scope, receive, send)
+            return
+        
+        timing = RequestTiming(f"{scope['method']} {self.path}")
+        token = _current.set(timing)
+        
+        async def send_status(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                timing.root.attributes["http.response.status_code"] = message["status"]
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            _current.reset(token)
+            timing.finish()
+            if self.exporter is not None:
+                self.exporter.export(timing)
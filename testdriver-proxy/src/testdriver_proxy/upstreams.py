@@ -0,0 +1,262 @@
+"""
+Load balancing across upstream targets
+"""
+
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+from dataclasses import replace
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+
+from .circuit import CircuitBreaker, CircuitOpen
+from .config import Config
+from .metrics import Metrics
+from .pool import UpstreamPool
+
+logger = logging.getLogger(__name__)
+
+# Upstream answers that count against a target's health
+FAILURE_STATUS_CODES = frozenset({429, 500, 502, 503, 504, 529})
+
+# Share of its weight a target gets right after it is let back in
+SLOW_START_FLOOR = 0.1
+
+# Ejections back to back double the time out, up to this many times
+MAX_EJECTION_DOUBLINGS = 4
+
+
+class UpstreamCall:
+    """A call to a target; ``record`` reports how it went, once per call"""
+    
+    __slots__ = ("upstream", "client", "recorded")
+    
+    def __init__(self, upstream: "Upstream", client: httpx.AsyncClient):
+        self.upstream = upstream
+        self.client = client
+        self.recorded = False
+    
+    def record(self, status_code: Optional[int], latency: Optional[float] = None) -> None:
+        """Report the call's outcome; later reports of the same call are ignored"""
+        if self.recorded:
+            return
+        self.recorded = True
+        self.upstream.record(status_code, latency)
+
+
+class Upstream:
+    """One upstream target: its URL, key, weight, connections and health.
+    
+    Health is tracked passively from real traffic. After ``eject_failures``
+    failures in a row (transport errors or statuses in
+    ``FAILURE_STATUS_CODES``) the target is ejected for ``eject_time``
+    seconds, doubling for each ejection that follows soon after. When it
+    comes back its share of traffic ramps up from ``SLOW_START_FLOOR`` of
+    its weight over ``slow_start`` seconds. The same outcomes, with their
+    latency, feed the target's circuit breaker.
+    """
+    
+    def __init__(
+        self,
+        config: Config,
+        name: str,
+        base_url: str,
+        api_key: Optional[str],
+        weight: float = 1.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        metrics: Optional[Metrics] = None,
+    ):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.url = f"{self.base_url}/v1/messages"
+        self.headers = {
+            "anthropic-version": "2023-06-01",
+            "content-type": "application/json",
+        }
+        if api_key:
+            self.headers["x-api-key"] = api_key
+        self.weight = weight
+        self.pool = UpstreamPool(config, transport, metrics)
+        self.breaker = CircuitBreaker(config, name)
+        self.eject_failures = config.upstream_eject_failures
+        self.eject_time = config.upstream_eject_time
+        self.slow_start = config.upstream_slow_start
+        
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.recent_ejections = 0
+        self.ejected_until = 0.0
+        self.recovered_at: Optional[float] = None
+    
+    def available(self, now: float) -> bool:
+        return now >= self.ejected_until
+    
+    def effective_weight(self, now: float) -> float:
+        """Weight scaled down while the target is easing back in after an ejection"""
+        if self.recovered_at is None or self.slow_start <= 0:
+            return self.weight
+        ramp = (now - self.recovered_at) / self.slow_start
+        if ramp >= 1:
+            return self.weight
+        return self.weight * max(SLOW_START_FLOOR, ramp)
+    
+    def record(self, status_code: Optional[int], latency: Optional[float] = None) -> None:
+        """Report how a call went: its status, or None for a transport error,
+        and the time its response headers took
+        """
+        now = time.monotonic()
+        failed = status_code is None or status_code in FAILURE_STATUS_CODES
+        self.breaker.record(failed, latency)
+        if not failed:
+            self.consecutive_failures = 0
+            if self.recovered_at is not None and now - self.recovered_at >= self.slow_start:
+                # Back to full weight without failing again
+                self.recovered_at = None
+                self.recent_ejections = 0
+            return
+        
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.eject_failures and self.consecutive_failures >= self.eject_failures and self.available(now):
+            duration = self.eject_time * 2 ** min(self.recent_ejections, MAX_EJECTION_DOUBLINGS)
+            logger.warning(
+                f"Ejecting upstream {self.name} for {duration:.0f}s "
+                f"after {self.consecutive_failures} failures in a row"
+            )
+            self.ejections += 1
+            self.recent_ejections += 1
+            self.consecutive_failures = 0
+            self.ejected_until = now + duration
+            self.recovered_at = self.ejected_until
+    
+    @asynccontextmanager
+    async def track(self) -> AsyncIterator[UpstreamCall]:
+        """Yield a call on the target's client while counting it as outstanding
+        
+        The caller reports the status with ``UpstreamCall.record`` once the
+        headers arrive. A transport error raised inside the block counts as a
+        failure only if nothing was reported yet, so a stream that breaks off
+        after its headers is not counted twice.
+        """
+        self.outstanding += 1
+        self.requests += 1
+        try:
+            async with self.pool.track() as client:
+                call = UpstreamCall(self, client)
+                try:
+                    yield call
+                except httpx.TransportError:
+                    call.record(None)
+                    raise
+        finally:
+            self.outstanding -= 1
+    
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "name": self.name,
+            "base_url": self.base_url,
+            "weight": self.weight,
+            "effective_weight": round(self.effective_weight(now), 3),
+            "healthy": self.available(now),
+            "ejected_for": round(max(0.0, self.ejected_until - now), 1),
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "ejections": self.ejections,
+            "circuit": self.breaker.stats(),
+            "pool": self.pool.stats(),
+        }
+
+
+class UpstreamBalancer:
+    """Spreads upstream calls over the configured targets.
+    
+    Targets come from ``config.upstreams``; without any, the single
+    ``zai_base_url`` and ``zai_api_key`` are used. Each call goes to the
+    less loaded of two targets drawn at random by weight (power of two
+    choices), load being outstanding calls per unit of weight. Ejected
+    targets are skipped unless every target is ejected, in which case all
+    of them are tried rather than failing outright. Targets whose circuit
+    breaker is open are always skipped, and when that is all of them calls
+    fail at once with ``CircuitOpen``.
+    """
+    
+    def __init__(
+        self,
+        config: Config,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        metrics: Optional[Metrics] = None,
+    ):
+        specs = config.upstreams or [{"base_url": config.zai_base_url}]
+        self.targets: List[Upstream] = []
+        for index, spec in enumerate(specs):
+            target_config = config
+            if "max_connections" in spec:
+                connections = int(spec["max_connections"])
+                target_config = replace(
+                    config,
+                    pool_max_connections=connections,
+                    pool_max_keepalive=min(config.pool_max_keepalive, connections),
+                )
+            self.targets.append(Upstream(
+                target_config,
+                spec.get("name") or f"upstream-{index}",
+                spec["base_url"],
+                spec.get("api_key", config.zai_api_key),
+                float(spec.get("weight", 1.0)),
+                transport,
+                metrics,
+            ))
+        self._random = random.Random()
+    
+    def open(self) -> None:
+        for target in self.targets:
+            target.pool.open()
+    
+    async def aclose(self) -> None:
+        for target in self.targets:
+            await target.pool.aclose()
+    
+    def _allowed(self, now: float) -> List[Upstream]:
+        allowed = [target for target in self.targets if target.breaker.available(now)]
+        if not allowed:
+            raise CircuitOpen(min(target.breaker.retry_after(now) for target in self.targets))
+        return allowed
+    
+    def check(self) -> None:
+        """Raise ``CircuitOpen`` if no target would take a call now"""
+        self._allowed(time.monotonic())
+    
+    def choose(self) -> Upstream:
+        """The target for the next call"""
+        now = time.monotonic()
+        target = self._pick(self._allowed(now), now)
+        target.breaker.acquire(now)
+        return target
+    
+    def _pick(self, allowed: List[Upstream], now: float) -> Upstream:
+        if len(allowed) == 1:
+            return allowed[0]
+        candidates = [target for target in allowed if target.available(now)] or allowed
+        if len(candidates) == 1:
+            return candidates[0]
+        
+        weights = [target.effective_weight(now) for target in candidates]
+        first = self._random.choices(range(len(candidates)), weights)[0]
+        rest = [i for i in range(len(candidates)) if i != first]
+        second = self._random.choices(rest, [weights[i] for i in rest])[0]
+        # On a tie, such as when both are idle, the first draw wins, so light
+        # traffic still follows the weights
+        return min(
+            (candidates[first], candidates[second]),
+            key=lambda target: target.outstanding / target.effective_weight(now),
+        )
+    
+    def stats(self) -> List[Dict[str, Any]]:
+        return [target.stats() for target in self.targets]
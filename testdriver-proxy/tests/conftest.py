@@ -0,0 +1,40 @@
+"""
+Shared test fixtures
+"""
+
+import json
+import pytest
+import httpx
+
+
+@pytest.fixture
+def upstream_transport():
+    """Factory of mock upstreams answering with a short Anthropic message, streamed if asked"""
+    
+    def make(input_tokens=12, output_tokens=3):
+        events = [
+            {"type": "message_start", "message": {"usage": {"input_tokens": input_tokens}}},
+            {"type": "content_block_start"},
+            {"type": "content_block_delta", "delta": {"type": "text_delta", "text": "Hi"}},
+            {
+                "type": "message_delta",
+                "delta": {"stop_reason": "end_turn"},
+                "usage": {"output_tokens": output_tokens},
+            },
+            {"type": "message_stop"},
+        ]
+        body = "".join(f"event: {e['type']}\ndata: {json.dumps(e)}\n\n" for e in events)
+        
+        def handler(request):
+            if json.loads(request.content).get("stream"):
+                return httpx.Response(200, text=body)
+            return httpx.Response(200, json={
+                "id": "msg_1",
+                "content": [{"type": "text", "text": "Hi"}],
+                "stop_reason": "end_turn",
+                "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens},
+            })
+        
+        return httpx.MockTransport(handler)
+    
+    return make
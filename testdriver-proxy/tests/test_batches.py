@@ -0,0 +1,358 @@
+"""
+Tests for batch files, batch jobs and multipart uploads
+"""
+
+import asyncio
+import json
+import os
+import time
+import pytest
+import httpx
+from fastapi.testclient import TestClient
+from testdriver_proxy.batches import BatchScheduler, BatchStore, finished_ids, validate_input
+from testdriver_proxy.circuit import CircuitOpen
+from testdriver_proxy.config import Config
+from testdriver_proxy.multipart import MultipartError, boundary_of, read_multipart
+from testdriver_proxy.proxy import create_app
+
+
+@pytest.fixture
+def config(tmp_path):
+    """Test configuration with batches on"""
+    return Config(
+        zai_api_key="test-key",
+        http2=False,
+        log_requests=False,
+        batch_enabled=True,
+        batch_dir=str(tmp_path / "batches"),
+        batch_concurrency=4,
+    )
+
+
+@pytest.fixture(autouse=True)
+def fast_scheduler(monkeypatch):
+    """Poll and check in often so tests do not wait for the scheduler"""
+    monkeypatch.setattr(BatchScheduler, "POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(BatchScheduler, "HEARTBEAT_INTERVAL", 0.01)
+
+
+def upstream_transport(calls=None, fail=()):
+    """Mock upstream echoing the prompt, failing for prompts in ``fail``"""
+    def handler(request):
+        prompt = json.loads(request.content)["messages"][0]["content"]
+        if calls is not None:
+            calls.append(prompt)
+        if prompt in fail:
+            return httpx.Response(400, json={"type": "error"})
+        return httpx.Response(200, json={
+            "id": "msg_1",
+            "content": [{"type": "text", "text": f"echo {prompt}"}],
+            "stop_reason": "end_turn",
+            "usage": {"input_tokens": 5, "output_tokens": 2},
+        })
+    
+    return httpx.MockTransport(handler)
+
+
+def batch_line(custom_id, prompt=None):
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {"model": "glm-4.5", "messages": [{"role": "user", "content": prompt or custom_id}]},
+    }
+
+
+def jsonl(lines):
+    return "".join(json.dumps(line) + "\n" for line in lines).encode()
+
+
+def wait_for(client, batch_id, statuses=("completed", "failed", "cancelled", "expired")):
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        batch = client.get(f"/v1/batches/{batch_id}").json()
+        if batch["status"] in statuses:
+            return batch
+        time.sleep(0.02)
+    raise AssertionError(f"Batch stuck in {batch['status']}")
+
+
+def results(client, file_id):
+    return [json.loads(line) for line in client.get(f"/v1/files/{file_id}/content").text.splitlines()]
+
+
+async def chunks_of(data, size):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+class TestMultipart:
+    """Test the streaming form parser"""
+    
+    def body(self, boundary="xyz"):
+        return (
+            f"--{boundary}\r\n"
+            'Content-Disposition: form-data; name="purpose"\r\n\r\n'
+            "batch\r\n"
+            f"--{boundary}\r\n"
+            'Content-Disposition: form-data; name="file"; filename="in.jsonl"\r\n'
+            "Content-Type: application/jsonl\r\n\r\n"
+            "line one\r\nline two --xy\n"
+            f"\r\n--{boundary}--\r\n"
+        ).encode()
+    
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("size", [1, 3, 7, 4096])
+    async def test_fields_and_file_across_chunks(self, tmp_path, size):
+        opened = []
+        
+        def open_file(field, filename):
+            opened.append((field, filename))
+            return open(tmp_path / "upload", "wb")
+        
+        fields = await read_multipart(chunks_of(self.body(), size), b"xyz", open_file, 1024)
+        
+        assert fields == {"purpose": "batch"}
+        assert opened == [("file", "in.jsonl")]
+        assert (tmp_path / "upload").read_bytes() == b"line one\r\nline two --xy\n"
+    
+    @pytest.mark.asyncio
+    async def test_limits_and_truncation(self, tmp_path):
+        def open_file(field, filename):
+            return open(tmp_path / "upload", "wb")
+        
+        with pytest.raises(MultipartError, match="larger"):
+            await read_multipart(chunks_of(self.body(), 5), b"xyz", open_file, 10)
+        with pytest.raises(MultipartError, match="ended"):
+            await read_multipart(chunks_of(self.body()[:-10], 5), b"xyz", open_file, 1024)
+    
+    def test_boundary(self):
+        assert boundary_of('multipart/form-data; boundary="a b"') == b"a b"
+        with pytest.raises(MultipartError):
+            boundary_of("application/json")
+
+
+class TestValidation:
+    """Test input file checks and resume bookkeeping"""
+    
+    def test_validate_input(self, tmp_path):
+        path = tmp_path / "in.jsonl"
+        bad_url = {**batch_line("b"), "url": "/v1/embeddings"}
+        path.write_bytes(jsonl([batch_line("a"), batch_line("a"), bad_url]) + b"not json\n\n")
+        
+        total, errors = validate_input(str(path), "/v1/chat/completions", 100)
+        
+        assert total == 4
+        assert [(e["code"], e["line"]) for e in errors] == [
+            ("duplicate_custom_id", 2), ("mismatched_endpoint", 3), ("invalid_json_line", 4)
+        ]
+    
+    def test_finished_ids_drops_torn_line(self, tmp_path):
+        path = tmp_path / "out.jsonl"
+        path.write_bytes(b'{"custom_id": "a"}\n{"custom_id": "b"}\n{"custom_id": "c"')
+        
+        ids, count = finished_ids(str(path))
+        
+        assert ids == {"a", "b"} and count == 2
+        assert path.read_bytes().endswith(b'"b"}\n')
+    
+    def test_claim_skips_live_owner(self, tmp_path):
+        store = BatchStore(str(tmp_path))
+        store.add_batch({"id": "batch_1", "status": "in_progress", "created_at": 1})
+        
+        assert store.claim("a", stale_before=time.time() - 30)["id"] == "batch_1"
+        assert store.claim("b", stale_before=time.time() - 30) is None
+        # Owner "a" stopped checking in
+        assert store.claim("b", stale_before=time.time() + 1)["id"] == "batch_1"
+        assert store.update_batch("batch_1", {"status": "finalizing"}, owner="a") is None
+        store.close()
+
+
+class TestScheduler:
+    """Test BatchScheduler against a store, without the HTTP layer"""
+    
+    def start(self, config, lines, status="validating"):
+        """A stored batch over ``lines``, claimed by a new scheduler"""
+        store = BatchStore(config.batch_dir)
+        file_id, path = store.new_file_path()
+        with open(path, "wb") as f:
+            f.write(jsonl(lines))
+        store.add_file(file_id, path, "input.jsonl", "batch")
+        store.add_batch({
+            "id": "batch_1",
+            "status": status,
+            "created_at": 1,
+            "input_file_id": file_id,
+            "endpoint": "/v1/chat/completions",
+            "expires_at": time.time() + 3600,
+            "request_counts": {"total": len(lines), "completed": 0, "failed": 0},
+        })
+        return store
+    
+    @pytest.mark.asyncio
+    async def test_cancel_during_validation_is_kept(self, config):
+        store = self.start(config, [batch_line("a"), {"custom_id": "b"}])
+        scheduler = BatchScheduler(config, store, None, lambda: 0)
+        batch = store.claim(scheduler.owner, stale_before=time.time())
+        store.update_batch("batch_1", {"status": "cancelling"})
+        
+        await scheduler._process(batch)
+        
+        assert store.get_batch("batch_1")["status"] == "cancelled"
+        store.close()
+    
+    @pytest.mark.asyncio
+    async def test_request_turned_away_too_long_fails(self, config, monkeypatch):
+        monkeypatch.setattr(BatchScheduler, "LIMIT_RETRY_SECONDS", 0.0)
+        
+        async def run(body):
+            raise CircuitOpen(30)
+        
+        store = self.start(config, [batch_line("a")], status="in_progress")
+        scheduler = BatchScheduler(config, store, run, lambda: 0)
+        
+        await scheduler._process(store.claim(scheduler.owner, stale_before=time.time()))
+        
+        batch = store.get_batch("batch_1")
+        assert batch["status"] == "completed"
+        assert batch["request_counts"] == {"total": 1, "completed": 0, "failed": 1}
+        with open(store.get_file(batch["error_file_id"])[1]) as f:
+            (error,) = [json.loads(line) for line in f]
+        assert error["response"]["status_code"] == 503
+        assert error["error"]["code"] == "503"
+        store.close()
+
+
+class TestBatchEndpoints:
+    """Test /v1/files and /v1/batches end to end"""
+    
+    def upload(self, client, lines):
+        response = client.post(
+            "/v1/files", data={"purpose": "batch"}, files={"file": ("input.jsonl", jsonl(lines))}
+        )
+        assert response.status_code == 200, response.text
+        return response.json()
+    
+    def test_disabled_by_default(self):
+        client = TestClient(create_app(Config(zai_api_key="test-key", http2=False)))
+        assert client.get("/v1/batches").status_code == 404
+    
+    def test_batch_runs_to_completion(self, config):
+        calls = []
+        app = create_app(config, upstream_transport(calls, fail={"bad"}))
+        
+        with TestClient(app) as client:
+            file = self.upload(client, [batch_line(f"req-{i}") for i in range(10)] + [batch_line("x", "bad")])
+            assert file["purpose"] == "batch" and file["bytes"] > 0
+            
+            response = client.post("/v1/batches", json={
+                "input_file_id": file["id"],
+                "endpoint": "/v1/chat/completions",
+                "completion_window": "24h",
+                "metadata": {"run": "nightly"},
+            })
+            assert response.status_code == 200
+            batch = wait_for(client, response.json()["id"])
+            
+            assert batch["status"] == "completed"
+            assert batch["request_counts"] == {"total": 11, "completed": 10, "failed": 1}
+            assert batch["metadata"] == {"run": "nightly"}
+            output = results(client, batch["output_file_id"])
+            errors = results(client, batch["error_file_id"])
+            assert client.get("/v1/batches").json()["data"][0]["id"] == batch["id"]
+        
+        assert sorted(calls) == sorted([f"req-{i}" for i in range(10)] + ["bad"])
+        assert {line["custom_id"] for line in output} == {f"req-{i}" for i in range(10)}
+        line = next(line for line in output if line["custom_id"] == "req-3")
+        assert line["response"]["status_code"] == 200
+        assert line["response"]["body"]["choices"][0]["message"]["content"] == "echo req-3"
+        assert [(e["custom_id"], e["response"]["status_code"]) for e in errors] == [("x", 500)]
+    
+    def test_invalid_input_fails_batch(self, config):
+        with TestClient(create_app(config, upstream_transport())) as client:
+            file = self.upload(client, [batch_line("a"), {"custom_id": "b"}])
+            batch_id = client.post("/v1/batches", json={
+                "input_file_id": file["id"], "endpoint": "/v1/chat/completions",
+            }).json()["id"]
+            batch = wait_for(client, batch_id)
+        
+        assert batch["status"] == "failed"
+        assert {e["line"] for e in batch["errors"]["data"]} == {2}
+    
+    def test_rejected_requests(self, config):
+        with TestClient(create_app(config, upstream_transport())) as client:
+            assert client.post("/v1/files", content=b"{}").status_code == 400
+            response = client.post(
+                "/v1/files", data={"purpose": "fine-tune"}, files={"file": ("a.jsonl", b"{}\n")}
+            )
+            assert response.status_code == 400
+            assert client.get("/v1/files").json()["data"] == []
+            
+            response = client.post("/v1/batches", json={
+                "input_file_id": "file-missing", "endpoint": "/v1/chat/completions",
+            })
+            assert response.status_code == 404
+            assert response.json()["error"]["code"] == "not_found"
+            
+            file = self.upload(client, [batch_line("a")])
+            response = client.post("/v1/batches", json={
+                "input_file_id": file["id"], "endpoint": "/v1/embeddings",
+            })
+            assert response.status_code == 400
+    
+    def test_resume_after_restart(self, config, monkeypatch):
+        calls = []
+        lines = [batch_line(f"req-{i}") for i in range(6)]
+        
+        # A previous process wrote two results and died holding the batch
+        with TestClient(create_app(config, upstream_transport())) as client:
+            client.app.state.proxy.batches.scheduler._task.cancel()
+            file = self.upload(client, lines)
+            batch_id = client.post("/v1/batches", json={
+                "input_file_id": file["id"], "endpoint": "/v1/chat/completions",
+            }).json()["id"]
+        store = BatchStore(config.batch_dir)
+        store.update_batch(batch_id, {
+            "status": "in_progress", "request_counts": {"total": 6, "completed": 0, "failed": 0},
+        })
+        store.claim("dead-worker", stale_before=time.time())
+        os.makedirs(f"{config.batch_dir}/results")
+        with open(f"{config.batch_dir}/results/{batch_id}.output.jsonl", "w") as f:
+            for line in lines[:2]:
+                f.write(json.dumps({"custom_id": line["custom_id"], "response": {"status_code": 200}}) + "\n")
+            f.write('{"custom_id": "req-2", "resp')
+        store.close()
+        monkeypatch.setattr(BatchScheduler, "LEASE", 0.05)
+        
+        with TestClient(create_app(config, upstream_transport(calls))) as client:
+            batch = wait_for(client, batch_id)
+            ids = [line["custom_id"] for line in results(client, batch["output_file_id"])]
+        
+        assert batch["status"] == "completed"
+        assert batch["request_counts"] == {"total": 6, "completed": 6, "failed": 0}
+        assert sorted(calls) == ["req-2", "req-3", "req-4", "req-5"]
+        assert sorted(ids) == [f"req-{i}" for i in range(6)]
+    
+    def test_cancel(self, config):
+        release = asyncio.Event()
+        
+        async def handler(request):
+            await release.wait()
+            return httpx.Response(200, json={"content": [], "stop_reason": "end_turn"})
+        
+        with TestClient(create_app(config, httpx.MockTransport(handler))) as client:
+            file = self.upload(client, [batch_line(f"req-{i}") for i in range(20)])
+            batch_id = client.post("/v1/batches", json={
+                "input_file_id": file["id"], "endpoint": "/v1/chat/completions",
+            }).json()["id"]
+            wait_for(client, batch_id, ("in_progress",))
+            
+            response = client.post(f"/v1/batches/{batch_id}/cancel")
+            assert response.status_code == 200
+            assert response.json()["status"] == "cancelling"
+            client.portal.call(release.set)
+            batch = wait_for(client, batch_id)
+            
+            assert batch["status"] == "cancelled"
+            assert batch["request_counts"]["completed"] <= config.batch_concurrency
+            assert client.post(f"/v1/batches/{batch_id}/cancel").status_code == 409
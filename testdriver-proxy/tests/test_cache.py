@@ -0,0 +1,272 @@
+"""
+Tests for response cache
+"""
+
+import json
+import pytest
+import httpx
+from testdriver_proxy.cache import (
+    Completion,
+    DiskCache,
+    LRUCache,
+    ResponseCache,
+    request_key,
+)
+from testdriver_proxy.config import Config
+from testdriver_proxy.models import ChatCompletionRequest, Message
+from testdriver_proxy.proxy import ZAIProxy
+
+
+@pytest.fixture
+def config():
+    """Test configuration with caching enabled"""
+    return Config(
+        zai_api_key="test-key",
+        cache_enabled=True,
+        http2=False,
+        log_requests=False,
+    )
+
+
+def anthropic_transport(text="Hello!"):
+    """Mock upstream returning a fixed Anthropic message"""
+    calls = []
+    
+    def handler(request):
+        calls.append(json.loads(request.content))
+        return httpx.Response(200, json={
+            "id": "msg_123",
+            "type": "message",
+            "role": "assistant",
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "usage": {"input_tokens": 10, "output_tokens": 5},
+        })
+    
+    return httpx.MockTransport(handler), calls
+
+
+def make_request(**kwargs):
+    return ChatCompletionRequest(
+        model="glm-4.5",
+        messages=[Message(role="user", content="Hello")],
+        **{"temperature": 0, **kwargs},
+    )
+
+
+class TestRequestKey:
+    """Test canonical request hashing"""
+    
+    def test_key_ignores_stream_and_order(self):
+        a = {"model": "m", "messages": [{"role": "user", "content": "x"}], "stream": True}
+        b = {"stream": False, "messages": [{"content": "x", "role": "user"}], "model": "m"}
+        assert request_key(a) == request_key(b)
+    
+    def test_key_depends_on_sampling(self):
+        a = {"model": "m", "messages": [], "temperature": 0}
+        b = {"model": "m", "messages": [], "temperature": 0.5}
+        assert request_key(a) != request_key(b)
+
+
+class TestLRUCache:
+    """Test LRUCache class"""
+    
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_bytes=30, ttl=60)
+        cache.set("a", b"x" * 10)
+        cache.set("b", b"x" * 10)
+        cache.get("a")
+        cache.set("c", b"x" * 10)
+        
+        assert cache.get("a") is not None
+        assert cache.get("b") is None
+        assert cache.get("c") is not None
+        assert cache.evictions == 1
+        assert cache.size <= 30
+    
+    def test_expired_entries_are_dropped(self):
+        cache = LRUCache(max_bytes=100, ttl=60)
+        cache.set("a", b"value", ttl=0)
+        
+        assert cache.get("a") is None
+        assert cache.size == 0
+    
+    def test_oversized_values_are_skipped(self):
+        cache = LRUCache(max_bytes=4, ttl=60)
+        cache.set("a", b"too large")
+        assert len(cache) == 0
+
+
+class TestDiskCache:
+    """Test DiskCache class"""
+    
+    def test_round_trip(self, tmp_path):
+        cache = DiskCache(str(tmp_path / "cache.db"), max_bytes=1024, ttl=60)
+        cache.set("a", b"value")
+        
+        ttl, value = cache.get("a")
+        assert value == b"value"
+        assert 0 < ttl <= 60
+        assert cache.get("missing") is None
+        cache.close()
+    
+    def test_shared_between_connections(self, tmp_path):
+        path = str(tmp_path / "cache.db")
+        writer = DiskCache(path, max_bytes=1024, ttl=60)
+        reader = DiskCache(path, max_bytes=1024, ttl=60)
+        writer.set("a", b"value")
+        
+        assert reader.get("a")[1] == b"value"
+        writer.close()
+        reader.close()
+    
+    def test_compaction_drops_least_recently_used(self, tmp_path, monkeypatch):
+        cache = DiskCache(str(tmp_path / "cache.db"), max_bytes=100, ttl=60)
+        clock = iter(range(1000, 2000))
+        monkeypatch.setattr("testdriver_proxy.cache.time.time", lambda: next(clock))
+        
+        cache.set("a", b"x" * 40)
+        cache.set("b", b"x" * 40)
+        cache.get("a")
+        cache.set("c", b"x" * 40)
+        
+        assert cache.get("a") is not None
+        assert cache.get("b") is None
+        assert cache.stats()["bytes"] <= 100
+        assert cache.compactions == 1
+        cache.close()
+    
+    def test_size_total_tracks_every_writer(self, tmp_path):
+        path = str(tmp_path / "cache.db")
+        first = DiskCache(path, max_bytes=1024, ttl=60)
+        second = DiskCache(path, max_bytes=1024, ttl=60)
+        first.set("a", b"x" * 40)
+        second.set("b", b"x" * 30)
+        second.set("a", b"x" * 10)  # Replacing an entry counts only its new size
+        
+        conn = first._connect()
+        (total,) = conn.execute("SELECT total FROM responses_size").fetchone()
+        (summed,) = conn.execute("SELECT SUM(size) FROM responses").fetchone()
+        assert total == summed == 40
+        assert first.stats()["bytes"] == 40
+        first.close()
+        second.close()
+
+
+class TestResponseCache:
+    """Test ResponseCache eligibility and counters"""
+    
+    def test_disabled_by_default(self):
+        cache = ResponseCache(Config())
+        assert cache.key_for({"model": "m", "temperature": 0}) is None
+    
+    def test_temperature_eligibility(self, config):
+        cache = ResponseCache(config)
+        assert cache.key_for({"model": "m", "temperature": 0}) is not None
+        assert cache.key_for({"model": "m", "temperature": 0.7}) is None
+    
+    @pytest.mark.asyncio
+    async def test_hit_and_miss_counters(self, config):
+        cache = ResponseCache(config)
+        completion = Completion(id="chatcmpl-1", content="Hi", finish_reason="stop")
+        
+        assert await cache.get("k") is None
+        await cache.set("k", completion)
+        assert await cache.get("k") == completion
+        stats = await cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+
+
+    @pytest.mark.asyncio
+    async def test_disk_tier_survives_restart(self, config, tmp_path):
+        config.cache_disk_path = str(tmp_path / "cache.db")
+        completion = Completion(id="chatcmpl-1", content="Hi", finish_reason="stop")
+        
+        first = ResponseCache(config)
+        await first.set("k", completion)
+        first.close()
+        
+        second = ResponseCache(config)
+        assert await second.get("k") == completion
+        assert second.disk_hits == 1
+        assert len(second.memory) == 1  # Promoted to memory
+        assert await second.get("k") == completion
+        assert second.disk_hits == 1
+        second.close()
+    
+    def test_state_dir_enables_shared_disk_tier(self, config, tmp_path):
+        config.state_dir = str(tmp_path)
+        cache = ResponseCache(config)
+        assert cache.disk.path == str(tmp_path / "cache.sqlite3")
+        
+        config.cache_disk_path = str(tmp_path / "explicit.db")
+        assert ResponseCache(config).disk.path == config.cache_disk_path
+
+
+class TestProxyCaching:
+    """Test caching through ZAIProxy"""
+    
+    @pytest.mark.asyncio
+    async def test_repeated_request_served_from_cache(self, config):
+        transport, calls = anthropic_transport()
+        proxy = ZAIProxy(config, transport=transport)
+        
+        first = await proxy.chat_completion(make_request())
+        second = await proxy.chat_completion(make_request())
+        await proxy.aclose()
+        
+        assert len(calls) == 1
+        assert second.choices[0].message.content == first.choices[0].message.content
+        assert second.usage.total_tokens == 15
+    
+    @pytest.mark.asyncio
+    async def test_sampled_request_not_cached(self, config):
+        transport, calls = anthropic_transport()
+        proxy = ZAIProxy(config, transport=transport)
+        
+        await proxy.chat_completion(make_request(temperature=0.7))
+        await proxy.chat_completion(make_request(temperature=0.7))
+        await proxy.aclose()
+        
+        assert len(calls) == 2
+    
+    @pytest.mark.asyncio
+    async def test_cached_entry_replayed_as_sse(self, config):
+        transport, calls = anthropic_transport(text="Cached text")
+        proxy = ZAIProxy(config, transport=transport)
+        
+        await proxy.chat_completion(make_request())
+        stream = await proxy.chat_completion(make_request(stream=True))
+        chunks = [c async for c in stream]
+        await proxy.aclose()
+        
+        assert len(calls) == 1
+        assert chunks[-1] == "data: [DONE]\n\n"
+        payloads = [json.loads(c[len("data: "):]) for c in chunks[:-1]]
+        content = "".join(p["choices"][0]["delta"].get("content", "") for p in payloads)
+        assert content == "Cached text"
+        assert payloads[-1]["choices"][0]["finish_reason"] == "stop"
+    
+    @pytest.mark.asyncio
+    async def test_stream_populates_cache(self, config):
+        events = [
+            {"type": "message_start", "message": {"usage": {"input_tokens": 7}}},
+            {"type": "content_block_start"},
+            {"type": "content_block_delta", "delta": {"type": "text_delta", "text": "Str"}},
+            {"type": "content_block_delta", "delta": {"type": "text_delta", "text": "eamed"}},
+            {"type": "message_delta", "delta": {"stop_reason": "end_turn"}, "usage": {"output_tokens": 2}},
+            {"type": "message_stop"},
+        ]
+        body = "".join(f"event: {e['type']}\ndata: {json.dumps(e)}\n\n" for e in events)
+        transport = httpx.MockTransport(lambda request: httpx.Response(200, text=body))
+        proxy = ZAIProxy(config, transport=transport)
+        
+        stream = await proxy.chat_completion(make_request(stream=True))
+        [c async for c in stream]
+        cached = await proxy.chat_completion(make_request())
+        await proxy.aclose()
+        
+        assert cached.choices[0].message.content == "Streamed"
+        assert cached.usage.prompt_tokens == 7
+        assert cached.usage.completion_tokens == 2
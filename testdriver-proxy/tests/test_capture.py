@@ -0,0 +1,133 @@
+"""
+Tests for traffic capture
+"""
+
+import json
+import os
+import pytest
+from fastapi.testclient import TestClient
+from testdriver_proxy.capture import FORMAT, VERSION, TrafficCapture, read_capture, request_shape
+from testdriver_proxy.config import Config
+from testdriver_proxy.metrics import Metrics
+from testdriver_proxy.models import ChatCompletionRequest
+from testdriver_proxy.proxy import create_app
+
+SCREENSHOT = "data:image/png;base64," + "A" * 1000
+
+
+
+def vision_request(stream=False):
+    return {
+        "model": "glm-4.5v",
+        "stream": stream,
+        "max_tokens": 256,
+        "messages": [
+            {"role": "system", "content": "secret system prompt"},
+            {"role": "user", "content": [
+                {"type": "text", "text": "secret question"},
+                {"type": "image_url", "image_url": {"url": SCREENSHOT}},
+                {"type": "image_url", "image_url": {"url": SCREENSHOT}},
+            ]},
+        ],
+    }
+
+
+def write_capture(path, started, records):
+    lines = [json.dumps({"format": FORMAT, "version": VERSION, "started": started})]
+    lines += [json.dumps(record) for record in records]
+    path.write_text("\n".join(lines) + "\n")
+
+
+class TestRequestShape:
+    """Test what is kept of a request"""
+    
+    def test_counts_images(self):
+        shape = request_shape(ChatCompletionRequest.model_validate(vision_request()))
+        
+        assert shape == {
+            "model": "glm-4.5v",
+            "stream": False,
+            "messages": 2,
+            "images": 2,
+            "image_bytes": 2 * len(SCREENSHOT),
+            "max_tokens": 256,
+        }
+    
+    def test_counts_anthropic_images(self):
+        request = vision_request()
+        request["messages"][1]["content"].append(
+            {"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": "A" * 500}}
+        )
+        
+        shape = request_shape(ChatCompletionRequest.model_validate(request))
+        
+        assert shape["images"] == 3
+        assert shape["image_bytes"] == 2 * len(SCREENSHOT) + 500
+
+
+class TestTrafficCapture:
+    """Test capture from the chat completions endpoint"""
+    
+    def test_records_shapes_and_timings(self, tmp_path, upstream_transport):
+        config = Config(
+            zai_api_key="test-key", http2=False, log_requests=False, traffic_capture_path=str(tmp_path / "capture.jsonl")
+        )
+        path = tmp_path / f"capture.{os.getpid()}.jsonl"
+        
+        with TestClient(create_app(config, upstream_transport())) as client:
+            assert client.post("/v1/chat/completions", json=vision_request()).status_code == 200
+            with client.stream("POST", "/v1/chat/completions", json=vision_request(stream=True)) as response:
+                response.read()
+            assert client.get("/stats").json()["capture"]["captured"] == 2
+        
+        text = path.read_text()
+        assert "secret" not in text
+        assert "AAAA" not in text
+        header, *lines = text.splitlines()
+        assert json.loads(header)["format"] == FORMAT
+        plain, streamed = (json.loads(line) for line in lines)
+        assert plain["status"] == streamed["status"] == 200
+        assert plain["images"] == 2
+        assert plain["request_bytes"] > plain["image_bytes"]
+        assert plain["output_tokens"] == 3
+        # Upstream time to first byte, for streams and whole responses alike
+        assert 0 < plain["ttfb"] <= plain["duration"]
+        assert 0 < streamed["ttfb"] <= streamed["duration"]
+        assert plain["ttft"] is None
+        assert 0 <= streamed["ttft"] <= streamed["duration"]
+        assert 0 <= plain["t"] <= streamed["t"]
+    
+    def test_stops_at_max_bytes(self, tmp_path):
+        config = Config(traffic_capture_path=str(tmp_path / "capture.jsonl"), traffic_capture_max_bytes=500)
+        capture = TrafficCapture(config)
+        path = tmp_path / f"capture.{os.getpid()}.jsonl"
+        tracker = Metrics(Config()).track("glm-4.5", False, 100)
+        tracker.finish(200, 50)
+        shape = request_shape(ChatCompletionRequest.model_validate(vision_request()))
+        
+        for _ in range(10):
+            capture.record(shape, tracker)
+        capture.close()
+        
+        assert capture.full
+        assert 0 < capture.captured < 10
+        assert path.stat().st_size <= 500
+
+
+class TestReadCapture:
+    """Test loading captures for replay"""
+    
+    def test_merges_workers(self, tmp_path):
+        write_capture(tmp_path / "a.jsonl", 1000.0, [{"t": 0.5}, {"t": 2.0}])
+        write_capture(tmp_path / "b.jsonl", 1001.0, [{"t": 0.25}])
+        
+        records = read_capture([str(tmp_path / "a.jsonl"), str(tmp_path / "b.jsonl")])
+        
+        assert [record["t"] for record in records] == [0.5, 1.25, 2.0]
+    
+    def test_rejects_other_files(self, tmp_path):
+        path = tmp_path / "traces.jsonl"
+        path.write_text('{"resourceSpans": []}\n')
+        
+        with pytest.raises(ValueError):
+            read_capture([str(path)])
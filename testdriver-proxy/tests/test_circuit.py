@@ -0,0 +1,189 @@
+"""
+Tests for upstream circuit breaking
+"""
+
+import pytest
+import httpx
+from fastapi.testclient import TestClient
+from testdriver_proxy.circuit import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from testdriver_proxy.config import Config
+from testdriver_proxy.proxy import create_app
+
+
+@pytest.fixture
+def config():
+    """Test configuration with a small circuit breaker window"""
+    return Config(
+        zai_api_key="test-key",
+        http2=False,
+        log_requests=False,
+        max_retries=0,
+        circuit_breaker_enabled=True,
+        circuit_window=10,
+        circuit_min_calls=4,
+        circuit_failure_rate=50,
+        circuit_slow_call_seconds=5,
+        circuit_slow_call_rate=50,
+        circuit_open_time=15,
+        circuit_half_open_calls=2,
+    )
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controllable monotonic clock for breaker timing"""
+    now = [1000.0]
+    monkeypatch.setattr("testdriver_proxy.circuit.time.monotonic", lambda: now[0])
+    monkeypatch.setattr("testdriver_proxy.upstreams.time.monotonic", lambda: now[0])
+    return now
+
+
+def chat(client, stream=False):
+    return client.post("/v1/chat/completions", json={
+        "model": "glm-4.5",
+        "messages": [{"role": "user", "content": "Hello"}],
+        "stream": stream,
+        "temperature": 1.0,
+    })
+
+
+class TestCircuitBreaker:
+    """Test CircuitBreaker class"""
+    
+    def test_opens_on_failure_rate(self, config, clock):
+        breaker = CircuitBreaker(config, "z")
+        
+        for failed in (False, True, False):
+            breaker.record(failed)
+        assert breaker.state(clock[0]) == CLOSED
+        breaker.record(True)
+        
+        assert breaker.state(clock[0]) == OPEN
+        assert breaker.available(clock[0]) is False
+        assert breaker.retry_after(clock[0]) == 15
+    
+    def test_opens_on_slow_calls(self, config, clock):
+        breaker = CircuitBreaker(config, "z")
+        
+        for latency in (0.1, 6.0, 0.2, 7.5):
+            breaker.record(False, latency)
+        
+        assert breaker.state(clock[0]) == OPEN
+    
+    def test_waits_for_min_calls(self, config, clock):
+        breaker = CircuitBreaker(config, "z")
+        
+        for _ in range(3):
+            breaker.record(True)
+        
+        assert breaker.state(clock[0]) == CLOSED
+    
+    def test_half_open_probes_then_closes(self, config, clock):
+        breaker = CircuitBreaker(config, "z")
+        for _ in range(4):
+            breaker.record(True)
+        
+        clock[0] += 15
+        assert breaker.state(clock[0]) == HALF_OPEN
+        for _ in range(2):
+            assert breaker.available(clock[0]) is True
+            breaker.acquire(clock[0])
+        # Only as many probes as configured
+        assert breaker.available(clock[0]) is False
+        
+        breaker.record(False, 0.1)
+        assert breaker.state(clock[0]) == HALF_OPEN
+        breaker.record(False, 0.1)
+        assert breaker.state(clock[0]) == CLOSED
+        assert breaker.available(clock[0]) is True
+    
+    def test_failed_probe_reopens(self, config, clock):
+        breaker = CircuitBreaker(config, "z")
+        for _ in range(4):
+            breaker.record(True)
+        clock[0] += 15
+        breaker.acquire(clock[0])
+        
+        breaker.record(False, 9.0)
+        
+        assert breaker.state(clock[0]) == OPEN
+        assert breaker.opened == 2
+    
+    def test_lost_probes_are_replaced(self, config, clock):
+        breaker = CircuitBreaker(config, "z")
+        for _ in range(4):
+            breaker.record(True)
+        clock[0] += 15
+        breaker.acquire(clock[0])
+        breaker.acquire(clock[0])
+        assert breaker.available(clock[0]) is False
+        
+        clock[0] += 15
+        
+        assert breaker.available(clock[0]) is True
+    
+    def test_disabled(self, clock):
+        breaker = CircuitBreaker(Config(), "z")
+        for _ in range(50):
+            breaker.record(True)
+        
+        assert breaker.available(clock[0]) is True
+
+
+class TestProxyCircuitBreaker:
+    """Test fast failure of chat completions"""
+    
+    def test_open_circuit_fails_fast(self, config):
+        calls = []
+        
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(503, json={"type": "error"})
+        
+        with TestClient(create_app(config, httpx.MockTransport(handler))) as client:
+            assert client.get("/health").json()["status"] == "healthy"
+            for _ in range(4):
+                assert chat(client).status_code == 500
+            
+            response = chat(client)
+            assert response.status_code == 503
+            assert response.headers["retry-after"] == "15"
+            assert chat(client, stream=True).status_code == 503
+            assert len(calls) == 4
+            
+            health = client.get("/health")
+            assert health.status_code == 200
+            assert health.json() == {
+                "status": "unavailable",
+                "upstreams": {"upstream-0": {"circuit": "open", "retry_after": 15.0, "ejected": False}},
+            }
+            assert 'testdriver_proxy_upstream_circuit_state{upstream="upstream-0"} 2' in client.get("/metrics").text
+    
+    def test_open_target_is_skipped(self, config):
+        config.upstreams = [
+            {"name": "a", "base_url": "http://a.test/v1"},
+            {"name": "b", "base_url": "http://b.test/v1"},
+        ]
+        config.upstream_eject_failures = 0
+        
+        def handler(request):
+            if request.url.host == "a.test":
+                return httpx.Response(500, json={"type": "error"})
+            return httpx.Response(200, json={
+                "id": "msg_1",
+                "content": [{"type": "text", "text": "Hi"}],
+                "stop_reason": "end_turn",
+                "usage": {"input_tokens": 5, "output_tokens": 2},
+            })
+        
+        app = create_app(config, httpx.MockTransport(handler))
+        app.state.proxy.upstreams._random.seed(0)
+        with TestClient(app) as client:
+            statuses = [chat(client).status_code for _ in range(30)]
+            health = client.get("/health").json()
+        
+        assert statuses.count(500) == 4
+        assert statuses[-10:] == [200] * 10
+        assert health["status"] == "degraded"
+        assert health["upstreams"]["a"]["circuit"] == "open"
+        assert health["upstreams"]["b"]["circuit"] == "closed"
@@ -0,0 +1,216 @@
+"""
+Tests for single-flight request coalescing
+"""
+
+import asyncio
+import json
+import pytest
+import httpx
+from testdriver_proxy.coalesce import SingleFlight, StreamBroadcast
+from testdriver_proxy.config import Config
+from testdriver_proxy.models import ChatCompletionRequest, Message
+from testdriver_proxy.proxy import ZAIProxy
+
+
+@pytest.fixture
+def config():
+    """Test configuration"""
+    return Config(zai_api_key="test-key", http2=False, log_requests=False)
+
+
+async def chunks_from(items, gate=None):
+    for item in items:
+        if gate is not None:
+            await gate.wait()
+        yield item
+
+
+class TestSingleFlight:
+    """Test SingleFlight.do"""
+    
+    def test_key_eligibility(self, config):
+        flights = SingleFlight(config)
+        assert flights.key_for({"model": "m", "temperature": 0}) is not None
+        assert flights.key_for({"model": "m", "temperature": 0.7}) is None
+        assert SingleFlight(Config(coalesce_enabled=False)).key_for({"model": "m"}) is None
+    
+    @pytest.mark.asyncio
+    async def test_concurrent_calls_share_result(self, config):
+        flights = SingleFlight(config)
+        calls = []
+        release = asyncio.Event()
+        
+        async def fetch():
+            calls.append(1)
+            await release.wait()
+            return "result"
+        
+        waiters = [asyncio.create_task(flights.do("k", fetch)) for _ in range(5)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*waiters)
+        
+        assert results == ["result"] * 5
+        assert len(calls) == 1
+        assert flights.coalesced == 4
+        assert flights.stats()["in_flight"] == 0
+    
+    @pytest.mark.asyncio
+    async def test_errors_propagate_to_all_waiters(self, config):
+        flights = SingleFlight(config)
+        
+        async def fail():
+            await asyncio.sleep(0)
+            raise RuntimeError("upstream down")
+        
+        results = await asyncio.gather(
+            flights.do("k", fail), flights.do("k", fail), return_exceptions=True
+        )
+        assert all(isinstance(r, RuntimeError) for r in results)
+    
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_does_not_cancel_call(self, config):
+        flights = SingleFlight(config)
+        release = asyncio.Event()
+        
+        async def fetch():
+            await release.wait()
+            return "result"
+        
+        first = asyncio.create_task(flights.do("k", fetch))
+        second = asyncio.create_task(flights.do("k", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        release.set()
+        
+        assert await second == "result"
+
+
+class TestStreamBroadcast:
+    """Test StreamBroadcast fan-out"""
+    
+    @pytest.mark.asyncio
+    async def test_late_joiner_receives_prefix(self):
+        gate = asyncio.Event()
+        broadcast = StreamBroadcast(chunks_from(["a", "b", "c"], gate))
+        early = broadcast.subscribe()
+        
+        gate.set()
+        first = await early.__anext__()
+        late = broadcast.subscribe()
+        
+        assert first == "a"
+        assert [c async for c in early] == ["b", "c"]
+        assert [c async for c in late] == ["a", "b", "c"]
+    
+    @pytest.mark.asyncio
+    async def test_error_reaches_subscribers(self):
+        async def failing():
+            yield "a"
+            raise RuntimeError("broken")
+        
+        broadcast = StreamBroadcast(failing())
+        received = []
+        with pytest.raises(RuntimeError):
+            async for chunk in broadcast.subscribe():
+                received.append(chunk)
+        assert received == ["a"]
+    
+    @pytest.mark.asyncio
+    async def test_upstream_cancelled_without_subscribers(self):
+        async def endless():
+            yield "a"
+            await asyncio.Event().wait()
+        
+        broadcast = StreamBroadcast(endless())
+        subscriber = broadcast.subscribe()
+        await subscriber.__anext__()
+        await subscriber.aclose()
+        await asyncio.sleep(0)
+        
+        assert broadcast.task.cancelled()
+    
+    @pytest.mark.asyncio
+    async def test_upstream_cancelled_when_unstarted_subscriber_dropped(self):
+        async def endless():
+            yield "a"
+            await asyncio.Event().wait()
+        
+        broadcast = StreamBroadcast(endless())
+        started = broadcast.subscribe()
+        unstarted = broadcast.subscribe()
+        await started.__anext__()
+        await started.aclose()
+        await asyncio.sleep(0)
+        # The unstarted subscriber still holds the stream open
+        assert not broadcast.task.done()
+        
+        del unstarted
+        await asyncio.sleep(0)
+        
+        assert broadcast.subscribers == 0
+        assert broadcast.task.cancelled()
+
+
+class TestProxyCoalescing:
+    """Test coalescing through ZAIProxy"""
+    
+    @pytest.mark.asyncio
+    async def test_identical_requests_share_upstream_call(self, config):
+        calls = []
+        
+        async def handler(request):
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return httpx.Response(200, json={
+                "id": "msg_1",
+                "content": [{"type": "text", "text": "Shared"}],
+                "stop_reason": "end_turn",
+                "usage": {"input_tokens": 3, "output_tokens": 1},
+            })
+        
+        proxy = ZAIProxy(config, transport=httpx.MockTransport(handler))
+        request = ChatCompletionRequest(
+            model="glm-4.5",
+            messages=[Message(role="user", content="Hello")],
+            temperature=0,
+        )
+        
+        responses = await asyncio.gather(*(proxy.chat_completion(request) for _ in range(3)))
+        await proxy.aclose()
+        
+        assert len(calls) == 1
+        assert {r.choices[0].message.content for r in responses} == {"Shared"}
+        assert proxy.flights.coalesced == 2
+    
+    @pytest.mark.asyncio
+    async def test_identical_streams_share_upstream_call(self, config):
+        calls = []
+        events = [
+            {"type": "content_block_start"},
+            {"type": "content_block_delta", "delta": {"type": "text_delta", "text": "Hi"}},
+        ]
+        body = "".join(f"data: {json.dumps(e)}\n\n" for e in events) + "data: [DONE]\n\n"
+        
+        def handler(request):
+            calls.append(1)
+            return httpx.Response(200, text=body)
+        
+        proxy = ZAIProxy(config, transport=httpx.MockTransport(handler))
+        request = ChatCompletionRequest(
+            model="glm-4.5",
+            messages=[Message(role="user", content="Hello")],
+            temperature=0,
+            stream=True,
+        )
+        
+        first = await proxy.chat_completion(request)
+        second = await proxy.chat_completion(request)
+        first_chunks = [c async for c in first]
+        second_chunks = [c async for c in second]
+        await proxy.aclose()
+        
+        assert len(calls) == 1
+        assert first_chunks == second_chunks
+        assert first_chunks[-1] == "data: [DONE]\n\n"
+        assert proxy.flights.stream_coalesced == 1
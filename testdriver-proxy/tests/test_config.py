@@ -120,3 +120,248 @@ class TestConfig:
         config = Config(port=65535)
         config.validate()  # Should pass
 
+    
+    def test_pool_defaults(self):
+        """Test upstream pool defaults"""
+        config = Config()
+        
+        assert config.pool_max_connections == 100
+        assert config.pool_max_keepalive == 20
+        assert config.pool_keepalive_expiry == 30.0
+        assert config.http2 is True
+    
+    def test_pool_from_env(self, monkeypatch):
+        """Test loading pool settings from environment variables"""
+        monkeypatch.setenv("POOL_MAX_CONNECTIONS", "50")
+        monkeypatch.setenv("POOL_MAX_KEEPALIVE", "10")
+        monkeypatch.setenv("POOL_KEEPALIVE_EXPIRY", "5.5")
+        monkeypatch.setenv("HTTP2", "false")
+        
+        config = Config.from_env()
+        
+        assert config.pool_max_connections == 50
+        assert config.pool_max_keepalive == 10
+        assert config.pool_keepalive_expiry == 5.5
+        assert config.http2 is False
+    
+    def test_validate_invalid_pool(self):
+        """Test validation of pool settings"""
+        with pytest.raises(ValueError, match="pool_max_connections must be positive"):
+            Config(pool_max_connections=0).validate()
+        
+        with pytest.raises(ValueError, match="pool_max_keepalive"):
+            Config(pool_max_connections=10, pool_max_keepalive=20).validate()
+        
+        with pytest.raises(ValueError, match="pool_keepalive_expiry"):
+            Config(pool_keepalive_expiry=-1).validate()
+    
+    def test_worker_defaults(self):
+        """Test worker process defaults"""
+        config = Config()
+        
+        assert config.workers == 1
+        assert config.worker_max_requests == 0
+        assert config.event_loop == "auto"
+        assert config.http_parser == "auto"
+        assert config.state_dir is None
+    
+    def test_workers_from_env(self, monkeypatch):
+        """Test loading worker settings from environment variables"""
+        monkeypatch.setenv("WORKERS", "4")
+        monkeypatch.setenv("WORKER_MAX_REQUESTS", "10000")
+        monkeypatch.setenv("EVENT_LOOP", "uvloop")
+        monkeypatch.setenv("HTTP_PARSER", "httptools")
+        monkeypatch.setenv("STATE_DIR", "/var/lib/testdriver-proxy")
+        
+        config = Config.from_env()
+        
+        assert config.workers == 4
+        assert config.worker_max_requests == 10000
+        assert config.event_loop == "uvloop"
+        assert config.http_parser == "httptools"
+        assert config.state_dir == "/var/lib/testdriver-proxy"
+    
+    def test_validate_invalid_workers(self):
+        """Test validation of worker settings"""
+        with pytest.raises(ValueError, match="workers must be positive"):
+            Config(workers=0).validate()
+        
+        with pytest.raises(ValueError, match="worker_max_requests"):
+            Config(worker_max_requests=-1).validate()
+        
+        with pytest.raises(ValueError, match="event_loop"):
+            Config(event_loop="trio").validate()
+        
+        with pytest.raises(ValueError, match="http_parser"):
+            Config(http_parser="h2").validate()
+    
+    def test_upstream_limit_from_env(self, monkeypatch):
+        """Test loading upstream limiter settings from environment variables"""
+        monkeypatch.setenv("UPSTREAM_LIMIT_MODE", "adaptive")
+        monkeypatch.setenv("UPSTREAM_LIMIT", "16")
+        monkeypatch.setenv("UPSTREAM_QUEUE_SIZE", "64")
+        monkeypatch.setenv("UPSTREAM_QUEUE_TIMEOUT", "2.5")
+        monkeypatch.setenv("UPSTREAM_REJECT_STATUS", "429")
+        
+        config = Config.from_env()
+        
+        assert config.upstream_limit_mode == "adaptive"
+        assert config.upstream_limit == 16
+        assert config.upstream_queue_size == 64
+        assert config.upstream_queue_timeout == 2.5
+        assert config.upstream_reject_status == 429
+        config.validate()
+    
+    def test_validate_invalid_upstream_limit(self):
+        """Test validation of upstream limiter settings"""
+        with pytest.raises(ValueError, match="upstream_limit_mode"):
+            Config(upstream_limit_mode="fast").validate()
+        
+        with pytest.raises(ValueError, match="upstream_limit must be between"):
+            Config(upstream_limit=500).validate()
+        
+        with pytest.raises(ValueError, match="upstream_queue_timeout"):
+            Config(upstream_queue_timeout=0).validate()
+        
+        with pytest.raises(ValueError, match="upstream_reject_status"):
+            Config(upstream_reject_status=500).validate()
+        
+        with pytest.raises(ValueError, match="upstream_latency_tolerance"):
+            Config(upstream_latency_tolerance=1).validate()
+    
+    def test_quotas_from_env(self, monkeypatch):
+        """Test loading quota settings from environment variables"""
+        monkeypatch.setenv("QUOTA_REQUESTS_PER_MINUTE", "120")
+        monkeypatch.setenv("QUOTA_TOKENS_PER_MINUTE", "200000")
+        
+        config = Config.from_env()
+        
+        assert config.quota_requests_per_minute == 120
+        assert config.quota_tokens_per_minute == 200000
+        
+        with pytest.raises(ValueError, match="quota_tokens_per_minute"):
+            Config(quota_tokens_per_minute=-1).validate()
+    
+    def test_traffic_capture_from_env(self, monkeypatch):
+        """Test loading traffic capture settings from environment variables"""
+        monkeypatch.setenv("TRAFFIC_CAPTURE_PATH", "/tmp/capture.jsonl")
+        monkeypatch.setenv("TRAFFIC_CAPTURE_MAX_BYTES", "1048576")
+        
+        config = Config.from_env()
+        
+        assert config.traffic_capture_path == "/tmp/capture.jsonl"
+        assert config.traffic_capture_max_bytes == 1048576
+        
+        with pytest.raises(ValueError, match="traffic_capture_max_bytes"):
+            Config(traffic_capture_max_bytes=0).validate()
+    
+    def test_max_choices_from_env(self, monkeypatch):
+        """Test loading the cap on n from environment variables"""
+        monkeypatch.setenv("MAX_CHOICES", "4")
+        
+        assert Config.from_env().max_choices == 4
+        
+        with pytest.raises(ValueError, match="max_choices"):
+            Config(max_choices=0).validate()
+    
+    def test_batches_from_env(self, monkeypatch):
+        """Test loading batch settings from environment variables"""
+        monkeypatch.setenv("BATCH_ENABLED", "true")
+        monkeypatch.setenv("BATCH_DIR", "/var/lib/proxy/batches")
+        monkeypatch.setenv("BATCH_CONCURRENCY", "16")
+        monkeypatch.setenv("BATCH_MAX_REQUESTS", "1000")
+        
+        config = Config.from_env()
+        
+        assert config.batch_enabled is True
+        assert config.batch_dir == "/var/lib/proxy/batches"
+        assert config.batch_concurrency == 16
+        assert config.batch_max_requests == 1000
+        
+        with pytest.raises(ValueError, match="batch_dir or state_dir"):
+            Config(batch_enabled=True).validate()
+        with pytest.raises(ValueError, match="batch_concurrency"):
+            Config(batch_concurrency=0).validate()
+    
+    def test_hedging_from_env(self, monkeypatch):
+        """Test loading request hedging settings from environment variables"""
+        monkeypatch.setenv("HEDGE_ENABLED", "true")
+        monkeypatch.setenv("HEDGE_PERCENTILE", "99")
+        monkeypatch.setenv("HEDGE_MIN_DELAY", "2.5")
+        monkeypatch.setenv("HEDGE_BUDGET_PERCENT", "2")
+        
+        config = Config.from_env()
+        
+        assert config.hedge_enabled is True
+        assert config.hedge_percentile == 99
+        assert config.hedge_min_delay == 2.5
+        assert config.hedge_budget_percent == 2
+        
+        with pytest.raises(ValueError, match="hedge_percentile"):
+            Config(hedge_percentile=100).validate()
+    
+    def test_upstreams_from_env(self, monkeypatch):
+        """Test loading upstream targets from environment variables"""
+        monkeypatch.setenv("UPSTREAMS", '[{"base_url": "http://a/v1", "api_key": "k", "weight": 2}]')
+        monkeypatch.setenv("UPSTREAM_EJECT_FAILURES", "10")
+        
+        config = Config.from_env()
+        
+        assert config.upstreams == [{"base_url": "http://a/v1", "api_key": "k", "weight": 2}]
+        assert config.upstream_eject_failures == 10
+        config.validate()
+        
+        with pytest.raises(ValueError, match="base_url"):
+            Config(upstreams=[{"api_key": "k"}]).validate()
+        with pytest.raises(ValueError, match="Unknown upstream settings: apikey"):
+            Config(upstreams=[{"base_url": "http://a/v1", "apikey": "k"}]).validate()
+        with pytest.raises(ValueError, match="weight"):
+            Config(upstreams=[{"base_url": "http://a/v1", "weight": 0}]).validate()
+    
+    def test_circuit_breaker_from_env(self, monkeypatch):
+        """Test loading circuit breaker settings from environment variables"""
+        monkeypatch.setenv("CIRCUIT_BREAKER_ENABLED", "true")
+        monkeypatch.setenv("CIRCUIT_FAILURE_RATE", "25")
+        monkeypatch.setenv("CIRCUIT_OPEN_TIME", "5")
+        monkeypatch.setenv("CIRCUIT_HALF_OPEN_CALLS", "1")
+        
+        config = Config.from_env()
+        
+        assert config.circuit_breaker_enabled is True
+        assert config.circuit_failure_rate == 25
+        assert config.circuit_open_time == 5
+        assert config.circuit_half_open_calls == 1
+        
+        with pytest.raises(ValueError, match="circuit_min_calls"):
+            Config(circuit_window=5, circuit_min_calls=10).validate()
+    
+    def test_model_routing_from_env(self, monkeypatch):
+        """Test loading model routing settings from environment variables"""
+        monkeypatch.setenv("MODEL_ROUTING_ENABLED", "true")
+        monkeypatch.setenv("MODEL_ALIASES", '{"gpt-4o": "glm-4.5v"}')
+        monkeypatch.setenv("ROUTE_FAST_MODEL", "glm-4.5-air")
+        monkeypatch.setenv("ROUTE_FAST_MAX_CHARS", "500")
+        
+        config = Config.from_env()
+        
+        assert config.model_routing_enabled is True
+        assert config.model_aliases == {"gpt-4o": "glm-4.5v"}
+        assert config.route_fast_model == "glm-4.5-air"
+        assert config.route_fast_max_chars == 500
+        assert config.route_long_prompt_model is None
+        
+        with pytest.raises(ValueError, match="model_aliases"):
+            Config(model_aliases={"gpt-4o": 4}).validate()
+    
+    def test_prompt_cache_from_env(self, monkeypatch):
+        """Test loading prompt caching settings from environment variables"""
+        monkeypatch.setenv("PROMPT_CACHE_STRATEGY", "History")
+        monkeypatch.setenv("PROMPT_CACHE_MIN_TOKENS", "2048")
+        
+        config = Config.from_env()
+        
+        assert config.prompt_cache_strategy == "history"
+        assert config.prompt_cache_min_tokens == 2048
+        
+        with pytest.raises(ValueError, match="prompt_cache_strategy"):
+            Config(prompt_cache_strategy="auto").validate()
@@ -0,0 +1,98 @@
+"""
+Tests for raw-body request parsing
+"""
+
+import json
+import pytest
+import httpx
+from fastapi.exceptions import RequestValidationError
+from fastapi.testclient import TestClient
+from testdriver_proxy.config import Config
+from testdriver_proxy.fastpath import parse_chat_request
+from testdriver_proxy.models import ChatCompletionRequest
+from testdriver_proxy.proxy import create_app
+
+IMAGE_URL = "data:image/png;base64," + "iVBORw0KGgo" * 1000
+
+
+@pytest.fixture
+def body():
+    return {
+        "model": "glm-4.5v",
+        "temperature": 0,
+        "stop": "END",
+        "messages": [
+            {"role": "system", "content": "You are a test agent"},
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": "What is on screen?"},
+                    {"type": "image_url", "image_url": {"url": IMAGE_URL}},
+                ],
+            },
+        ],
+    }
+
+
+class TestParseChatRequest:
+    """Test parse_chat_request"""
+    
+    def test_matches_validated_model(self, body):
+        parsed = parse_chat_request(json.dumps(body).encode())
+        validated = ChatCompletionRequest.model_validate(body)
+        assert parsed.model_dump() == validated.model_dump()
+    
+    def test_content_parts_are_plain_dicts(self, body):
+        parsed = parse_chat_request(json.dumps(body).encode())
+        parts = parsed.messages[1].content
+        assert parts[1] == {"type": "image_url", "image_url": {"url": IMAGE_URL}}
+    
+    def test_invalid_json(self):
+        with pytest.raises(RequestValidationError) as exc:
+            parse_chat_request(b"{not json")
+        assert exc.value.errors()[0]["type"] == "json_invalid"
+    
+    def test_invalid_top_level_field(self, body):
+        body["temperature"] = "hot"
+        with pytest.raises(RequestValidationError) as exc:
+            parse_chat_request(json.dumps(body).encode())
+        assert exc.value.errors()[0]["loc"] == ("body", "temperature")
+    
+    def test_invalid_messages(self, body):
+        body["messages"].append({"role": "tool", "content": 5})
+        with pytest.raises(RequestValidationError) as exc:
+            parse_chat_request(json.dumps(body).encode())
+        locs = {error["loc"][:4] for error in exc.value.errors()}
+        assert locs == {("body", "messages", 2, "role"), ("body", "messages", 2, "content")}
+    
+    def test_missing_messages(self):
+        with pytest.raises(RequestValidationError):
+            parse_chat_request(b'{"model": "glm-4.5"}')
+
+
+class TestFastPathEndpoint:
+    """Test the chat completions endpoint with single_pass_parsing enabled"""
+    
+    def test_forwards_request(self, body):
+        seen = []
+        
+        def handler(request):
+            seen.append(json.loads(request.content))
+            return httpx.Response(200, json={
+                "id": "msg_1",
+                "content": [{"type": "text", "text": "A login form"}],
+                "stop_reason": "end_turn",
+                "usage": {"input_tokens": 10, "output_tokens": 3},
+            })
+        
+        config = Config(zai_api_key="test-key", http2=False, log_requests=False, single_pass_parsing=True)
+        with TestClient(create_app(config, httpx.MockTransport(handler))) as client:
+            response = client.post("/v1/chat/completions", json=body)
+            invalid = client.post("/v1/chat/completions", json={"model": "glm-4.5", "messages": [{}]})
+        
+        assert response.status_code == 200
+        assert response.json()["choices"][0]["message"]["content"] == "A login form"
+        assert seen[0]["system"] == "You are a test agent"
+        assert seen[0]["messages"][0]["content"][1]["source"]["type"] == "base64"
+        assert seen[0]["stop_sequences"] == ["END"]
+        assert invalid.status_code == 422
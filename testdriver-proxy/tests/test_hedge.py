@@ -0,0 +1,159 @@
+"""
+Tests for hedged upstream requests
+"""
+
+import asyncio
+from dataclasses import replace
+import pytest
+import httpx
+from fastapi.testclient import TestClient
+from testdriver_proxy.config import Config
+from testdriver_proxy.hedge import HedgePolicy
+from testdriver_proxy.metrics import Metrics
+from testdriver_proxy.proxy import create_app
+
+
+@pytest.fixture
+def config():
+    """Test configuration hedging after 10 ms at the 50th percentile"""
+    return Config(
+        zai_api_key="test-key",
+        http2=False,
+        log_requests=False,
+        hedge_enabled=True,
+        hedge_percentile=50,
+        hedge_min_delay=0.01,
+        hedge_budget_percent=100,
+    )
+
+
+def warmed(config, metrics=None, latency=0.001):
+    """A policy that has seen enough fast requests to start hedging"""
+    policy = HedgePolicy(config, metrics)
+    for _ in range(policy.MIN_SAMPLES):
+        policy.observe("glm-4.5", latency)
+    return policy
+
+
+def scripted(*steps):
+    """A send function whose n-th call sleeps and returns (or raises) step n"""
+    calls = []
+    
+    async def send():
+        delay, result = steps[len(calls)]
+        calls.append(result)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            calls.append("cancelled")
+            raise
+        if isinstance(result, Exception):
+            raise result
+        return result
+    
+    return send, calls
+
+
+class TestHedgePolicy:
+    """Test HedgePolicy class"""
+    
+    def test_delay_follows_percentile(self, config):
+        policy = HedgePolicy(config)
+        assert policy.delay("glm-4.5") is None
+        
+        for latency in range(1, 101):
+            policy.observe("glm-4.5", latency / 100)
+        
+        assert policy.delay("glm-4.5") == pytest.approx(0.51)
+        assert policy.delay("glm-4.5v") is None
+        assert HedgePolicy(Config()).delay("glm-4.5") is None
+    
+    @pytest.mark.asyncio
+    async def test_fast_request_is_not_hedged(self, config):
+        policy = warmed(config)
+        send, calls = scripted((0, "first"))
+        
+        assert await policy.call("glm-4.5", send) == "first"
+        assert calls == ["first"]
+        assert policy.hedged == 0
+    
+    @pytest.mark.asyncio
+    async def test_hedge_wins_and_original_is_cancelled(self, config):
+        metrics = Metrics(config)
+        policy = warmed(config, metrics)
+        send, calls = scripted((10, "slow"), (0, "hedge"))
+        
+        assert await policy.call("glm-4.5", send) == "hedge"
+        await asyncio.sleep(0)
+        
+        assert calls == ["slow", "hedge", "cancelled"]
+        assert policy.hedged == policy.won == 1
+        assert metrics.hedges.series == {("hedge",): 1.0}
+    
+    @pytest.mark.asyncio
+    async def test_failed_hedge_waits_for_original(self, config):
+        policy = warmed(config)
+        send, calls = scripted((0.05, "slow"), (0, RuntimeError("boom")))
+        
+        assert await policy.call("glm-4.5", send) == "slow"
+        assert policy.hedged == 1 and policy.won == 0
+    
+    @pytest.mark.asyncio
+    async def test_both_failing_raises_original_error(self, config):
+        policy = warmed(config)
+        send, _ = scripted((0.05, ValueError("original")), (0, RuntimeError("hedge")))
+        
+        with pytest.raises(ValueError, match="original"):
+            await policy.call("glm-4.5", send)
+    
+    @pytest.mark.asyncio
+    async def test_budget_and_saturation_hold_back_hedges(self, config):
+        async def slow():
+            await asyncio.sleep(0.02)
+            return "slow"
+        
+        policy = warmed(replace(config, hedge_budget_percent=0))
+        for _ in range(HedgePolicy.RESERVE + 1):
+            await policy.call("glm-4.5", slow)
+        
+        assert policy.hedged == HedgePolicy.RESERVE
+        assert policy.budget_exhausted == 1
+        
+        policy = warmed(config)
+        await policy.call("glm-4.5", slow, may_hedge=lambda: False)
+        assert policy.hedged == 0
+
+
+class TestProxyHedging:
+    """Test hedging of non-streaming chat completions"""
+    
+    def test_slow_upstream_call_is_hedged(self, config):
+        calls = []
+        
+        async def handler(request):
+            calls.append(request)
+            if len(calls) == 1:
+                await asyncio.sleep(10)
+            return httpx.Response(200, json={
+                "id": "msg_1",
+                "content": [{"type": "text", "text": f"answer {len(calls)}"}],
+                "stop_reason": "end_turn",
+                "usage": {"input_tokens": 5, "output_tokens": 2},
+            })
+        
+        app = create_app(config, httpx.MockTransport(handler))
+        with TestClient(app) as client:
+            hedging = app.state.proxy.hedging
+            for _ in range(hedging.MIN_SAMPLES):
+                hedging.observe("glm-4.5", 0.001)
+            
+            response = client.post("/v1/chat/completions", json={
+                "model": "glm-4.5",
+                "messages": [{"role": "user", "content": "Hello"}],
+            })
+            
+            assert response.status_code == 200
+            assert response.json()["choices"][0]["message"]["content"] == "answer 2"
+            assert len(calls) == 2
+            assert client.get("/stats").json()["hedging"]["won"] == 1
+            assert 'testdriver_proxy_upstream_hedges_total{winner="hedge"} 1' in client.get("/metrics").text
@@ -0,0 +1,199 @@
+"""
+Tests for image handling
+"""
+
+import base64
+import io
+import os
+import pytest
+from testdriver_proxy.config import Config
+from testdriver_proxy.images import ImageEntry, ImagePipeline, ImageStore, image_digest, image_payload, parse_data_url
+from testdriver_proxy.models import ChatCompletionRequest, Message
+from testdriver_proxy.proxy import ZAIProxy
+
+PNG_DATA = base64.b64encode(b"\x89PNG\r\n\x1a\n" + b"\x00" * 64).decode()
+
+
+def image_url_part(data=PNG_DATA, media_type="image/png"):
+    return {"type": "image_url", "image_url": {"url": f"data:{media_type};base64,{data}"}}
+
+
+@pytest.fixture
+def config():
+    """Test configuration"""
+    return Config(zai_api_key="test-key", log_requests=False)
+
+
+class TestDataUrls:
+    """Test data URL parsing"""
+    
+    def test_parse_data_url(self):
+        assert parse_data_url("data:image/jpeg;base64,abcd") == ("image/jpeg", "abcd")
+    
+    def test_parse_non_data_url(self):
+        assert parse_data_url("https://example.com/img.png") is None
+        assert parse_data_url("data:text/plain,hello") is None
+    
+    def test_image_payload_shapes(self):
+        assert image_payload(image_url_part()) == ("image/png", PNG_DATA)
+        anthropic_part = {
+            "type": "image",
+            "source": {"type": "base64", "media_type": "image/gif", "data": "abcd"},
+        }
+        assert image_payload(anthropic_part) == ("image/gif", "abcd")
+        assert image_payload({"type": "text", "text": "hi"}) is None
+
+
+class TestImageStore:
+    """Test ImageStore class"""
+    
+    def test_repeated_payload_is_deduplicated(self, config):
+        store = ImageStore(config)
+        digest = image_digest(PNG_DATA)
+        assert store.get(digest) is None
+        entry = ImageEntry(digest, "image/png", PNG_DATA)
+        store.put(entry)
+        
+        # A distinct but equal string, as produced by parsing a new request
+        assert store.get(image_digest("".join(list(PNG_DATA))), len(PNG_DATA)) is entry
+        assert store.hits == 1
+        assert store.misses == 1
+        assert store.stats()["bytes_deduplicated"] == len(PNG_DATA)
+    
+    def test_memory_budget(self):
+        store = ImageStore(Config(image_store_max_bytes=300))
+        for i in range(5):
+            data = base64.b64encode(bytes([i]) * 60).decode()
+            store.put(ImageEntry(image_digest(data), "image/png", data))
+        
+        assert store.size <= 300
+        assert store.evictions > 0
+
+
+def make_png(width, height):
+    """Render a small synthetic screenshot"""
+    Image = pytest.importorskip("PIL.Image")
+    image = Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+class TestImagePipeline:
+    """Test ImagePipeline class"""
+    
+    @pytest.mark.asyncio
+    async def test_converts_data_url_to_image_block(self, config):
+        pipeline = ImagePipeline(config, ImageStore(config))
+        block = await pipeline.process_part(image_url_part())
+        pipeline.close()
+        
+        assert block == {
+            "type": "image",
+            "source": {"type": "base64", "media_type": "image/png", "data": PNG_DATA},
+        }
+    
+    @pytest.mark.asyncio
+    async def test_converts_remote_url_to_url_source(self, config):
+        pipeline = ImagePipeline(config, ImageStore(config))
+        part = {"type": "image_url", "image_url": {"url": "https://example.com/img.jpg"}}
+        block = await pipeline.process_part(part)
+        pipeline.close()
+        
+        assert block == {"type": "image", "source": {"type": "url", "url": "https://example.com/img.jpg"}}
+    
+    @pytest.mark.asyncio
+    async def test_text_parts_pass_through(self, config):
+        pipeline = ImagePipeline(config, ImageStore(config))
+        part = {"type": "text", "text": "hi"}
+        assert await pipeline.process_part(part) is part
+        pipeline.close()
+    
+    @pytest.mark.asyncio
+    async def test_downscales_and_reencodes(self):
+        Image = pytest.importorskip("PIL.Image")
+        config = Config(image_max_edge=200, image_format="jpeg", image_quality=70)
+        pipeline = ImagePipeline(config, ImageStore(config))
+        data = make_png(800, 400)
+        
+        block = await pipeline.process_part(image_url_part(data))
+        pipeline.close()
+        
+        assert block["source"]["media_type"] == "image/jpeg"
+        decoded = base64.b64decode(block["source"]["data"])
+        with Image.open(io.BytesIO(decoded)) as image:
+            assert image.size == (200, 100)
+        assert pipeline.stats()["bytes_saved"] > 0
+    
+    @pytest.mark.asyncio
+    async def test_repeated_image_processed_once(self):
+        pytest.importorskip("PIL.Image")
+        config = Config(image_max_edge=100, image_format="webp")
+        pipeline = ImagePipeline(config, ImageStore(config))
+        data = make_png(300, 300)
+        
+        first = await pipeline.process_part(image_url_part(data))
+        second = await pipeline.process_part(image_url_part(data))
+        pipeline.close()
+        
+        assert first == second
+        assert pipeline.processed == 1
+        assert pipeline.store.hits == 1
+        # Only the shrunk form is kept
+        assert pipeline.store.size == len(image_digest(data)) + len(first["source"]["data"])
+    
+    @pytest.mark.asyncio
+    async def test_undecodable_image_sent_as_is(self):
+        pytest.importorskip("PIL.Image")
+        config = Config(image_max_edge=100)
+        pipeline = ImagePipeline(config, ImageStore(config))
+        block = await pipeline.process_part(image_url_part())
+        invalid = await pipeline.process_part(image_url_part("not base64!"))
+        again = await pipeline.process_part(image_url_part("not base64!"))
+        pipeline.close()
+        
+        assert block["source"]["data"] == PNG_DATA
+        assert invalid["source"]["data"] == again["source"]["data"] == "not base64!"
+        # Failures are stored too, so they are not retried every turn
+        assert pipeline.failed == 2
+        assert pipeline.store.hits == 1
+    
+    @pytest.mark.asyncio
+    async def test_no_preprocessing_reuses_converted_payload(self, config):
+        pipeline = ImagePipeline(config, ImageStore(config))
+        part = image_url_part()
+        
+        first = await pipeline.process_part(part)
+        # A distinct but equal URL, as produced by parsing a new request
+        second = await pipeline.process_part(image_url_part("".join(list(PNG_DATA))))
+        pipeline.close()
+        
+        assert second["source"]["data"] is first["source"]["data"]
+        assert len(pipeline.store) == 1
+        assert pipeline.store.hits == 1
+        assert pipeline.store.stats()["bytes_deduplicated"] == len(part["image_url"]["url"])
+        assert pipeline.processed == 0
+
+
+class TestTransformImages:
+    """Test image parts through transform_request"""
+    
+    @pytest.mark.asyncio
+    async def test_image_parts_are_shared_across_turns(self, config):
+        proxy = ZAIProxy(config)
+        request = ChatCompletionRequest(
+            model="glm-4.5v",
+            messages=[Message(role="user", content=[{"type": "text", "text": "Hi"}, image_url_part()])],
+        )
+        
+        first = await proxy.transform_request(request)
+        second = await proxy.transform_request(request)
+        await proxy.aclose()
+        
+        text, image = first["messages"][0]["content"]
+        assert text is request.messages[0].content[0]
+        assert image["type"] == "image"
+        assert second["messages"][0]["content"][1] == image
+        # Nothing to preprocess: the payload is sliced out of the URL once
+        assert second["messages"][0]["content"][1]["source"]["data"] is image["source"]["data"]
+        assert proxy.images.hits == 1
@@ -0,0 +1,242 @@
+"""
+Tests for the upstream concurrency limiter
+"""
+
+import asyncio
+import pytest
+import httpx
+from fastapi.testclient import TestClient
+from testdriver_proxy.config import Config
+from testdriver_proxy.limiter import ConcurrencyLimiter, LimitExceeded
+from testdriver_proxy.models import ChatCompletionRequest, Message
+from testdriver_proxy.proxy import ZAIProxy, create_app
+
+
+@pytest.fixture
+def config():
+    """Test configuration with a small static limit"""
+    return Config(
+        zai_api_key="test-key",
+        http2=False,
+        log_requests=False,
+        upstream_limit_mode="static",
+        upstream_limit=2,
+        upstream_limit_min=1,
+        upstream_queue_size=2,
+        upstream_queue_timeout=5.0,
+    )
+
+
+async def hold(limiter, started, release, order, name):
+    async with limiter.acquire():
+        order.append(name)
+        started.set()
+        await release.wait()
+
+
+class TestConcurrencyLimiter:
+    """Test ConcurrencyLimiter queueing"""
+    
+    @pytest.mark.asyncio
+    async def test_disabled_by_default(self):
+        limiter = ConcurrencyLimiter(Config())
+        async with limiter.acquire(), limiter.acquire(), limiter.acquire():
+            assert limiter.in_flight == 0
+        limiter.check()
+    
+    @pytest.mark.asyncio
+    async def test_excess_requests_queue_in_order(self, config):
+        limiter = ConcurrencyLimiter(config)
+        release = asyncio.Event()
+        order = []
+        tasks = [
+            asyncio.create_task(hold(limiter, asyncio.Event(), release, order, name))
+            for name in "abcd"
+        ]
+        await asyncio.sleep(0)
+        
+        assert limiter.in_flight == 2
+        assert limiter.queue_depth == 2
+        assert order == ["a", "b"]
+        
+        release.set()
+        await asyncio.gather(*tasks)
+        assert order == ["a", "b", "c", "d"]
+        assert limiter.in_flight == 0
+        assert limiter.stats()["queued_total"] == 2
+    
+    @pytest.mark.asyncio
+    async def test_full_queue_rejects_immediately(self, config):
+        limiter = ConcurrencyLimiter(config)
+        release = asyncio.Event()
+        tasks = [
+            asyncio.create_task(hold(limiter, asyncio.Event(), release, [], i)) for i in range(4)
+        ]
+        await asyncio.sleep(0)
+        
+        with pytest.raises(LimitExceeded) as exc:
+            async with limiter.acquire():
+                pass
+        assert exc.value.status_code == 503
+        assert limiter.rejected == 1
+        
+        release.set()
+        await asyncio.gather(*tasks)
+    
+    @pytest.mark.asyncio
+    async def test_queue_timeout(self, config):
+        config.upstream_limit = 1
+        config.upstream_queue_timeout = 0.01
+        config.upstream_reject_status = 429
+        limiter = ConcurrencyLimiter(config)
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold(limiter, asyncio.Event(), release, [], "a"))
+        await asyncio.sleep(0)
+        
+        with pytest.raises(LimitExceeded) as exc:
+            async with limiter.acquire():
+                pass
+        assert exc.value.status_code == 429
+        assert limiter.timeouts == 1
+        assert limiter.queue_depth == 0
+        
+        release.set()
+        await holder
+    
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_does_not_leak_slot(self, config):
+        config.upstream_limit = 1
+        limiter = ConcurrencyLimiter(config)
+        release = asyncio.Event()
+        order = []
+        holder = asyncio.create_task(hold(limiter, asyncio.Event(), release, order, "a"))
+        cancelled = asyncio.create_task(hold(limiter, asyncio.Event(), release, order, "b"))
+        waiting = asyncio.create_task(hold(limiter, asyncio.Event(), release, order, "c"))
+        await asyncio.sleep(0)
+        
+        cancelled.cancel()
+        release.set()
+        await asyncio.gather(holder, waiting, cancelled, return_exceptions=True)
+        
+        assert order == ["a", "c"]
+        assert limiter.in_flight == 0
+
+
+class TestAdaptiveLimit:
+    """Test AIMD limit adjustments"""
+    
+    @pytest.fixture
+    def limiter(self, config):
+        config.upstream_limit_mode = "adaptive"
+        config.upstream_limit = 10
+        config.upstream_limit_max = 20
+        return ConcurrencyLimiter(config)
+    
+    @pytest.mark.asyncio
+    async def test_overload_decreases_limit(self, limiter):
+        async with limiter.acquire() as slot:
+            slot.record(429)
+        assert limiter.current_limit == 9
+        assert limiter.decreases == 1
+    
+    @pytest.mark.asyncio
+    async def test_timeout_decreases_limit(self, limiter):
+        with pytest.raises(httpx.ReadTimeout):
+            async with limiter.acquire():
+                raise httpx.ReadTimeout("slow")
+        assert limiter.current_limit == 9
+    
+    @pytest.mark.asyncio
+    async def test_decreases_are_spaced_by_latency(self, limiter):
+        limiter.short_latency = 60.0
+        for _ in range(5):
+            async with limiter.acquire() as slot:
+                slot.record(529)
+        assert limiter.decreases == 1
+    
+    @pytest.mark.asyncio
+    async def test_grows_only_when_saturated(self, limiter):
+        async with limiter.acquire() as slot:
+            slot.record(200)
+        assert limiter.increases == 0
+        
+        release = asyncio.Event()
+        holders = [
+            asyncio.create_task(hold(limiter, asyncio.Event(), release, [], i)) for i in range(5)
+        ]
+        await asyncio.sleep(0)
+        async with limiter.acquire() as slot:
+            slot.record(200)
+        release.set()
+        await asyncio.gather(*holders)
+        
+        assert limiter.increases >= 1
+        assert limiter.limit > 10
+    
+    def test_latency_rise_decreases_limit(self, limiter):
+        limiter.short_latency = limiter.long_latency = 1.0
+        limiter._samples = limiter.WARMUP_SAMPLES
+        slot = type("FakeSlot", (), {"status_code": 200, "latency": 30.0})()
+        
+        limiter._update(slot, failed=False)
+        
+        assert limiter.decreases == 1
+        assert limiter.current_limit == 9
+
+
+class TestProxyLimiting:
+    """Test limiter integration in ZAIProxy"""
+    
+    @pytest.mark.asyncio
+    async def test_upstream_calls_are_capped(self, config):
+        config.upstream_limit = 1
+        active = []
+        peak = []
+        
+        async def handler(request):
+            active.append(1)
+            peak.append(len(active))
+            await asyncio.sleep(0.01)
+            active.pop()
+            return httpx.Response(200, json={
+                "id": "msg_1",
+                "content": [{"type": "text", "text": "ok"}],
+                "stop_reason": "end_turn",
+            })
+        
+        proxy = ZAIProxy(config, transport=httpx.MockTransport(handler))
+        requests = [
+            ChatCompletionRequest(
+                model="glm-4.5",
+                temperature=0.7,
+                messages=[Message(role="user", content=f"Hi {i}")],
+            )
+            for i in range(3)
+        ]
+        results = await asyncio.gather(*(proxy.chat_completion(r) for r in requests))
+        await proxy.aclose()
+        
+        assert [r.choices[0].message.content for r in results] == ["ok"] * 3
+        assert max(peak) == 1
+    
+    def test_full_queue_returns_retry_after(self, config):
+        config.upstream_limit = 1
+        config.upstream_queue_size = 0
+        app = create_app(config)
+        app.state.proxy.limiter.in_flight = 1  # Saturated
+        
+        with TestClient(app) as client:
+            response = client.post(
+                "/v1/chat/completions",
+                json={"model": "glm-4.5", "stream": True, "messages": [{"role": "user", "content": "Hi"}]},
+            )
+            stats = client.get("/stats").json()["limiter"]
+            metrics = client.get("/metrics").text
+        
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "1"
+        assert response.json()["error"]["type"] == "overloaded_error"
+        assert stats["rejected"] == 1
+        assert stats["limit"] == 1
+        assert "testdriver_proxy_upstream_concurrency_limit 1\n" in metrics
+        assert "testdriver_proxy_upstream_queue_depth 0\n" in metrics
@@ -0,0 +1,44 @@
+"""
+Tests for the entry point and worker supervisor
+"""
+
+import socket
+import pytest
+from testdriver_proxy.config import Config
+from testdriver_proxy.main import WorkerSupervisor, bind_socket
+
+
+class TestBindSocket:
+    """Test bind_socket"""
+    
+    @pytest.mark.skipif(not hasattr(socket, "SO_REUSEPORT"), reason="SO_REUSEPORT not supported")
+    def test_reuse_port_allows_several_listeners(self):
+        first = bind_socket("127.0.0.1", 0, reuse_port=True)
+        port = first.getsockname()[1]
+        second = bind_socket("127.0.0.1", port, reuse_port=True)
+        try:
+            assert second.getsockname()[1] == port
+        finally:
+            first.close()
+            second.close()
+    
+    def test_without_reuse_port_address_is_exclusive(self):
+        first = bind_socket("127.0.0.1", 0)
+        try:
+            with pytest.raises(OSError):
+                bind_socket("127.0.0.1", first.getsockname()[1])
+        finally:
+            first.close()
+
+
+class TestWorkerSupervisor:
+    """Test WorkerSupervisor"""
+    
+    def test_max_requests_jitter(self):
+        supervisor = WorkerSupervisor(Config(workers=2, worker_max_requests=1000))
+        limits = {supervisor._max_requests() for _ in range(50)}
+        assert all(1000 <= limit <= 1100 for limit in limits)
+        assert len(limits) > 1
+    
+    def test_unlimited_requests(self):
+        assert WorkerSupervisor(Config(workers=2))._max_requests() is None
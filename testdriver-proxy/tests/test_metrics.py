@@ -0,0 +1,188 @@
+"""
+Tests for Prometheus metrics
+"""
+
+import json
+import os
+import pytest
+import httpx
+from fastapi.testclient import TestClient
+from testdriver_proxy.cache import Completion
+from testdriver_proxy.config import Config
+from testdriver_proxy.metrics import MAX_MODELS, OTHER_MODEL, Counter, Histogram, Metrics
+from testdriver_proxy.proxy import create_app
+
+
+@pytest.fixture
+def config():
+    """Test configuration"""
+    return Config(zai_api_key="test-key", http2=False, log_requests=False)
+
+
+
+def sample(text, name):
+    """Value of one sample line in a text exposition"""
+    for line in text.splitlines():
+        if line.startswith(name + " "):
+            return float(line.rsplit(" ", 1)[1])
+    raise AssertionError(f"{name} not found in:\n{text}")
+
+
+class TestPrimitives:
+    """Test counters and histograms"""
+    
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram("latency_seconds", "Latency", (0.1, 1.0), ("route",))
+        for value in (0.05, 0.1, 0.5, 5.0):
+            histogram.observe(value, ("a",))
+        
+        lines = list(histogram.samples(histogram.series))
+        
+        assert [(name, labels, value) for name, labels, _, value in lines] == [
+            ("latency_seconds_bucket", ("a", "0.1"), 2),
+            ("latency_seconds_bucket", ("a", "1"), 3),
+            ("latency_seconds_bucket", ("a", "+Inf"), 4),
+            ("latency_seconds_sum", ("a",), pytest.approx(5.65)),
+            ("latency_seconds_count", ("a",), 4),
+        ]
+    
+    def test_merge(self):
+        assert Counter.merge(2.0, 3.0) == 5.0
+        assert Histogram.merge([1, 0, 2.5], [0, 1, 4.0]) == [1, 1, 6.5]
+
+
+class TestMetrics:
+    """Test the metrics registry"""
+    
+    def test_render_format(self, config):
+        metrics = Metrics(config)
+        metrics.requests.inc(("glm-4.5", "false", "200"))
+        metrics.requests.inc(("say \"hi\"\n", "false", "200"))
+        
+        text = metrics.render()
+        
+        assert "# TYPE testdriver_proxy_requests_total counter" in text
+        assert 'testdriver_proxy_requests_total{model="glm-4.5",stream="false",status="200"} 1' in text
+        assert 'model="say \\"hi\\"\\n"' in text
+        assert "testdriver_proxy_requests_in_flight 0" in text
+    
+    def test_model_labels_are_bounded(self, config):
+        metrics = Metrics(config)
+        labels = {metrics.model_label(f"model-{i}") for i in range(MAX_MODELS + 5)}
+        assert len(labels) == MAX_MODELS + 1
+        assert OTHER_MODEL in labels
+        assert metrics.model_label("model-0") == "model-0"
+    
+    @pytest.mark.asyncio
+    async def test_tracker(self, config):
+        metrics = Metrics(config)
+        tracker = metrics.track("glm-4.5", True, request_size=300)
+        
+        async def frames():
+            yield 'data: {"choices":[{"index":0,"delta":{"role":"assistant","content":""}}]}\n\n'
+            yield 'data: {"choices":[{"index":0,"delta":{"content":"Hi"}}]}\n\n'
+            await tracker.complete(Completion("id", "Hi", "stop", prompt_tokens=12, completion_tokens=3))
+        
+        assert metrics.in_flight.series[()] == 1
+        sent = [frame async for frame in tracker.frames(frames())]
+        
+        assert metrics.in_flight.series[()] == 0
+        assert metrics.requests.series == {("glm-4.5", "true", "200"): 1}
+        assert metrics.tokens.series[("glm-4.5", "completion")] == 3
+        assert sum(metrics.time_to_first_token.series[("glm-4.5",)][:-1]) == 1
+        assert sum(metrics.output_tokens_per_second.series[("glm-4.5", "true")][:-1]) == 1
+        assert metrics.response_size.series[("true",)][-1] == sum(len(f) for f in sent)
+        assert metrics.request_size.series[()][-1] == 300
+        
+        tracker.finish(500)  # Only the first outcome counts
+        assert metrics.requests.series == {("glm-4.5", "true", "200"): 1}
+    
+    @pytest.mark.asyncio
+    async def test_workers_share_snapshots(self, tmp_path):
+        config = Config(state_dir=str(tmp_path))
+        metrics = Metrics(config)
+        metrics.requests.inc(("glm-4.5", "false", "200"), 2)
+        metrics.in_flight.set(1)
+        
+        exited = {
+            "pid": 2 ** 22 + 1,  # Above the highest possible Linux pid
+            "series": {
+                "testdriver_proxy_requests_total": [[["glm-4.5", "false", "200"], 5]],
+                "testdriver_proxy_requests_in_flight": [[[], 7]],
+            },
+        }
+        (tmp_path / "metrics").mkdir()
+        (tmp_path / "metrics" / "worker-1.json").write_text(json.dumps(exited))
+        metrics.write_snapshot()
+        
+        text = await metrics.exposition()
+        
+        assert os.path.exists(metrics.snapshot_path)
+        assert sample(text, 'testdriver_proxy_requests_total{model="glm-4.5",stream="false",status="200"}') == 7
+        assert sample(text, "testdriver_proxy_requests_in_flight") == 1
+    
+    @pytest.mark.asyncio
+    async def test_exited_workers_are_folded(self, tmp_path):
+        metrics = Metrics(Config(state_dir=str(tmp_path)))
+        metrics.requests.inc(("glm-4.5", "false", "200"), 2)
+        directory = tmp_path / "metrics"
+        directory.mkdir()
+        for pid, requests in ((2 ** 22 + 1, 5), (2 ** 22 + 2, 3)):
+            (directory / f"worker-{pid}.json").write_text(json.dumps({
+                "pid": pid,
+                "series": {
+                    "testdriver_proxy_requests_total": [[["glm-4.5", "false", "200"], requests]],
+                    "testdriver_proxy_request_size_bytes": [[[], [1] + [0] * 10 + [100]]],
+                    "testdriver_proxy_requests_in_flight": [[[], 7]],
+                },
+            }))
+        
+        first = await metrics.exposition()
+        second = await metrics.exposition()
+        
+        assert sorted(os.listdir(directory)) == ["exited.json", "lock"]
+        exited = json.loads((directory / "exited.json").read_text())["series"]
+        assert "testdriver_proxy_requests_in_flight" not in exited
+        for text in (first, second):
+            assert sample(text, 'testdriver_proxy_requests_total{model="glm-4.5",stream="false",status="200"}') == 10
+            assert sample(text, "testdriver_proxy_request_size_bytes_count") == 2
+            assert sample(text, "testdriver_proxy_request_size_bytes_sum") == 200
+            assert sample(text, "testdriver_proxy_requests_in_flight") == 0
+
+
+class TestMetricsEndpoint:
+    """Test the /metrics endpoint"""
+    
+    def test_records_requests(self, config, upstream_transport):
+        client = TestClient(create_app(config, upstream_transport()))
+        body = {"model": "glm-4.5", "messages": [{"role": "user", "content": "Hello"}]}
+        
+        assert client.post("/v1/chat/completions", json=body).status_code == 200
+        with client.stream("POST", "/v1/chat/completions", json={**body, "stream": True}) as response:
+            response.read()
+        
+        response = client.get("/metrics")
+        text = response.text
+        
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        assert sample(text, 'testdriver_proxy_requests_total{model="glm-4.5",stream="false",status="200"}') == 1
+        assert sample(text, 'testdriver_proxy_requests_total{model="glm-4.5",stream="true",status="200"}') == 1
+        assert sample(text, 'testdriver_proxy_tokens_total{model="glm-4.5",type="prompt"}') == 24
+        assert sample(text, 'testdriver_proxy_time_to_first_token_seconds_count{model="glm-4.5"}') == 1
+        assert sample(text, 'testdriver_proxy_upstream_ttfb_seconds_count{status="200"}') == 2
+        assert sample(text, "testdriver_proxy_request_size_bytes_count") == 2
+        assert sample(text, "testdriver_proxy_requests_in_flight") == 0
+        assert sample(text, 'testdriver_proxy_upstream_connections{state="active"}') == 0
+    
+    def test_records_errors(self, config):
+        transport = httpx.MockTransport(lambda request: httpx.Response(400, json={"error": "bad"}))
+        client = TestClient(create_app(config, transport))
+        body = {"model": "glm-4.5", "messages": [{"role": "user", "content": "Hello"}]}
+        
+        status = client.post("/v1/chat/completions", json=body).status_code
+        
+        text = client.get("/metrics").text
+        labels = f'model="glm-4.5",stream="false",status="{status}"'
+        assert status >= 400
+        assert sample(text, f"testdriver_proxy_requests_total{{{labels}}}") == 1
+        assert sample(text, 'testdriver_proxy_upstream_ttfb_seconds_count{status="400"}') == 1
@@ -0,0 +1,94 @@
+"""
+Tests for upstream connection pool
+"""
+
+import pytest
+from fastapi.testclient import TestClient
+from testdriver_proxy.config import Config
+from testdriver_proxy.pool import UpstreamPool
+from testdriver_proxy.proxy import create_app
+
+
+@pytest.fixture
+def config():
+    """Test configuration"""
+    return Config(
+        pool_max_connections=8,
+        pool_max_keepalive=4,
+        pool_keepalive_expiry=15.0,
+        http2=False,
+        log_requests=False,
+    )
+
+
+class TestUpstreamPool:
+    """Test UpstreamPool class"""
+    
+    def test_limits_from_config(self, config):
+        """Test pool limits follow configuration"""
+        pool = UpstreamPool(config)
+        
+        assert pool.limits.max_connections == 8
+        assert pool.limits.max_keepalive_connections == 4
+        assert pool.limits.keepalive_expiry == 15.0
+        assert pool.http2 is False
+    
+    def test_lazy_open(self, config):
+        """Test client is opened on first use"""
+        pool = UpstreamPool(config)
+        assert pool.is_open is False
+        
+        client = pool.client
+        assert client is not None
+        assert pool.is_open is True
+        assert pool.client is client
+    
+    @pytest.mark.asyncio
+    async def test_close(self, config):
+        """Test closing releases the client"""
+        pool = UpstreamPool(config)
+        pool.open()
+        await pool.aclose()
+        
+        assert pool.is_open is False
+        await pool.aclose()  # Closing twice is a no-op
+    
+    @pytest.mark.asyncio
+    async def test_track_counts_in_flight(self, config):
+        """Test in-flight accounting"""
+        pool = UpstreamPool(config)
+        
+        async with pool.track():
+            stats = pool.stats()
+            assert stats["in_flight"] == 1
+        
+        stats = pool.stats()
+        assert stats["in_flight"] == 0
+        assert stats["requests_total"] == 1
+        await pool.aclose()
+    
+    def test_stats_shape(self, config):
+        """Test stats before the pool is opened"""
+        stats = UpstreamPool(config).stats()
+        
+        assert stats["open"] is False
+        assert stats["max_connections"] == 8
+        assert stats["connections"] == 0
+        assert stats["idle_connections"] == 0
+
+
+class TestPoolLifespan:
+    """Test pool lifecycle within the application"""
+    
+    def test_lifespan_opens_and_closes_pool(self, config):
+        """Test pool follows the application lifespan"""
+        app = create_app(config)
+        pool = app.state.proxy.pool
+        
+        with TestClient(app) as client:
+            assert pool.is_open is True
+            response = client.get("/stats")
+            assert response.status_code == 200
+            assert response.json()["pool"]["max_connections"] == 8
+        
+        assert pool.is_open is False
@@ -0,0 +1,174 @@
+"""
+Tests for automatic prompt-cache breakpoints
+"""
+
+import json
+import pytest
+import httpx
+from fastapi.testclient import TestClient
+from testdriver_proxy.config import Config
+from testdriver_proxy.models import ChatCompletionRequest
+from testdriver_proxy.promptcache import EPHEMERAL, PromptCache, stable_prefix_end
+from testdriver_proxy.proxy import ZAIProxy, create_app
+
+SYSTEM = "You are a test agent. " * 400
+SCREENSHOT = {"type": "image_url", "image_url": {"url": "data:image/png;base64,iVBORw0KGgo="}}
+
+
+@pytest.fixture
+def config():
+    """Test configuration caching the system prompt and history"""
+    return Config(
+        zai_api_key="test-key",
+        http2=False,
+        log_requests=False,
+        prompt_cache_strategy="history",
+    )
+
+
+def agent_request(turns=2, system=SYSTEM):
+    """An agent session: one exchange per earlier step, then a screenshot"""
+    messages = [{"role": "system", "content": system}]
+    for step in range(turns - 1):
+        messages.append({"role": "user", "content": [{"type": "text", "text": f"Step {step}"}, SCREENSHOT]})
+        messages.append({"role": "assistant", "content": f"click {step}"})
+    messages.append({"role": "user", "content": [{"type": "text", "text": "Next step"}, SCREENSHOT]})
+    return ChatCompletionRequest.model_validate({"model": "glm-4.5v", "messages": messages, "temperature": 1.0})
+
+
+def breakpoints(zai_request):
+    contents = [zai_request.get("system")] + [message["content"] for message in zai_request["messages"]]
+    return [
+        (index, block.get("text"))
+        for index, content in enumerate(contents)
+        if isinstance(content, list)
+        for block in content
+        if block.get("cache_control") == EPHEMERAL
+    ]
+
+
+class TestPromptCache:
+    """Test PromptCache class"""
+    
+    def test_stable_prefix_end(self):
+        def roles(*names):
+            return [{"role": name} for name in names]
+        
+        assert stable_prefix_end(roles("user")) is None
+        assert stable_prefix_end(roles("user", "assistant", "user")) == 1
+        assert stable_prefix_end(roles("user", "assistant", "user", "assistant")) == 1
+    
+    @pytest.mark.asyncio
+    async def test_history_strategy(self, config):
+        request = agent_request(turns=3)
+        
+        zai_request = await ZAIProxy(config).transform_request(request)
+        
+        # The system prompt, and the reply ending the previous step
+        assert breakpoints(zai_request) == [(0, SYSTEM), (4, "click 1")]
+        assert zai_request["messages"][3]["content"] == [{"type": "text", "text": "click 1", "cache_control": EPHEMERAL}]
+        assert zai_request["messages"][4]["content"][0] == {"type": "text", "text": "Next step"}
+        # Client parts are copied, not marked
+        assert "cache_control" not in request.messages[1].content[0]
+    
+    @pytest.mark.asyncio
+    async def test_system_strategy(self, config):
+        config.prompt_cache_strategy = "system"
+        
+        zai_request = await ZAIProxy(config).transform_request(agent_request(turns=3))
+        
+        assert breakpoints(zai_request) == [(0, SYSTEM)]
+    
+    @pytest.mark.asyncio
+    async def test_short_prefixes_are_not_marked(self, config):
+        proxy = ZAIProxy(config)
+        
+        first = await proxy.transform_request(agent_request(turns=1, system="Be brief"))
+        later = await proxy.transform_request(agent_request(turns=2, system="Be brief"))
+        
+        assert breakpoints(first) == []
+        # Screenshots in the history count towards the minimum
+        assert breakpoints(later) == [(2, "click 0")]
+        assert later["system"] == "Be brief"
+    
+    @pytest.mark.asyncio
+    async def test_client_breakpoints_are_kept(self, config):
+        request = agent_request()
+        request.messages[1].content[0]["cache_control"] = EPHEMERAL
+        proxy = ZAIProxy(config)
+        
+        zai_request = await proxy.transform_request(request)
+        
+        assert breakpoints(zai_request) == [(1, "Step 0")]
+        assert proxy.prompt_cache.stats()["client_managed"] == 1
+    
+    def test_off(self):
+        zai_request = {"system": SYSTEM, "messages": [{"role": "user", "content": "Hi"}]}
+        
+        assert PromptCache(Config()).apply(zai_request) == 0
+        assert zai_request["system"] == SYSTEM
+
+
+class TestProxyPromptCache:
+    """Test prompt caching of chat completions"""
+    
+    def test_cache_usage_is_reported(self, config):
+        bodies = []
+        
+        def handler(request):
+            bodies.append(json.loads(request.content))
+            return httpx.Response(200, json={
+                "id": "msg_1",
+                "content": [{"type": "text", "text": "click 2"}],
+                "stop_reason": "end_turn",
+                "usage": {
+                    "input_tokens": 20,
+                    "output_tokens": 3,
+                    "cache_read_input_tokens": 2000,
+                    "cache_creation_input_tokens": 500,
+                },
+            })
+        
+        with TestClient(create_app(config, httpx.MockTransport(handler))) as client:
+            response = client.post("/v1/chat/completions", json=agent_request(turns=2).model_dump())
+            stats = client.get("/stats").json()["prompt_cache"]
+            metrics = client.get("/metrics").text
+        
+        assert bodies[0]["system"][0]["cache_control"] == EPHEMERAL
+        assert response.json()["usage"] == {
+            "prompt_tokens": 2520,
+            "completion_tokens": 3,
+            "total_tokens": 2523,
+            "prompt_tokens_details": {"cached_tokens": 2000, "cache_write_tokens": 500},
+        }
+        assert stats == {"strategy": "history", "requests": 1, "breakpoints": 2, "client_managed": 0}
+        assert 'testdriver_proxy_tokens_total{model="glm-4.5v",type="cache_read"} 2000' in metrics
+    
+    def test_streamed_cache_usage(self, config):
+        events = [
+            ("message_start", {"type": "message_start", "message": {"id": "msg_1", "usage": {
+                "input_tokens": 20, "output_tokens": 1, "cache_read_input_tokens": 2000,
+            }}}),
+            ("content_block_start", {"type": "content_block_start", "index": 0,
+                                     "content_block": {"type": "text", "text": ""}}),
+            ("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                     "delta": {"type": "text_delta", "text": "click"}}),
+            ("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn"},
+                               "usage": {"output_tokens": 3}}),
+            ("message_stop", {"type": "message_stop"}),
+        ]
+        body = "".join(f"event: {name}\ndata: {json.dumps(data)}\n\n" for name, data in events)
+        
+        def handler(request):
+            return httpx.Response(200, content=body.encode(), headers={"content-type": "text/event-stream"})
+        
+        app = create_app(config, httpx.MockTransport(handler))
+        with TestClient(app) as client:
+            with client.stream(
+                "POST", "/v1/chat/completions", json={**agent_request().model_dump(), "stream": True}
+            ) as response:
+                response.read()
+            metrics = client.get("/metrics").text
+        
+        assert 'testdriver_proxy_tokens_total{model="glm-4.5v",type="prompt"} 2020' in metrics
+        assert 'testdriver_proxy_tokens_total{model="glm-4.5v",type="cache_read"} 2000' in metrics
@@ -2,11 +2,14 @@
 Tests for proxy server
 """
 
+import asyncio
 import pytest
 import json
+import httpx
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
 from unittest.mock import AsyncMock, patch, MagicMock
-from testdriver_proxy.proxy import create_app, ZAIProxy
+from testdriver_proxy.proxy import ClientDisconnected, create_app, ZAIProxy
 from testdriver_proxy.config import Config
 from testdriver_proxy.models import ChatCompletionRequest, Message
 
@@ -229,8 +232,8 @@ class TestStreamingResponse:
     def test_streaming_enabled(self, mock_client_class, client):
         """Test streaming response request"""
         # Mock streaming response
-        async def mock_aiter_lines():
-            yield "data: " + json.dumps({
+        async def mock_aiter_bytes():
+            yield b"data: " + json.dumps({
                 "id": "chatcmpl-test",
                 "created": 123456,
                 "choices": [{
@@ -238,11 +241,11 @@ class TestStreamingResponse:
                     "delta": {"content": "Hello"},
                     "finish_reason": None,
                 }],
-            })
-            yield "data: [DONE]"
+            }).encode() + b"\n\n"
+            yield b"data: [DONE]\n\n"
         
         mock_response = MagicMock()
-        mock_response.aiter_lines = mock_aiter_lines
+        mock_response.aiter_bytes = mock_aiter_bytes
         mock_response.raise_for_status = MagicMock()
         
         mock_stream_context = MagicMock()
@@ -305,3 +308,175 @@ class TestMultimodalSupport:
         data = response.json()
         assert data["model"] == "glm-4.5v"
 
+
+
+def anthropic_message(text):
+    """Anthropic Messages API response body"""
+    return {
+        "id": "msg_1",
+        "content": [{"type": "text", "text": text}],
+        "stop_reason": "end_turn",
+        "usage": {"input_tokens": 10, "output_tokens": 2},
+    }
+
+
+def anthropic_events(text):
+    """Anthropic Messages SSE stream"""
+    events = [
+        {"type": "message_start", "message": {"usage": {"input_tokens": 10}}},
+        {"type": "content_block_start", "index": 0},
+        {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": text}},
+        {"type": "message_delta", "delta": {"stop_reason": "end_turn"}, "usage": {"output_tokens": 2}},
+        {"type": "message_stop"},
+    ]
+    return "".join(f"event: {e['type']}\ndata: {json.dumps(e)}\n\n" for e in events)
+
+
+class TestMultipleChoices:
+    """Test n > 1 fanned out to concurrent upstream calls"""
+    
+    def test_non_streaming_choices(self, config):
+        calls = []
+        
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(200, json=anthropic_message(f"answer {len(calls)}"))
+        
+        client = TestClient(create_app(config, httpx.MockTransport(handler)))
+        response = client.post("/v1/chat/completions", json={
+            "model": "glm-4.5", "n": 3, "temperature": 0, "messages": [{"role": "user", "content": "Hi"}],
+        })
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert len(calls) == 3
+        assert [choice["index"] for choice in data["choices"]] == [0, 1, 2]
+        assert {choice["message"]["content"] for choice in data["choices"]} == {
+            "answer 1", "answer 2", "answer 3"
+        }
+        assert data["usage"] == {"prompt_tokens": 30, "completion_tokens": 6, "total_tokens": 36}
+    
+    def test_streaming_choices(self, config):
+        def handler(request):
+            return httpx.Response(200, text=anthropic_events("Hello"))
+        
+        client = TestClient(create_app(config, httpx.MockTransport(handler)))
+        with client.stream("POST", "/v1/chat/completions", json={
+            "model": "glm-4.5", "n": 2, "stream": True, "messages": [{"role": "user", "content": "Hi"}],
+        }) as response:
+            frames = [frame for frame in response.read().decode().split("\n\n") if frame]
+        
+        assert frames.count("data: [DONE]") == 1
+        assert frames[-1] == "data: [DONE]"
+        chunks = [json.loads(frame[6:]) for frame in frames[:-1]]
+        assert len({chunk["id"] for chunk in chunks}) == 1
+        for index in (0, 1):
+            deltas = [chunk["choices"][0] for chunk in chunks if chunk["choices"][0]["index"] == index]
+            assert "".join(delta["delta"].get("content", "") for delta in deltas) == "Hello"
+            assert deltas[-1]["finish_reason"] == "stop"
+    
+    def test_too_many_choices(self, config):
+        calls = []
+        
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(200, json=anthropic_message("Hi"))
+        
+        client = TestClient(create_app(config, httpx.MockTransport(handler)))
+        for n in (0, config.max_choices + 1):
+            response = client.post("/v1/chat/completions", json={
+                "model": "glm-4.5", "n": n, "messages": [{"role": "user", "content": "Hi"}],
+            })
+            assert response.status_code == 400
+            assert response.json()["error"]["code"] == "invalid_n"
+        assert calls == []
+    
+    @pytest.mark.asyncio
+    async def test_failure_cancels_siblings(self, config):
+        calls = 0
+        cancelled = 0
+        
+        async def handler(request):
+            nonlocal calls, cancelled
+            calls += 1
+            if calls == 1:
+                return httpx.Response(400, json={"type": "error"})
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled += 1
+                raise
+            return httpx.Response(200, json=anthropic_message("late"))
+        
+        proxy = ZAIProxy(config, transport=httpx.MockTransport(handler))
+        request = ChatCompletionRequest(
+            model="glm-4.5", n=3, messages=[Message(role="user", content="Hi")]
+        )
+        
+        with pytest.raises(HTTPException):
+            await asyncio.wait_for(proxy.chat_completion(request), timeout=2)
+        await asyncio.sleep(0)
+        
+        assert calls == 3
+        assert cancelled == 2
+        await proxy.aclose()
+    
+    @pytest.mark.asyncio
+    async def test_disconnect_cancels_siblings(self, config, monkeypatch):
+        monkeypatch.setattr("testdriver_proxy.proxy.DISCONNECT_POLL_INTERVAL", 0.01)
+        cancelled = 0
+        checks = []
+        
+        async def handler(request):
+            nonlocal cancelled
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled += 1
+                raise
+            return httpx.Response(200, json=anthropic_message("late"))
+        
+        async def disconnected():
+            checks.append(1)
+            return len(checks) >= 3
+        
+        proxy = ZAIProxy(config, transport=httpx.MockTransport(handler))
+        request = ChatCompletionRequest(
+            model="glm-4.5", n=2, messages=[Message(role="user", content="Hi")]
+        )
+        
+        with pytest.raises(ClientDisconnected):
+            await asyncio.wait_for(proxy.chat_completion(request, disconnected=disconnected), timeout=2)
+        await asyncio.sleep(0)
+        
+        assert len(checks) == 3
+        assert cancelled == 2
+        await proxy.aclose()
+    
+    @pytest.mark.asyncio
+    async def test_closing_stream_cancels_siblings(self, config):
+        closed = 0
+        
+        async def body():
+            nonlocal closed
+            try:
+                yield anthropic_events("Hello").split("event: message_delta")[0].encode()
+                await asyncio.sleep(10)
+            finally:
+                closed += 1
+        
+        def handler(request):
+            return httpx.Response(200, content=body())
+        
+        proxy = ZAIProxy(config, transport=httpx.MockTransport(handler))
+        request = ChatCompletionRequest(
+            model="glm-4.5", n=2, stream=True, messages=[Message(role="user", content="Hi")]
+        )
+        
+        stream = await proxy.chat_completion(request)
+        first = await asyncio.wait_for(stream.__anext__(), timeout=2)
+        await asyncio.wait_for(stream.aclose(), timeout=2)
+        
+        assert first.startswith("data: ")
+        assert closed == 2
+        await proxy.aclose()
@@ -0,0 +1,212 @@
+"""
+Tests for per-client quotas
+"""
+
+import pytest
+from fastapi.testclient import TestClient
+from testdriver_proxy.cache import Completion
+from testdriver_proxy.config import Config
+from testdriver_proxy.models import ChatCompletionRequest, Message
+from testdriver_proxy.proxy import create_app
+from testdriver_proxy.quota import (
+    IMAGE_TOKENS,
+    MemoryBuckets,
+    QuotaExceeded,
+    QuotaManager,
+    SQLiteBuckets,
+    take,
+)
+
+
+@pytest.fixture
+def config():
+    """Test configuration with quotas enabled"""
+    return Config(
+        zai_api_key="test-key",
+        http2=False,
+        log_requests=False,
+        quota_requests_per_minute=60,
+        quota_tokens_per_minute=1000,
+    )
+
+
+def make_request(content="Hello", **kwargs):
+    return ChatCompletionRequest(
+        model="glm-4.5",
+        messages=[Message(role="user", content=content)],
+        **{"max_tokens": 100, **kwargs},
+    )
+
+
+
+class TestTake:
+    """Test the token bucket arithmetic"""
+    
+    def test_new_client_starts_full(self):
+        state, wait = take(None, now=0, rpm=60, tpm=1000, cost=100)
+        assert wait == 0
+        assert state == (59, 900, 0)
+    
+    def test_rejects_until_refilled(self):
+        state = (0.0, 1000.0, 0.0)
+        _, wait = take(state, now=0, rpm=60, tpm=1000, cost=1)
+        assert wait == pytest.approx(1.0)
+        
+        _, wait = take(state, now=1.0, rpm=60, tpm=1000, cost=1)
+        assert wait == 0
+    
+    def test_token_bucket_wait(self):
+        _, wait = take((10.0, 100.0, 0.0), now=0, rpm=60, tpm=600, cost=200)
+        assert wait == pytest.approx(10.0)  # 100 missing tokens at 10/s
+    
+    def test_cost_above_capacity_passes_when_full(self):
+        state, wait = take(None, now=0, rpm=0, tpm=1000, cost=5000)
+        assert wait == 0
+        assert state[1] == -4000
+    
+    def test_disabled_bucket(self):
+        _, wait = take((0.0, 0.0, 0.0), now=0, rpm=0, tpm=1000, cost=10)
+        assert wait == pytest.approx(0.6)
+        _, wait = take((0.0, 0.0, 0.0), now=0, rpm=60, tpm=0, cost=10)
+        assert wait == pytest.approx(1.0)
+
+
+class TestBuckets:
+    """Test bucket stores"""
+    
+    def test_adjust_is_capped(self):
+        buckets = MemoryBuckets()
+        buckets.take("a", 0, 60, 1000, 100)
+        buckets.adjust("a", 0, 1000, 5000)
+        assert buckets._state["a"][1] == 1000
+        buckets.adjust("missing", 0, 1000, 10)
+        assert len(buckets) == 1
+    
+    def test_prune_drops_refilled_clients(self, monkeypatch):
+        monkeypatch.setattr(MemoryBuckets, "MAX_CLIENTS", 2)
+        buckets = MemoryBuckets()
+        buckets.take("a", 0, 60, 1000, 100)
+        buckets.take("b", 0, 60, 1000, 100)
+        buckets.take("c", 120, 60, 1000, 100)
+        assert set(buckets._state) == {"c"}
+    
+    def test_sqlite_shared_between_workers(self, tmp_path):
+        path = str(tmp_path / "quotas.sqlite3")
+        first, second = SQLiteBuckets(path), SQLiteBuckets(path)
+        
+        first.take("a", 0, 2, 0, 0)
+        second.take("a", 0, 2, 0, 0)
+        _, wait = first.take("a", 0, 2, 0, 0)
+        
+        assert wait > 0
+        assert len(second) == 1
+        first.close()
+        second.close()
+
+
+class TestQuotaManager:
+    """Test QuotaManager"""
+    
+    def test_disabled_by_default(self):
+        assert QuotaManager(Config()).enabled is False
+    
+    def test_client_key(self, config):
+        quotas = QuotaManager(config)
+        by_key = quotas.key_for(make_request(), "Bearer sk-1", "10.0.0.1")
+        assert by_key.startswith("key:")
+        assert "sk-1" not in by_key
+        assert by_key != quotas.key_for(make_request(), "Bearer sk-2")
+        assert quotas.key_for(make_request(), None, "10.0.0.1") == "addr:10.0.0.1"
+        
+        # The user field splits a client's bucket, it never replaces the client
+        assert quotas.key_for(make_request(user="suite-1"), "Bearer sk-1") == by_key + "/user:suite-1"
+        assert quotas.key_for(make_request(user="suite-2"), None, "10.0.0.1") == "addr:10.0.0.1/user:suite-2"
+    
+    def test_estimate(self, config):
+        quotas = QuotaManager(config)
+        assert quotas.estimate(make_request("x" * 400)) == 4 + 100 + 100
+        
+        parts = [
+            {"type": "text", "text": "y" * 40},
+            {"type": "image_url", "image_url": {"url": "data:image/png;base64,AAAA"}},
+        ]
+        request = make_request(parts, max_tokens=None)
+        assert quotas.estimate(request) == 4 + 10 + IMAGE_TOKENS + config.max_tokens
+    
+    @pytest.mark.asyncio
+    async def test_settle_corrects_estimate(self, config):
+        quotas = QuotaManager(config)
+        reservation = await quotas.reserve("c", make_request())
+        assert reservation.remaining == {"requests": 59, "tokens": 895}
+        
+        await reservation.settle(Completion("id", "Hi", "stop", prompt_tokens=20, completion_tokens=30))
+        await reservation.settle(None)  # Only the first settlement counts
+        
+        assert quotas.buckets._state["c"][1] == pytest.approx(950, abs=1)
+    
+    @pytest.mark.asyncio
+    async def test_failed_request_refunds_tokens(self, config):
+        quotas = QuotaManager(config)
+        reservation = await quotas.reserve("c", make_request())
+        await reservation.settle(None)
+        assert quotas.buckets._state["c"][1] == pytest.approx(1000, abs=1)
+    
+    @pytest.mark.asyncio
+    async def test_exceeded(self, config):
+        config.quota_requests_per_minute = 1
+        quotas = QuotaManager(config)
+        await quotas.reserve("c", make_request())
+        
+        with pytest.raises(QuotaExceeded) as exc:
+            await quotas.reserve("c", make_request())
+        assert exc.value.retry_after == 60
+        assert (await quotas.stats())["rejected"] == 1
+        await quotas.reserve("other", make_request())
+        assert (await quotas.stats())["clients"] == 2
+
+
+class TestQuotaEndpoint:
+    """Test quotas on the chat completions endpoint"""
+    
+    def test_rejects_with_rate_limit_headers(self, config, upstream_transport):
+        config.quota_requests_per_minute = 2
+        app = create_app(config, upstream_transport(input_tokens=10, output_tokens=5))
+        body = {
+            "model": "glm-4.5",
+            "max_tokens": 10,
+            "messages": [{"role": "user", "content": "Hi"}],
+            "user": "suite",
+        }
+        
+        with TestClient(app) as client:
+            responses = [client.post("/v1/chat/completions", json=body) for _ in range(3)]
+            other = client.post("/v1/chat/completions", json={**body, "user": "other"})
+        
+        assert [r.status_code for r in responses] == [200, 200, 429]
+        assert responses[0].headers["x-ratelimit-remaining-requests"] == "1"
+        rejected = responses[2]
+        assert rejected.json()["error"]["code"] == "rate_limit_exceeded"
+        assert int(rejected.headers["retry-after"]) >= 1
+        assert rejected.headers["x-ratelimit-remaining-requests"] == "0"
+        # Another suite of the same client has a bucket of its own
+        assert other.status_code == 200
+    
+    def test_stream_usage_corrects_token_bucket(self, config, upstream_transport):
+        app = create_app(config, upstream_transport(input_tokens=10, output_tokens=5))
+        body = {
+            "model": "glm-4.5",
+            "stream": True,
+            "max_tokens": 500,
+            "messages": [{"role": "user", "content": "Hi"}],
+        }
+        headers = {"Authorization": "Bearer sk-test"}
+        
+        with TestClient(app) as client:
+            first = client.post("/v1/chat/completions", json=body, headers=headers)
+            assert "data: [DONE]" in first.text
+            second = client.post("/v1/chat/completions", json=body, headers=headers)
+        
+        # The first estimate (504 tokens) was replaced by the 15 actually used
+        assert int(first.headers["x-ratelimit-remaining-tokens"]) == 1000 - 504
+        remaining = int(second.headers["x-ratelimit-remaining-tokens"])
+        assert remaining == pytest.approx(1000 - 15 - 504, abs=2)
@@ -0,0 +1,210 @@
+"""
+Tests for upstream retry policy
+"""
+
+import json
+import pytest
+import httpx
+from testdriver_proxy.config import Config
+from testdriver_proxy.models import ChatCompletionRequest, Message
+from testdriver_proxy.proxy import ZAIProxy
+from testdriver_proxy.retry import RetryBudget, RetryPolicy, parse_retry_after
+
+
+@pytest.fixture
+def config():
+    """Test configuration with fast retries"""
+    return Config(
+        zai_api_key="test-key",
+        max_retries=3,
+        retry_base_delay=0.001,
+        retry_max_delay=0.01,
+        http2=False,
+        log_requests=False,
+    )
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Record backoff delays instead of sleeping"""
+    delays = []
+    
+    async def fake_sleep(delay):
+        delays.append(delay)
+    
+    monkeypatch.setattr("testdriver_proxy.retry.asyncio.sleep", fake_sleep)
+    return delays
+
+
+def sequence_transport(responses):
+    """Mock transport replaying responses (or raising exceptions) in order"""
+    calls = []
+    
+    def handler(request):
+        calls.append(request)
+        item = responses[min(len(calls), len(responses)) - 1]
+        if isinstance(item, Exception):
+            raise item
+        return item
+    
+    return httpx.MockTransport(handler), calls
+
+
+class TestRetryBudget:
+    """Test RetryBudget class"""
+    
+    def test_reserve_allows_burst(self):
+        """Test initial reserve can be withdrawn"""
+        budget = RetryBudget(percent=10, reserve=2)
+        assert budget.withdraw() is True
+        assert budget.withdraw() is True
+        assert budget.withdraw() is False
+    
+    def test_deposits_follow_percentage(self):
+        """Test ten requests at 10% earn one retry"""
+        budget = RetryBudget(percent=10, reserve=0)
+        for _ in range(10):
+            budget.deposit()
+        assert budget.withdraw() is True
+        assert budget.withdraw() is False
+
+
+class TestParseRetryAfter:
+    """Test Retry-After parsing"""
+    
+    def test_seconds(self):
+        assert parse_retry_after("2") == 2.0
+        assert parse_retry_after("1.5") == 1.5
+    
+    def test_invalid(self):
+        assert parse_retry_after(None) is None
+        assert parse_retry_after("soon") is None
+    
+    def test_http_date_in_past(self):
+        assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+
+class TestRetryPolicy:
+    """Test RetryPolicy.call"""
+    
+    @pytest.mark.asyncio
+    async def test_retries_transient_status(self, config, sleeps):
+        """Test 503 responses are retried until success"""
+        transport, calls = sequence_transport([
+            httpx.Response(503),
+            httpx.Response(503),
+            httpx.Response(200, json={"ok": True}),
+        ])
+        policy = RetryPolicy(config)
+        
+        async with httpx.AsyncClient(transport=transport) as client:
+            response = await policy.call(lambda: client.post("http://upstream/v1/messages"))
+        
+        assert response.status_code == 200
+        assert len(calls) == 3
+        assert policy.retries == 2
+        assert len(sleeps) == 2
+        assert all(0 <= d <= config.retry_max_delay for d in sleeps)
+    
+    @pytest.mark.asyncio
+    async def test_does_not_retry_client_errors(self, config, sleeps):
+        """Test 400 responses are returned immediately"""
+        transport, calls = sequence_transport([httpx.Response(400)])
+        policy = RetryPolicy(config)
+        
+        async with httpx.AsyncClient(transport=transport) as client:
+            response = await policy.call(lambda: client.post("http://upstream/v1/messages"))
+        
+        assert response.status_code == 400
+        assert len(calls) == 1
+        assert sleeps == []
+    
+    @pytest.mark.asyncio
+    async def test_honors_retry_after(self, config, sleeps):
+        """Test Retry-After overrides the computed backoff"""
+        transport, _ = sequence_transport([
+            httpx.Response(429, headers={"retry-after": "0.005"}),
+            httpx.Response(200),
+        ])
+        policy = RetryPolicy(config)
+        
+        async with httpx.AsyncClient(transport=transport) as client:
+            await policy.call(lambda: client.post("http://upstream/v1/messages"))
+        
+        assert sleeps == [0.005]
+    
+    @pytest.mark.asyncio
+    async def test_gives_up_on_long_retry_after(self, config, sleeps):
+        """Test Retry-After beyond retry_max_delay is passed to the client"""
+        transport, calls = sequence_transport([
+            httpx.Response(429, headers={"retry-after": "60"}),
+        ])
+        policy = RetryPolicy(config)
+        
+        async with httpx.AsyncClient(transport=transport) as client:
+            response = await policy.call(lambda: client.post("http://upstream/v1/messages"))
+        
+        assert response.status_code == 429
+        assert len(calls) == 1
+    
+    @pytest.mark.asyncio
+    async def test_retries_connect_errors(self, config, sleeps):
+        """Test connection errors are retried and re-raised when exhausted"""
+        transport, calls = sequence_transport([httpx.ConnectError("refused")])
+        policy = RetryPolicy(config)
+        
+        async with httpx.AsyncClient(transport=transport) as client:
+            with pytest.raises(httpx.ConnectError):
+                await policy.call(lambda: client.post("http://upstream/v1/messages"))
+        
+        assert len(calls) == config.max_retries + 1
+    
+    @pytest.mark.asyncio
+    async def test_budget_caps_retries(self, config, sleeps):
+        """Test an exhausted budget stops retries"""
+        config.retry_budget_percent = 0
+        config.retry_budget_reserve = 1
+        transport, calls = sequence_transport([httpx.Response(503)])
+        policy = RetryPolicy(config)
+        
+        async with httpx.AsyncClient(transport=transport) as client:
+            response = await policy.call(lambda: client.post("http://upstream/v1/messages"))
+        
+        assert response.status_code == 503
+        assert len(calls) == 2
+        assert policy.budget_exhausted == 1
+
+
+class TestStreamRetry:
+    """Test retries on the streaming path"""
+    
+    @pytest.mark.asyncio
+    async def test_retries_before_first_byte(self, config, monkeypatch):
+        """Test a stream is retried when the upstream fails before emitting"""
+        async def fake_sleep(delay):
+            pass
+        
+        monkeypatch.setattr("testdriver_proxy.proxy.asyncio.sleep", fake_sleep)
+        events = [
+            {"type": "content_block_start"},
+            {"type": "content_block_delta", "delta": {"type": "text_delta", "text": "Hi"}},
+        ]
+        body = "".join(f"data: {json.dumps(e)}\n\n" for e in events) + "data: [DONE]\n\n"
+        transport, calls = sequence_transport([
+            httpx.Response(502),
+            httpx.Response(200, text=body, headers={"content-type": "text/event-stream"}),
+        ])
+        proxy = ZAIProxy(config, transport=transport)
+        request = ChatCompletionRequest(
+            model="glm-4.5",
+            messages=[Message(role="user", content="Hello")],
+            stream=True,
+        )
+        
+        zai_request = await proxy.transform_request(request)
+        chunks = [c async for c in proxy._stream_response(request, zai_request)]
+        await proxy.aclose()
+        
+        assert len(calls) == 2
+        assert chunks[-1] == "data: [DONE]\n\n"
+        assert '"Hi"' in chunks[1]
@@ -0,0 +1,115 @@
+"""
+Tests for content-aware model routing
+"""
+
+import json
+import pytest
+import httpx
+from fastapi.testclient import TestClient
+from testdriver_proxy.config import Config
+from testdriver_proxy.models import ChatCompletionRequest
+from testdriver_proxy.proxy import create_app
+from testdriver_proxy.routing import ModelRouter, Route, inspect_messages
+
+SCREENSHOT = {"type": "image_url", "image_url": {"url": "data:image/png;base64,iVBORw0KGgo="}}
+
+
+@pytest.fixture
+def config():
+    """Test configuration with routing on"""
+    return Config(
+        zai_api_key="test-key",
+        http2=False,
+        log_requests=False,
+        model_routing_enabled=True,
+        model_aliases={"gpt-4o": "glm-4.5v", "legacy": "glm-4"},
+    )
+
+
+def chat_request(model="glm-4.5v", text="Click the login button", image=False):
+    content = [{"type": "text", "text": text}, SCREENSHOT] if image else text
+    return ChatCompletionRequest.model_validate({
+        "model": model,
+        "messages": [
+            {"role": "system", "content": "You are a test agent"},
+            {"role": "user", "content": content},
+        ],
+    })
+
+
+class TestModelRouter:
+    """Test ModelRouter class"""
+    
+    def test_inspect_messages(self):
+        assert inspect_messages(chat_request(text="abc")) == (False, 20 + 3)
+        assert inspect_messages(chat_request(text="abc", image=True)) == (True, 20 + 3)
+    
+    def test_vision_only_with_images(self, config):
+        router = ModelRouter(config)
+        
+        assert router.route(chat_request(image=True)) == Route("glm-4.5v", "glm-4.5v", "vision")
+        assert router.route(chat_request()) == Route("glm-4.5v", "glm-4.5", "text")
+        assert router.route(chat_request("auto", image=True)).model == "glm-4.5v"
+    
+    def test_aliases(self, config):
+        router = ModelRouter(config)
+        
+        # An alias for a routed model is routed by content too
+        assert router.route(chat_request("gpt-4o")) == Route("gpt-4o", "glm-4.5", "text")
+        assert router.route(chat_request("legacy", image=True)) == Route("legacy", "glm-4", "alias")
+        assert router.route(chat_request("glm-4-plus")) is None
+    
+    def test_prompt_length_and_latency_tier(self, config):
+        config.route_fast_model = "glm-4.5-air"
+        config.route_fast_max_chars = 100
+        config.route_long_prompt_model = "glm-4.5-long"
+        config.route_long_prompt_chars = 1000
+        router = ModelRouter(config)
+        
+        assert router.route(chat_request()).model == "glm-4.5-air"
+        assert router.route(chat_request(text="x" * 500)).model == "glm-4.5"
+        assert router.route(chat_request(text="x" * 2000)) == Route("glm-4.5v", "glm-4.5-long", "long_prompt")
+        assert router.route(chat_request(text="x" * 2000, image=True)).reason == "vision"
+    
+    def test_disabled_keeps_model(self):
+        router = ModelRouter(Config(model_aliases={"gpt-4o": "glm-4.5v"}))
+        
+        assert router.route(chat_request()) is None
+        assert router.route(chat_request("gpt-4o")) == Route("gpt-4o", "glm-4.5v", "alias")
+    
+    def test_apply_shares_messages(self, config):
+        request = chat_request()
+        
+        routed, route = ModelRouter(config).apply(request)
+        
+        assert routed.model == "glm-4.5" and request.model == "glm-4.5v"
+        assert routed.messages is request.messages
+
+
+class TestProxyRouting:
+    """Test routing of chat completions"""
+    
+    def test_text_turn_goes_to_text_model(self, config):
+        models = []
+        
+        def handler(request):
+            models.append(json.loads(request.content)["model"])
+            return httpx.Response(200, json={
+                "id": "msg_1",
+                "content": [{"type": "text", "text": "Done"}],
+                "stop_reason": "end_turn",
+                "usage": {"input_tokens": 5, "output_tokens": 2},
+            })
+        
+        with TestClient(create_app(config, httpx.MockTransport(handler))) as client:
+            text = client.post("/v1/chat/completions", json=chat_request().model_dump())
+            vision = client.post("/v1/chat/completions", json=chat_request(image=True).model_dump())
+            listed = [model["id"] for model in client.get("/v1/models").json()["data"]]
+            metrics = client.get("/metrics").text
+        
+        assert models == ["glm-4.5", "glm-4.5v"]
+        assert text.json()["model"] == "glm-4.5"
+        assert text.headers["x-model-route"] == "glm-4.5; reason=text"
+        assert vision.headers["x-model-route"] == "glm-4.5v; reason=vision"
+        assert {"gpt-4o", "legacy", "auto"} <= set(listed)
+        assert 'testdriver_proxy_model_routes_total{model="glm-4.5",reason="text"} 1' in metrics
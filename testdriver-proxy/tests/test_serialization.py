@@ -0,0 +1,55 @@
+"""
+Tests for response serialization
+"""
+
+import json
+import pytest
+from testdriver_proxy import serialization
+from testdriver_proxy.cache import Completion
+from testdriver_proxy.config import Config
+from testdriver_proxy.models import ChatCompletionRequest, ChatCompletionResponse, Message
+from testdriver_proxy.proxy import ZAIProxy
+from testdriver_proxy.serialization import FastJSONResponse, dumps
+
+
+@pytest.fixture
+def completion():
+    return Completion(
+        id="chatcmpl-1",
+        content="Héllo \"world\"",
+        finish_reason="stop",
+        prompt_tokens=3,
+        completion_tokens=2,
+    )
+
+
+class TestDumps:
+    """Test dumps helper"""
+    
+    def test_compact_output(self):
+        assert json.loads(dumps({"a": [1, "é"]})) == {"a": [1, "é"]}
+        assert b" " not in dumps({"a": 1, "b": 2})
+    
+    def test_stdlib_fallback(self, monkeypatch):
+        monkeypatch.setattr(serialization, "orjson", None)
+        assert dumps({"a": "é"}) == '{"a":"é"}'.encode()
+
+
+class TestFastJSONResponse:
+    """Test FastJSONResponse rendering"""
+    
+    def test_constructed_response_matches_validated(self, completion):
+        proxy = ZAIProxy(Config())
+        request = ChatCompletionRequest(model="glm-4.5", messages=[Message(role="user", content="Hi")])
+        
+        constructed = proxy._build_response(request, completion)
+        validated = ChatCompletionResponse.model_validate(constructed.model_dump())
+        body = FastJSONResponse(content=constructed).body
+        
+        assert json.loads(body) == json.loads(validated.model_dump_json())
+        assert json.loads(body)["usage"]["total_tokens"] == 5
+    
+    def test_renders_plain_data(self):
+        response = FastJSONResponse(content={"status": "healthy"})
+        assert json.loads(response.body) == {"status": "healthy"}
+        assert response.media_type == "application/json"
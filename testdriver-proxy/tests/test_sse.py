@@ -0,0 +1,123 @@
+"""
+Tests for SSE parsing and stream translation
+"""
+
+import json
+from testdriver_proxy.cache import Completion
+from testdriver_proxy.models import ChatCompletionChunk, StreamChoice
+from testdriver_proxy.sse import DONE_FRAME, ChunkEncoder, SSEParser, StreamTranslator
+
+
+def anthropic_stream(text_parts, stop_reason="end_turn"):
+    """Render an Anthropic Messages SSE stream"""
+    events = [
+        {"type": "message_start", "message": {"id": "msg_1", "usage": {"input_tokens": 12}}},
+        {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}},
+        {"type": "ping"},
+    ]
+    events += [
+        {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": t}}
+        for t in text_parts
+    ]
+    events += [
+        {"type": "content_block_stop", "index": 0},
+        {"type": "message_delta", "delta": {"stop_reason": stop_reason}, "usage": {"output_tokens": 4}},
+        {"type": "message_stop"},
+    ]
+    return "".join(f"event: {e['type']}\ndata: {json.dumps(e)}\n\n" for e in events).encode()
+
+
+class TestSSEParser:
+    """Test SSEParser class"""
+    
+    def test_event_and_data_pairs(self):
+        events = SSEParser().feed(b"event: ping\ndata: {}\n\ndata: x\n\n")
+        assert events == [("ping", b"{}"), (None, b"x")]
+    
+    def test_split_across_chunks(self):
+        stream = b"event: a\r\ndata: hello\r\n\r\nevent: b\ndata: world\n\n"
+        for size in (1, 2, 3, 7):
+            parser = SSEParser()
+            events = []
+            for i in range(0, len(stream), size):
+                events += parser.feed(stream[i:i + size])
+            assert events == [("a", b"hello"), ("b", b"world")]
+    
+    def test_multiline_data_and_comments(self):
+        events = SSEParser().feed(b": keep-alive\ndata: one\ndata: two\nid: 7\n\n")
+        assert events == [(None, b"one\ntwo")]
+    
+    def test_flush_trailing_event(self):
+        parser = SSEParser()
+        assert parser.feed(b"data: [DONE]") == []
+        assert parser.flush() == [(None, b"[DONE]")]
+
+
+class TestChunkEncoder:
+    """Test ChunkEncoder output"""
+    
+    def test_matches_pydantic_serialization(self):
+        encoder = ChunkEncoder("chatcmpl-1", "glm-4.5", created=1700000000)
+        for delta, reason in [({"content": "Hé \"quoted\"\n"}, None), ({}, "stop")]:
+            expected = ChatCompletionChunk(
+                id="chatcmpl-1",
+                created=1700000000,
+                model="glm-4.5",
+                choices=[StreamChoice(index=0, delta=delta, finish_reason=reason)],
+            )
+            if "content" in delta:
+                frame = encoder.content(delta["content"])
+            else:
+                frame = encoder.frame("{}", reason)
+            assert frame == f"data: {expected.model_dump_json()}\n\n"
+    
+    def test_choice_index(self):
+        frame = ChunkEncoder("chatcmpl-1", "glm-4.5", index=2).content("Hi")
+        assert json.loads(frame[6:])["choices"][0]["index"] == 2
+    
+    def test_replay(self):
+        completion = Completion(id="chatcmpl-1", content="Hi", finish_reason="length")
+        frames = ChunkEncoder("chatcmpl-1", "glm-4.5").replay(completion)
+        assert frames[-1] == DONE_FRAME
+        assert json.loads(frames[-2][6:])["choices"][0]["finish_reason"] == "length"
+
+
+class TestStreamTranslator:
+    """Test StreamTranslator class"""
+    
+    def translate(self, stream):
+        parser = SSEParser()
+        translator = StreamTranslator("chatcmpl-1", "glm-4.5")
+        frames = [translator.feed(e, d) for e, d in parser.feed(stream)]
+        return translator, [f for f in frames if f is not None]
+    
+    def test_skips_noop_events(self):
+        translator, frames = self.translate(anthropic_stream(["Hel", "lo"]))
+        
+        payloads = [json.loads(f[6:]) for f in frames[:-1]]
+        assert [p["choices"][0]["delta"] for p in payloads] == [
+            {"role": "assistant", "content": ""},
+            {"content": "Hel"},
+            {"content": "lo"},
+            {},
+        ]
+        assert payloads[-1]["choices"][0]["finish_reason"] == "stop"
+        assert frames[-1] == DONE_FRAME
+        assert translator.done is True
+    
+    def test_completion(self):
+        translator, _ = self.translate(anthropic_stream(["a", "b"], stop_reason="max_tokens"))
+        completion = translator.completion()
+        
+        assert completion.content == "ab"
+        assert completion.finish_reason == "length"
+        assert completion.prompt_tokens == 12
+        assert completion.completion_tokens == 4
+    
+    def test_incomplete_stream_has_no_completion(self):
+        translator, _ = self.translate(b"data: {\"type\": \"content_block_start\"}\n\n")
+        assert translator.completion() is None
+    
+    def test_invalid_json_is_skipped(self):
+        translator, frames = self.translate(b"data: {not json\n\n")
+        assert frames == []
@@ -0,0 +1,206 @@
+"""
+Tests for request phase timing and trace export
+"""
+
+import json
+import pytest
+from fastapi.testclient import TestClient
+from testdriver_proxy.config import Config
+from testdriver_proxy.proxy import create_app
+from testdriver_proxy.timing import RequestTiming, TraceExporter, _current, current_timing, phase
+
+
+@pytest.fixture
+def config():
+    """Test configuration with Server-Timing on"""
+    return Config(zai_api_key="test-key", http2=False, log_requests=False, server_timing=True)
+
+
+
+def phases(server_timing):
+    """Phase names in a Server-Timing value"""
+    return [entry.split(";")[0] for entry in server_timing.split(", ")]
+
+
+BODY = {"model": "glm-4.5", "messages": [{"role": "user", "content": "Hello"}]}
+
+
+class TestRequestTiming:
+    """Test span bookkeeping"""
+    
+    def test_phase_is_noop_without_timing(self):
+        assert current_timing() is None
+        assert phase("transform") is phase("decode")
+    
+    def test_server_timing(self):
+        timing = RequestTiming()
+        token = _current.set(timing)
+        try:
+            with phase("transform"):
+                pass
+            with phase("upstream"):
+                pass
+            with phase("upstream"):
+                pass
+            timing.add("translate", 0.002)
+            timing.add("translate", 0.003)
+        finally:
+            _current.reset(token)
+        
+        value = timing.server_timing()
+        
+        assert phases(value) == ["transform", "upstream", "translate", "total"]
+        assert "translate;dur=5.00" in value
+    
+    def test_finish_closes_open_spans(self):
+        timing = RequestTiming()
+        upstream = timing.start("upstream")
+        timing.add("translate", 0.001)
+        timing.finish()
+        
+        assert upstream.end is not None
+        assert upstream.attributes == {"error": True}
+        assert timing.root.attributes == {"translate.duration_ms": 1.0}
+    
+    @pytest.mark.asyncio
+    async def test_httpcore_trace(self):
+        timing = RequestTiming()
+        upstream = timing.start("upstream")
+        trace = timing.httpcore_trace(upstream)
+        for event in (
+            "connection.connect_tcp.started",
+            "connection.connect_tcp.complete",
+            "http11.send_request_headers.started",
+            "http11.send_request_headers.complete",
+            "http11.receive_response_headers.started",
+            "http11.receive_response_headers.complete",
+        ):
+            await trace(event, {})
+        
+        spans = {span.name: span for span in timing.spans}
+        
+        assert set(spans) == {"POST /v1/chat/completions", "upstream", "pool", "connect", "ttfb"}
+        assert all(spans[name].parent is upstream for name in ("pool", "connect", "ttfb"))
+        assert spans["pool"].start == upstream.start
+        assert spans["pool"].end <= spans["connect"].start <= spans["connect"].end <= spans["ttfb"].start
+        assert spans["ttfb"].end is not None
+    
+    @pytest.mark.asyncio
+    async def test_trailer_precedes_done(self):
+        timing = RequestTiming()
+        
+        async def frames():
+            yield 'data: {"choices":[]}\n\n'
+            yield "data: [DONE]\n\n"
+        
+        sent = [frame async for frame in timing.trailer(frames())]
+        
+        assert len(sent) == 3
+        assert sent[1].startswith(": server-timing ")
+        assert sent[2] == "data: [DONE]\n\n"
+
+
+class TestTraceExporter:
+    """Test the JSONL span export"""
+    
+    def test_otlp_shape(self, tmp_path):
+        path = tmp_path / "traces.jsonl"
+        exporter = TraceExporter(Config(trace_export_path=str(path)))
+        timing = RequestTiming()
+        with timing.span("transform"):
+            pass
+        timing.finish()
+        
+        exporter.export(timing)
+        exporter.close()
+        
+        record = json.loads(path.read_text())
+        spans = record["resourceSpans"][0]["scopeSpans"][0]["spans"]
+        root, child = spans
+        assert root["kind"] == 2
+        assert "parentSpanId" not in root
+        assert child["parentSpanId"] == root["spanId"]
+        assert child["traceId"] == root["traceId"] and len(root["traceId"]) == 32
+        assert int(root["startTimeUnixNano"]) <= int(child["startTimeUnixNano"])
+        assert int(child["endTimeUnixNano"]) <= int(root["endTimeUnixNano"])
+    
+    def test_rotation(self, tmp_path):
+        path = tmp_path / "traces.jsonl"
+        exporter = TraceExporter(
+            Config(trace_export_path=str(path), trace_export_max_bytes=1000, trace_export_backups=2)
+        )
+        for _ in range(10):
+            timing = RequestTiming()
+            timing.finish()
+            exporter.export(timing)
+        exporter.close()
+        
+        assert sorted(p.name for p in tmp_path.iterdir()) == [
+            "traces.jsonl", "traces.jsonl.1", "traces.jsonl.2"
+        ]
+        assert all(p.stat().st_size <= 1000 for p in tmp_path.iterdir())
+        assert exporter.exported == 10
+    
+    def test_worker_files(self, tmp_path):
+        exporter = TraceExporter(Config(trace_export_path=str(tmp_path / "traces.jsonl"), workers=2))
+        assert exporter.path.startswith(str(tmp_path / "traces."))
+        assert exporter.path.endswith(".jsonl")
+        assert exporter.path != str(tmp_path / "traces.jsonl")
+
+
+class TestServerTiming:
+    """Test timings on the chat completions endpoint"""
+    
+    def test_header(self, config, upstream_transport):
+        client = TestClient(create_app(config, upstream_transport()))
+        
+        response = client.post("/v1/chat/completions", json=BODY)
+        
+        assert response.status_code == 200
+        names = phases(response.headers["server-timing"])
+        assert names[:2] == ["parse", "transform"]
+        assert {"upstream", "decode", "serialize"} <= set(names)
+        assert names[-1] == "total"
+    
+    def test_stream_trailer(self, config, upstream_transport):
+        client = TestClient(create_app(config, upstream_transport()))
+        
+        with client.stream("POST", "/v1/chat/completions", json={**BODY, "stream": True}) as response:
+            text = response.read().decode()
+        
+        assert "server-timing" not in response.headers
+        comment = next(line for line in text.splitlines() if line.startswith(": server-timing "))
+        assert "translate;dur=" in comment
+        assert "upstream;dur=" in comment
+        assert text.index(": server-timing") < text.index("data: [DONE]")
+    
+    def test_off_by_default(self, upstream_transport):
+        config = Config(zai_api_key="test-key", http2=False, log_requests=False)
+        client = TestClient(create_app(config, upstream_transport()))
+        
+        response = client.post("/v1/chat/completions", json=BODY)
+        
+        assert "server-timing" not in response.headers
+        assert not any(
+            getattr(middleware.cls, "__name__", "") == "TimingMiddleware"
+            for middleware in client.app.user_middleware
+        )
+    
+    def test_trace_export(self, tmp_path, upstream_transport):
+        path = tmp_path / "traces.jsonl"
+        config = Config(zai_api_key="test-key", http2=False, log_requests=False, trace_export_path=str(path))
+        app = create_app(config, upstream_transport())
+        
+        with TestClient(app) as client:
+            response = client.post("/v1/chat/completions", json=BODY)
+            client.get("/health")  # Not traced
+        
+        assert "server-timing" not in response.headers
+        lines = path.read_text().splitlines()
+        assert len(lines) == 1
+        spans = json.loads(lines[0])["resourceSpans"][0]["scopeSpans"][0]["spans"]
+        by_name = {span["name"]: span for span in spans}
+        root = by_name["POST /v1/chat/completions"]
+        assert by_name["upstream"]["parentSpanId"] == root["spanId"]
+        assert by_name["upstream"]["kind"] == 3
+        assert {"key": "http.response.status_code", "value": {"intValue": "200"}} in root["attributes"]
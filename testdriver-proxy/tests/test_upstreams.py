@@ -0,0 +1,189 @@
+"""
+Tests for load balancing across upstream targets
+"""
+
+from collections import Counter
+import pytest
+import httpx
+from fastapi.testclient import TestClient
+from testdriver_proxy.config import Config
+from testdriver_proxy.proxy import create_app
+from testdriver_proxy.upstreams import SLOW_START_FLOOR, UpstreamBalancer
+
+
+@pytest.fixture
+def config():
+    """Test configuration with two upstream accounts"""
+    return Config(
+        zai_api_key="default-key",
+        http2=False,
+        log_requests=False,
+        retry_base_delay=0.001,
+        retry_max_delay=0.01,
+        upstreams=[
+            {"name": "a", "base_url": "http://a.test/v1", "api_key": "key-a"},
+            {"name": "b", "base_url": "http://b.test/v1", "weight": 3},
+        ],
+        upstream_eject_failures=3,
+        upstream_eject_time=30.0,
+        upstream_slow_start=10.0,
+    )
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controllable monotonic clock for ejection timing"""
+    now = [1000.0]
+    monkeypatch.setattr("testdriver_proxy.upstreams.time.monotonic", lambda: now[0])
+    return now
+
+
+def completion(text="Hi"):
+    return httpx.Response(200, json={
+        "id": "msg_1",
+        "content": [{"type": "text", "text": text}],
+        "stop_reason": "end_turn",
+        "usage": {"input_tokens": 5, "output_tokens": 2},
+    })
+
+
+class TestUpstreamBalancer:
+    """Test UpstreamBalancer class"""
+    
+    def test_single_target_from_base_url(self):
+        balancer = UpstreamBalancer(Config(zai_api_key="key", zai_base_url="http://z.test/v1/"))
+        
+        target = balancer.choose()
+        
+        assert len(balancer.targets) == 1
+        assert target.url == "http://z.test/v1/v1/messages"
+        assert target.headers["x-api-key"] == "key"
+    
+    def test_targets_from_config(self, config):
+        a, b = UpstreamBalancer(config).targets
+        
+        assert (a.name, a.headers["x-api-key"], a.weight) == ("a", "key-a", 1.0)
+        assert (b.name, b.headers["x-api-key"], b.weight) == ("b", "default-key", 3.0)
+        assert b.url == "http://b.test/v1/v1/messages"
+    
+    def test_traffic_follows_weights(self, config):
+        balancer = UpstreamBalancer(config)
+        balancer._random.seed(1)
+        
+        picks = Counter(balancer.choose().name for _ in range(2000))
+        
+        # Nothing is outstanding, so every pick is a tie won by the first draw
+        assert 0.2 < picks["a"] / 2000 < 0.3
+    
+    def test_prefers_less_loaded_target(self, config):
+        balancer = UpstreamBalancer(config)
+        a, b = balancer.targets
+        b.outstanding = 30
+        
+        picks = Counter(balancer.choose().name for _ in range(100))
+        
+        assert picks == {"a": 100}
+    
+    def test_ejects_failing_target_and_eases_it_back(self, config, clock):
+        balancer = UpstreamBalancer(config)
+        a, b = balancer.targets
+        
+        for status in (503, 500, 200, 529, 429):
+            a.record(status)
+        assert a.available(clock[0]) is True
+        a.record(None)
+        assert a.available(clock[0]) is False
+        assert {balancer.choose().name for _ in range(50)} == {"b"}
+        
+        clock[0] += 30
+        assert a.available(clock[0]) is True
+        assert a.effective_weight(clock[0]) == pytest.approx(SLOW_START_FLOOR)
+        clock[0] += 5
+        assert a.effective_weight(clock[0]) == pytest.approx(0.5)
+        
+        # Failing again soon after doubles the time out
+        for _ in range(3):
+            a.record(502)
+        assert a.ejected_until == clock[0] + 60
+    
+    def test_every_target_ejected_still_chooses(self, config, clock):
+        balancer = UpstreamBalancer(config)
+        for target in balancer.targets:
+            for _ in range(3):
+                target.record(503)
+        
+        assert balancer.choose() in balancer.targets
+    
+    @pytest.mark.asyncio
+    async def test_call_is_recorded_once(self, config):
+        balancer = UpstreamBalancer(config)
+        a, _ = balancer.targets
+        
+        # A stream that breaks off after its headers were recorded
+        with pytest.raises(httpx.ReadError):
+            async with a.track() as call:
+                call.record(200)
+                raise httpx.ReadError("connection reset")
+        assert a.failures == 0
+        
+        # A transport error before any headers counts as a failure
+        with pytest.raises(httpx.ConnectError):
+            async with a.track():
+                raise httpx.ConnectError("refused")
+        assert a.failures == 1
+        assert a.outstanding == 0
+        await balancer.aclose()
+
+
+class TestProxyBalancing:
+    """Test upstream balancing of chat completions"""
+    
+    def test_failing_target_is_ejected(self, config):
+        hosts = []
+        
+        def handler(request):
+            hosts.append(request.url.host)
+            if request.url.host == "a.test":
+                return httpx.Response(503, json={"type": "error"})
+            assert request.headers["x-api-key"] == "default-key"
+            return completion()
+        
+        app = create_app(config, httpx.MockTransport(handler))
+        app.state.proxy.upstreams._random.seed(0)
+        with TestClient(app) as client:
+            for _ in range(40):
+                response = client.post("/v1/chat/completions", json={
+                    "model": "glm-4.5",
+                    "messages": [{"role": "user", "content": "Hello"}],
+                    "temperature": 1.0,
+                })
+                assert response.status_code == 200
+            stats = {target["name"]: target for target in client.get("/stats").json()["upstreams"]}
+            metrics = client.get("/metrics").text
+        
+        assert hosts.count("a.test") == 3
+        assert stats["a"]["healthy"] is False and stats["a"]["ejections"] == 1
+        assert stats["b"]["healthy"] is True and stats["b"]["failures"] == 0
+        assert 'testdriver_proxy_upstream_healthy{upstream="a"} 0' in metrics
+    
+    def test_transport_errors_count_against_target(self, config):
+        def handler(request):
+            if request.url.host == "a.test":
+                raise httpx.ConnectError("refused")
+            return completion()
+        
+        app = create_app(config, httpx.MockTransport(handler))
+        app.state.proxy.upstreams._random.seed(0)
+        with TestClient(app) as client:
+            for _ in range(40):
+                with client.stream("POST", "/v1/chat/completions", json={
+                    "model": "glm-4.5",
+                    "messages": [{"role": "user", "content": "Hello"}],
+                    "stream": True,
+                    "temperature": 1.0,
+                }) as response:
+                    assert response.status_code == 200
+                    response.read()
+            a = app.state.proxy.upstreams.targets[0]
+        
+        assert a.failures == 3 and a.ejections == 1